@@ -0,0 +1,202 @@
+# A common text-generation interface over the ways this repository runs models:
+# Ollama (D1_Ollama.py), an HF `pipeline` (D2_HF.py, D4_HF_Gemma.py), raw
+# `AutoModelForCausalLM.generate` (D3_HF_DS.py) and the gemma library sampler
+# (TryGemma.py).
+#
+# Every backend takes a chat message list and yields the reply in text pieces
+# as they are produced; after the stream ends, `last_token_count` holds the
+# number of generated tokens. Heavy libraries are only imported by the
+# backend that needs them.
+
+import re
+import threading
+from abc import ABC, abstractmethod
+
+
+def render_prompt(tokenizer, messages):
+    """Applies the tokenizer's chat template, or joins the contents if it has none."""
+    if getattr(tokenizer, "chat_template", None):
+        return tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    return "\n".join(m["content"] for m in messages) + "\n"
+
+
+def default_device():
+    import torch
+
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+class Backend(ABC):
+    """Base class: stream(messages, max_new_tokens) yields text pieces."""
+
+    name = "backend"
+
+    def __init__(self, model):
+        self.model = model
+        self.last_token_count = 0
+
+    @abstractmethod
+    def stream(self, messages, max_new_tokens=256):
+        """Yields the reply to `messages` in text pieces and sets last_token_count."""
+
+    def close(self):
+        pass
+
+
+class OllamaBackend(Backend):
+    """Streams from an Ollama server; token counts come from eval_count."""
+
+    name = "ollama"
+
+    def __init__(self, model, host=None, keep_alive="30m", options=None):
+        import ollama
+
+        super().__init__(model)
+        self.client = ollama.Client(host=host)
+        self.keep_alive = keep_alive
+        self.options = options or {}
+
+    def stream(self, messages, max_new_tokens=256):
+        self.last_token_count = 0
+        pieces = 0
+        for chunk in self.client.chat(
+            model=self.model,
+            messages=messages,
+            stream=True,
+            keep_alive=self.keep_alive,
+            options={**self.options, "num_predict": max_new_tokens},
+        ):
+            text = chunk['message']['content']
+            if text:
+                pieces += 1
+                yield text
+            if chunk.get('done'):
+                self.last_token_count = chunk.get('eval_count') or pieces
+
+
+class _HFStreamingBackend(Backend):
+    """Shared streaming for HF backends: generation runs in a thread feeding a TextIteratorStreamer."""
+
+    @abstractmethod
+    def _generate(self, prompt, streamer, max_new_tokens):
+        """Runs generation for `prompt`, feeding text to `streamer`."""
+
+    def stream(self, messages, max_new_tokens=256):
+        from transformers import TextIteratorStreamer
+
+        prompt = render_prompt(self.tokenizer, messages)
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        errors = []
+
+        def run():
+            try:
+                self._generate(prompt, streamer, max_new_tokens)
+            except Exception as e:
+                errors.append(e)
+                streamer.end()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        pieces = []
+        for text in streamer:
+            if text:
+                pieces.append(text)
+                yield text
+        thread.join()
+        if errors:
+            raise errors[0]
+        self.last_token_count = len(self.tokenizer("".join(pieces), add_special_tokens=False)["input_ids"])
+
+
+class HFPipelineBackend(_HFStreamingBackend):
+    """transformers `pipeline("text-generation")`, as in D2_HF.py and D4_HF_Gemma.py."""
+
+    name = "hf-pipeline"
+
+    def __init__(self, model, device=None, torch_dtype=None, generate_kwargs=None):
+        from transformers import pipeline
+
+        super().__init__(model)
+        self.pipe = pipeline(
+            "text-generation",
+            model=model,
+            model_kwargs={"torch_dtype": torch_dtype} if torch_dtype else {},
+            device=device or default_device(),
+        )
+        self.tokenizer = self.pipe.tokenizer
+        self.generate_kwargs = generate_kwargs or {}
+
+    def _generate(self, prompt, streamer, max_new_tokens):
+        self.pipe(prompt, max_new_tokens=max_new_tokens, streamer=streamer, return_full_text=False,
+                  **self.generate_kwargs)
+
+
+class HFGenerateBackend(_HFStreamingBackend):
+    """`AutoModelForCausalLM.generate`, as in D3_HF_DS.py."""
+
+    name = "hf-generate"
+
+    def __init__(self, model, device=None, torch_dtype=None, generate_kwargs=None, trust_remote_code=False):
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        super().__init__(model)
+        self.tokenizer = AutoTokenizer.from_pretrained(model, trust_remote_code=trust_remote_code)
+        self.hf_model = AutoModelForCausalLM.from_pretrained(
+            model,
+            trust_remote_code=trust_remote_code,
+            torch_dtype=torch_dtype,
+            device_map=device or default_device(),
+        )
+        self.generate_kwargs = generate_kwargs or {}
+
+    def _generate(self, prompt, streamer, max_new_tokens):
+        inputs = self.tokenizer(prompt, return_tensors="pt", add_special_tokens=False).to(self.hf_model.device)
+        self.hf_model.generate(**inputs, max_new_tokens=max_new_tokens, streamer=streamer, **self.generate_kwargs)
+
+
+# gemma checkpoint names (gm.ckpts.CheckpointPath) such as GEMMA3_4B_IT
+GEMMA_CHECKPOINT_RE = re.compile(r"GEMMA(\d)_(\d+B)_(?:IT|PT)")
+
+
+class GemmaBackend(Backend):
+    """The gemma library sampler, as in TryGemma.py. It does not stream, so TTFT equals total time."""
+
+    name = "gemma"
+
+    def __init__(self, model="GEMMA3_1B_IT"):
+        match = GEMMA_CHECKPOINT_RE.fullmatch(model)
+        if not match:
+            raise ValueError(f"Unsupported gemma checkpoint '{model}', expected a name like GEMMA3_1B_IT")
+        from gemma import gm
+
+        # The network must match the checkpoint, e.g. GEMMA3_4B_IT -> gm.nn.Gemma3_4B
+        architecture = getattr(gm.nn, f"Gemma{match.group(1)}_{match.group(2)}", None)
+        checkpoint = getattr(gm.ckpts.CheckpointPath, model, None)
+        if architecture is None or checkpoint is None:
+            raise ValueError(f"The installed gemma library does not provide '{model}'")
+        super().__init__(model)
+        self.sampler = gm.text.ChatSampler(
+            model=architecture(),
+            params=gm.ckpts.load_params(checkpoint),
+        )
+
+    def stream(self, messages, max_new_tokens=256):
+        prompt = "\n".join(m["content"] for m in messages if m["role"] != "system")
+        text = self.sampler.chat(prompt, multi_turn=False, max_new_tokens=max_new_tokens)
+        self.last_token_count = len(self.sampler.tokenizer.encode(text))
+        yield text
+
+
+BACKENDS = {
+    OllamaBackend.name: OllamaBackend,
+    HFPipelineBackend.name: HFPipelineBackend,
+    HFGenerateBackend.name: HFGenerateBackend,
+    GemmaBackend.name: GemmaBackend,
+}
+
+
+def create_backend(kind, model, **kwargs):
+    """Creates a backend by name: ollama, hf-pipeline, hf-generate or gemma."""
+    if kind not in BACKENDS:
+        raise ValueError(f"Unknown backend '{kind}', expected one of {sorted(BACKENDS)}")
+    return BACKENDS[kind](model, **kwargs)
@@ -0,0 +1,285 @@
+# Resumable, parallel batch runner for JSONL prompt files.
+#
+# Input is read one line at a time (a .jsonl file of records with "messages",
+# "prompt" or "title"/"body", or a prompts.txt-style text file with one
+# prompt per line) and fanned out to `workers` concurrent requests. At most
+# 2 x workers records are in flight, so memory stays flat however large the
+# input is. Each result is appended to the output JSONL as it finishes.
+#
+# Progress is checkpointed to <output>.ckpt:
+#   - offset: the input byte offset below which every record is done (the
+#     low-water mark);
+#   - done_ahead: ids of records past that offset that finished early;
+#   - output_bytes: the output size that matches this state.
+# After a crash, `--resume` truncates the output to output_bytes, seeks the
+# input to offset and skips done_ahead. Every record is then written exactly
+# once. If the checkpoint is missing, the state is rebuilt from the ids in
+# the output instead (input offset 0, every written id skipped).
+#
+# An input line that is not a valid JSON object gets an {"id": "@<offset>",
+# "error": ...} result like a failed request, and the run continues.
+#
+#   python BatchRunner.py requests.jsonl results.jsonl --workers 8 --model gemma3
+#   python BatchRunner.py requests.jsonl results.jsonl --resume
+#   python BatchRunner.py prompts.txt out.jsonl --backend hf --model sshleifer/tiny-gpt2
+
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def record_messages(record):
+    """Chat messages for a workload record with "messages", "prompt" or "title"/"body" fields."""
+    if "messages" in record:
+        return record["messages"]
+    if "prompt" in record:
+        return [{"role": "user", "content": record["prompt"]}]
+    text = "\n\n".join(record[k] for k in ("title", "body") if record.get(k))
+    return [{"role": "user", "content": text}]
+
+
+class InvalidRecord(ValueError):
+    """An input line that could not be read as a record; yielded in place of its messages."""
+
+
+def iter_records(path, offset=0):
+    """
+    Yields (start offset, end offset, id, messages) for each input record,
+    starting at byte `offset`. Records without an "id" (or "request_id") are
+    named by their byte offset, which stays stable across resumes. For a line
+    that is not a valid record, messages is an InvalidRecord.
+    """
+    jsonl = path.endswith(".jsonl")
+    with open(path, "rb") as f:
+        f.seek(offset)
+        start = offset
+        for raw in iter(f.readline, b""):
+            end = start + len(raw)
+            try:
+                line = raw.decode("utf-8").strip()
+            except UnicodeDecodeError as e:
+                yield start, end, f"@{start}", InvalidRecord(f"invalid UTF-8: {e}")
+                start = end
+                continue
+            if line and jsonl:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as e:
+                    record = InvalidRecord(f"invalid JSON: {e}")
+                if not isinstance(record, dict):
+                    error = record if isinstance(record, InvalidRecord) else InvalidRecord("not a JSON object")
+                    yield start, end, f"@{start}", error
+                else:
+                    record_id = str(record.get("id", record.get("request_id", f"@{start}")))
+                    yield start, end, record_id, record_messages(record)
+            elif line and not line.startswith(("http://", "https://")):
+                yield start, end, f"@{start}", [{"role": "user", "content": line}]
+            start = end
+
+
+class Checkpoint:
+    """Low-water input offset plus ids completed beyond it; saved atomically as JSON."""
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.done_ahead = set()
+        self.output_bytes = 0
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                state = json.load(f)
+            self.offset = state["offset"]
+            self.done_ahead = set(state["done_ahead"])
+            self.output_bytes = state["output_bytes"]
+        return self
+
+    def rebuild(self, output_path):
+        """
+        Recovers the state from the output alone: every complete result line
+        is kept and its id skipped, and the input is re-read from the start.
+        """
+        self.offset = 0
+        self.done_ahead = set()
+        self.output_bytes = 0
+        if not os.path.exists(output_path):
+            return self
+        with open(output_path, "rb") as f:
+            for raw in iter(f.readline, b""):
+                if not raw.endswith(b"\n"):
+                    break  # A torn last line; rewrite from here
+                try:
+                    self.done_ahead.add(str(json.loads(raw)["id"]))
+                except (ValueError, KeyError, TypeError):
+                    break
+                self.output_bytes += len(raw)
+        return self
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"offset": self.offset, "done_ahead": sorted(self.done_ahead),
+                       "output_bytes": self.output_bytes}, f)
+        os.replace(tmp, self.path)
+
+
+class BatchRunner:
+    """
+    Runs `handle(messages) -> dict` for every input record on `workers`
+    threads and writes {"id": ..., **result} lines to `output_path`.
+    """
+
+    def __init__(self, handle, workers=4, checkpoint_every=2.0, report_every=5.0):
+        self.handle = handle
+        self.workers = workers
+        self.checkpoint_every = checkpoint_every
+        self.report_every = report_every
+        self._lock = threading.Lock()
+        self._in_flight = {}  # start offset -> id, for submitted records not yet written
+        self._done = {}  # start offset -> id, for written records (pruned below the low-water mark)
+        self.stats = {"done": 0, "failed": 0, "tokens": 0, "skipped": 0}
+
+    def run(self, input_path, output_path, resume=False):
+        checkpoint = Checkpoint(output_path + ".ckpt")
+        if resume and os.path.exists(checkpoint.path):
+            checkpoint.load()
+        elif resume:
+            checkpoint.rebuild(output_path)
+            print(f"No checkpoint found; resuming after the {len(checkpoint.done_ahead)} results in {output_path}.")
+        elif os.path.exists(checkpoint.path):
+            os.remove(checkpoint.path)
+
+        with open(output_path, "ab" if resume else "wb") as out:
+            # Anything written after the last checkpoint is redone, so drop it
+            out.truncate(checkpoint.output_bytes)
+            out.seek(0, os.SEEK_END)
+            self._out = out
+            self._checkpoint = checkpoint
+            self._read_offset = checkpoint.offset
+            self._started = time.perf_counter()
+            self._last_report = self._last_checkpoint = self._started
+            slots = threading.BoundedSemaphore(self.workers * 2)
+            skip = set(checkpoint.done_ahead)
+
+            try:
+                with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                    for start, end, record_id, messages in iter_records(input_path, checkpoint.offset):
+                        if record_id in skip:
+                            skip.discard(record_id)
+                            with self._lock:
+                                self._done[start] = record_id
+                                self._read_offset = end
+                            self.stats["skipped"] += 1
+                            continue
+                        slots.acquire()
+                        # Registered together, so the low-water mark never passes an unsubmitted record
+                        with self._lock:
+                            self._in_flight[start] = record_id
+                            self._read_offset = end
+                        future = pool.submit(self._run_one, start, record_id, messages)
+                        future.add_done_callback(lambda _: slots.release())
+            finally:
+                with self._lock:
+                    self._save_checkpoint()
+        self.report(final=True)
+
+    def _run_one(self, start, record_id, messages):
+        began = time.perf_counter()
+        try:
+            if isinstance(messages, InvalidRecord):
+                raise messages
+            result = {"id": record_id, **self.handle(messages)}
+        except Exception as e:
+            result = {"id": record_id, "error": str(e)}
+        result["seconds"] = round(time.perf_counter() - began, 4)
+        line = (json.dumps(result) + "\n").encode("utf-8")
+
+        with self._lock:
+            self._out.write(line)
+            self._out.flush()
+            del self._in_flight[start]
+            self._done[start] = record_id
+            self.stats["failed" if "error" in result else "done"] += 1
+            self.stats["tokens"] += result.get("tokens") or 0
+            now = time.perf_counter()
+            if now - self._last_checkpoint >= self.checkpoint_every:
+                self._save_checkpoint()
+                self._last_checkpoint = now
+            report = now - self._last_report >= self.report_every
+            if report:
+                self._last_report = now
+        if report:
+            self.report()
+
+    def _save_checkpoint(self):
+        """Advances the low-water mark and saves. Caller holds the lock."""
+        low_water = min(self._in_flight) if self._in_flight else self._read_offset
+        # Records behind the mark are covered by the offset itself
+        self._done = {start: i for start, i in self._done.items() if start >= low_water}
+        checkpoint = self._checkpoint
+        checkpoint.offset = low_water
+        checkpoint.done_ahead = set(self._done.values())
+        checkpoint.output_bytes = self._out.tell()
+        checkpoint.save()
+
+    def report(self, final=False):
+        s = self.stats
+        elapsed = time.perf_counter() - self._started
+        rate = (s["done"] + s["failed"]) / elapsed if elapsed else 0.0
+        label = "Finished" if final else "Progress"
+        print(f"{label}: {s['done']} done, {s['failed']} failed, {s['skipped']} skipped in {elapsed:.1f}s "
+              f"({rate:.2f} req/s, {s['tokens'] / elapsed if elapsed else 0:.1f} tok/s)", flush=True)
+
+
+def ollama_handler(model, host=None, options=None):
+    """A thread-safe handle(messages) that asks an Ollama model (one shared, pooled client)."""
+    from Telemetry import instrumented_client
+
+    client = instrumented_client(host)
+
+    def handle(messages):
+        response = client.chat(model=model, messages=messages, options=options or {})
+        return {"response": response['message']['content'], "tokens": response.get('eval_count') or 0}
+    return handle
+
+
+def hf_handler(model_id, device=None, max_batch_size=8, max_new_tokens=256):
+    """A thread-safe handle(messages) that batches concurrent requests into one HF model."""
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    from Backends import default_device, render_prompt
+    from HFBatching import BatchingGenerator
+
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    model = AutoModelForCausalLM.from_pretrained(model_id).to(device or default_device()).eval()
+    generator = BatchingGenerator(model, tokenizer, max_batch_size=max_batch_size,
+                                  add_special_tokens=not tokenizer.chat_template, max_new_tokens=max_new_tokens)
+
+    def handle(messages):
+        text = generator.submit(render_prompt(tokenizer, messages)).result()
+        return {"response": text, "tokens": len(tokenizer.encode(text, add_special_tokens=False))}
+    return handle
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a JSONL (or prompts.txt) workload through a model, resumably.")
+    parser.add_argument("input", help="input .jsonl or .txt file")
+    parser.add_argument("output", help="output .jsonl file")
+    parser.add_argument("--backend", choices=("ollama", "hf"), default="ollama")
+    parser.add_argument("--model", default="gemma3")
+    parser.add_argument("--host", default=None, help="Ollama URL")
+    parser.add_argument("--device", default=None, help="device for the hf backend")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent requests (hf: max batch size)")
+    parser.add_argument("--max-new-tokens", type=int, default=256)
+    parser.add_argument("--resume", action="store_true", help="continue from the output's checkpoint")
+    args = parser.parse_args()
+
+    if args.backend == "ollama":
+        handler = ollama_handler(args.model, args.host, {"num_predict": args.max_new_tokens})
+    else:
+        handler = hf_handler(args.model, args.device, args.workers, args.max_new_tokens)
+    BatchRunner(handler, workers=args.workers).run(args.input, args.output, resume=args.resume)
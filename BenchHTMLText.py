@@ -0,0 +1,109 @@
+# Benchmark: streaming HTMLText extractor vs. the original BeautifulSoup extractor.
+#
+# For every saved page in the fixtures directory this reports throughput
+# (MB of HTML per second, best of --repeat runs) and the peak RSS growth of
+# a fresh process that runs the extractor once.
+#
+#   python BenchHTMLText.py --fixtures fixtures/html --repeat 5
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import HTMLText
+
+EXTRACTORS = {
+    "bs4": HTMLText.extract_text_bs4,
+    "streaming": HTMLText.extract_text,
+}
+
+
+def max_rss_kb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def measure_rss(name, path, max_chars, queue):
+    """Runs one extraction in this (fresh) process and reports peak RSS growth."""
+    with open(path, encoding="utf-8") as f:
+        html = f.read()
+    extract = EXTRACTORS[name]
+    before = max_rss_kb()
+    if name == "streaming":
+        extract(html, max_chars)
+    else:
+        extract(html)
+    queue.put(max_rss_kb() - before)
+
+
+def peak_rss_kb(name, path, max_chars):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=measure_rss, args=(name, path, max_chars, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def throughput(name, html, max_chars, repeat):
+    """Returns (best seconds per run, extracted characters)."""
+    extract = EXTRACTORS[name]
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        text = extract(html, max_chars) if name == "streaming" else extract(html)
+        best = min(best, time.perf_counter() - start)
+    return best, len(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the HTML-to-text extractors.")
+    parser.add_argument("--fixtures", default="fixtures/html", help="directory of saved .html pages")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per extractor and page")
+    parser.add_argument("--max-chars", type=int, default=None, help="text budget for the streaming extractor")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.fixtures, "*.html")))
+    if not paths:
+        print(f"No .html fixtures found in {args.fixtures}")
+        return
+
+    results = []
+    print(f"{'page':<20} {'extractor':<10} {'KB':>8} {'MB/s':>8} {'chars':>9} {'peak RSS KB':>12}")
+    print("-" * 72)
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            html = f.read()
+        size_mb = len(html.encode("utf-8")) / 1e6
+        for name in EXTRACTORS:
+            seconds, chars = throughput(name, html, args.max_chars, args.repeat)
+            rss = peak_rss_kb(name, path, args.max_chars)
+            row = {
+                "page": os.path.basename(path),
+                "extractor": name,
+                "html_bytes": len(html.encode("utf-8")),
+                "seconds": seconds,
+                "mb_per_s": size_mb / seconds if seconds else float("inf"),
+                "text_chars": chars,
+                "peak_rss_kb": rss,
+            }
+            results.append(row)
+            print(f"{row['page']:<20} {name:<10} {row['html_bytes'] / 1024:>8.0f} "
+                  f"{row['mb_per_s']:>8.2f} {chars:>9} {rss:>12}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+# CPU execution profile for the Hugging Face scripts.
+#
+# On machines without a GPU the HF scripts load the model through
+# load_model(), which:
+#   - sets the intra-op (per-operator) and inter-op thread counts, since
+#     generation is one sequential chain of ops;
+#   - loads the checkpoint in float32 (bfloat16 matmuls are slow on most
+#     CPUs) and applies dynamic int8 quantization to every nn.Linear;
+#   - saves the quantized weights (a state_dict) as a local snapshot. Later
+#     runs build the model skeleton from its config without allocating any
+#     weights (on the meta device), swap in empty int8 Linear layers and load
+#     the memory-mapped snapshot with torch.load(weights_only=True), so
+#     startup never reads, initialises or quantizes a float32 copy of the
+#     model. Snapshots are keyed by the torch and transformers versions,
+#     since the packed int8 format and the model code can change between
+#     releases.
+# With a GPU, load_model() is plain from_pretrained() with the caller's settings.
+#
+#   python CPUProfile.py --model sshleifer/tiny-gpt2 --max-new-tokens 64
+#
+# compares startup time and tokens/sec of the float32 and int8 paths.
+
+import argparse
+import os
+import time
+
+import torch
+import transformers
+from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer
+
+try:
+    from transformers.modeling_utils import no_init_weights
+except ImportError:  # transformers 5 moved it
+    from transformers.initialization import no_init_weights
+
+SNAPSHOT_ROOT = ".cpu_snapshots"
+
+
+def configure_threads(intra_op=None, inter_op=1):
+    """Sets torch's thread pools. intra_op defaults to the number of CPUs."""
+    torch.set_num_threads(intra_op or os.cpu_count() or 1)
+    try:
+        torch.set_num_interop_threads(inter_op)
+    except RuntimeError:
+        pass  # Can only be set once, before any inter-op work has started
+    return torch.get_num_threads(), torch.get_num_interop_threads()
+
+
+def quantize(model):
+    """Dynamic int8 quantization of the Linear layers (weights int8, activations quantized per batch)."""
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def quantize_skeleton(model):
+    """
+    quantize() for a model whose weights are on the meta device: every
+    nn.Linear becomes an empty dynamic int8 Linear, to be filled by
+    load_state_dict. Nothing is observed or converted, so no float32
+    weights are needed.
+    """
+    for module in list(model.modules()):
+        for name, child in list(module.named_children()):
+            if type(child) is torch.nn.Linear:
+                setattr(module, name, torch.ao.nn.quantized.dynamic.Linear(
+                    child.in_features, child.out_features, bias_=child.bias is not None, dtype=torch.qint8))
+    return model
+
+
+def snapshot_dir(model_id, root=SNAPSHOT_ROOT):
+    versions = f"torch{torch.__version__}-transformers{transformers.__version__}".replace("+", "_")
+    return os.path.join(root, model_id.strip("/").replace("/", "--") + "-int8-" + versions)
+
+
+def save_snapshot(model, tokenizer, path):
+    """Saves a quantized model's state_dict, config and tokenizer."""
+    os.makedirs(path, exist_ok=True)
+    tmp = os.path.join(path, "model.pt.tmp")
+    torch.save(model.state_dict(), tmp)
+    os.replace(tmp, os.path.join(path, "model.pt"))
+    model.config.save_pretrained(path)
+    tokenizer.save_pretrained(path)
+
+
+def load_snapshot(path, trust_remote_code=False):
+    """
+    Rebuilds a quantized model from a snapshot. The skeleton comes from the
+    saved config with its weights on the meta device (buffers stay real),
+    its Linear layers are swapped for empty int8 ones, and the saved tensors
+    are assigned in place from the memory-mapped file. The remaining float
+    weights (embeddings, norms) are paged in as they are used; the int8
+    Linear weights are repacked into their own buffers as they load.
+    """
+    from accelerate import init_empty_weights
+
+    config = AutoConfig.from_pretrained(path, trust_remote_code=trust_remote_code)
+    with init_empty_weights(), no_init_weights():
+        skeleton = AutoModelForCausalLM.from_config(config, trust_remote_code=trust_remote_code,
+                                                    torch_dtype=torch.float32)
+    model = quantize_skeleton(skeleton)
+    state = torch.load(os.path.join(path, "model.pt"), mmap=True, weights_only=True)
+    model.load_state_dict(state, assign=True)
+    return model.eval(), AutoTokenizer.from_pretrained(path, trust_remote_code=trust_remote_code)
+
+
+def load_cpu_model(model_id, trust_remote_code=False, quantized=True, snapshot_root=SNAPSHOT_ROOT):
+    """Loads `model_id` for CPU inference, from (or into) the quantized snapshot when `quantized`."""
+    path = snapshot_dir(model_id, snapshot_root)
+    if quantized and os.path.exists(os.path.join(path, "model.pt")):
+        return load_snapshot(path, trust_remote_code)
+    tokenizer = AutoTokenizer.from_pretrained(model_id, trust_remote_code=trust_remote_code)
+    model = AutoModelForCausalLM.from_pretrained(
+        model_id, trust_remote_code=trust_remote_code, torch_dtype=torch.float32
+    ).eval()
+    if quantized:
+        model = quantize(model)
+        save_snapshot(model, tokenizer, path)
+    return model, tokenizer
+
+
+def load_model(model_id, trust_remote_code=False, quantized=True, **gpu_kwargs):
+    """
+    Returns (model, tokenizer). With CUDA available this is
+    from_pretrained(model_id, **gpu_kwargs); otherwise the CPU profile is used.
+    """
+    if torch.cuda.is_available():
+        tokenizer = AutoTokenizer.from_pretrained(model_id, trust_remote_code=trust_remote_code)
+        model = AutoModelForCausalLM.from_pretrained(model_id, trust_remote_code=trust_remote_code, **gpu_kwargs)
+        return model, tokenizer
+    configure_threads()
+    return load_cpu_model(model_id, trust_remote_code, quantized)
+
+
+def tokens_per_second(model, tokenizer, prompt, max_new_tokens):
+    inputs = tokenizer(prompt, return_tensors="pt")
+    with torch.inference_mode():
+        model.generate(**inputs, max_new_tokens=4, do_sample=False)  # warm-up
+        start = time.perf_counter()
+        output = model.generate(**inputs, max_new_tokens=max_new_tokens, min_new_tokens=max_new_tokens,
+                                do_sample=False)
+    elapsed = time.perf_counter() - start
+    return (output.shape[1] - inputs["input_ids"].shape[1]) / elapsed
+
+
+def compare(model_id, prompt, max_new_tokens, snapshot_root=SNAPSHOT_ROOT):
+    """Prints startup time and tokens/sec for float32, int8 (first run) and int8 (from snapshot)."""
+    threads = configure_threads()
+    print(f"threads: intra-op {threads[0]}, inter-op {threads[1]}")
+    rows = []
+    for label, quantized in (("float32", False), ("int8 build", True), ("int8 snapshot", True)):
+        if label == "int8 build":
+            path = os.path.join(snapshot_dir(model_id, snapshot_root), "model.pt")
+            if os.path.exists(path):
+                os.remove(path)  # Time the first run, which quantizes and writes the snapshot
+        start = time.perf_counter()
+        model, tokenizer = load_cpu_model(model_id, quantized=quantized, snapshot_root=snapshot_root)
+        startup = time.perf_counter() - start
+        rows.append((label, startup, tokens_per_second(model, tokenizer, prompt, max_new_tokens)))
+        del model
+
+    print(f"\n{'profile':<12} {'startup s':>10} {'tok/s':>9}")
+    for label, startup, tps in rows:
+        print(f"{label:<12} {startup:>10.2f} {tps:>9.1f}")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare float32 and int8 CPU inference.")
+    parser.add_argument("--model", default="sshleifer/tiny-gpt2")
+    parser.add_argument("--prompt", default="The Eiffel Tower is")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--snapshot-root", default=SNAPSHOT_ROOT)
+    args = parser.parse_args()
+    compare(args.model, args.prompt, args.max_new_tokens, args.snapshot_root)
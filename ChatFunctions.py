@@ -1,11 +1,19 @@
 # This script demonstrates a chat interface that uses a local LLM (gemma3:1b via Ollama)
 # for function calling with Pydantic validation and conversational argument gathering.
 
-import json
+import argparse
 from typing import Any, Dict, List
 import ollama
 from pydantic import BaseModel, ValidationError
 
+from ChatHistory import ChatHistory, approximate_tokens, ollama_summarizer, tokenizer_counter
+from IntentRouter import CITY_PATTERN, IntentRouter
+from OllamaSession import OllamaSession
+from StreamingJSON import parse_first_object
+from Telemetry import get_telemetry, instrumented_client
+from ToolExecutor import ToolExecutor
+from ToolRegistry import RESPONSE_SCHEMA, MalformedToolCall, ToolRegistry
+
 # --- 1. Function and Pydantic Model Definitions ---
 # Pydantic models are used to define the required arguments and validate them.
 
@@ -50,22 +58,32 @@ def send_email(recipient: str, subject: str, body: str) -> str:
 
 # --- 2. Tool Registry and LLM Prompting ---
 # This dictionary acts as a registry for the available functions and their schemas.
+# The optional execution settings (see ToolExecutor) bound how long a call may
+# take and how many run at once; weather lookups are idempotent, so their
+# results are reused for 10 minutes. Functions may also be `async def`.
 
 AVAILABLE_TOOLS = {
     "get_weather": {
         "function": get_weather,
-        "schema": GetWeatherRequest
+        "schema": GetWeatherRequest,
+        "timeout": 10,
+        "max_concurrency": 8,
+        "cache_ttl": 600
     },
     "send_email": {
         "function": send_email,
-        "schema": SendEmailRequest
+        "schema": SendEmailRequest,
+        "timeout": 30,
+        "max_concurrency": 2
     }
 }
 
+# Each tool's Pydantic model is compiled once into a validator and JSON schema.
+TOOL_REGISTRY = ToolRegistry.from_available_tools(AVAILABLE_TOOLS)
+
 # The system prompt instructs the LLM on its role and how to use the tools.
 # It provides the function schemas in a format the model can parse.
-# The 'response_format' parameter will ensure the model returns JSON.
-SYSTEM_PROMPT = """
+SYSTEM_PROMPT = f"""
 You are a helpful assistant with access to the following tools.
 Use the tools only when a user's request requires it.
 
@@ -75,28 +93,220 @@ When you need to use a tool, respond with a JSON object in the following format:
   "tool_input": {{ "arg1": "value1", "arg2": "value2" }}
 }}
 
-If the user asks for something you cannot do with the available tools, or if a tool call is not necessary, respond naturally.
+When the request needs several tool calls, make them all at once:
+{{
+  "tool_calls": [
+    {{ "tool_name": "name_of_the_tool", "tool_input": {{ "arg1": "value1" }} }},
+    {{ "tool_name": "name_of_another_tool", "tool_input": {{ "arg1": "value1" }} }}
+  ]
+}}
+
+If the user asks for something you cannot do with the available tools, or if a tool call is not necessary, respond naturally in the following format:
+{{ "response": "your reply" }}
 
 Available tools and their schemas:
-- get_weather: {{
-    "name": "get_weather",
-    "description": "Get the current weather for a specific city.",
-    "parameters": GetWeatherRequest.model_json_schema()
-}}
-- send_email: {{
-    "name": "send_email",
-    "description": "Send an email to a recipient with a specified subject and body.",
-    "parameters": SendEmailRequest.model_json_schema()
-}}
+{TOOL_REGISTRY.prompt_block()}
 """
 
+# Passed as `format=` so the model can only emit a valid tool call or a reply.
+# Arguments are not required by the schema, so missing ones are left out and
+# gathered from the user through Pydantic validation rather than invented.
+TOOL_CALL_SCHEMA = TOOL_REGISTRY.call_schema(allow_response=True, require_args=False, allow_multiple=True)
+
+# Re-asks allowed when a response still fails to parse
+MAX_PARSE_RETRIES = 1
+
+# Requests matching these patterns exactly skip the model. The named groups
+# are the tool arguments. A city is capitalized words only, and the whole
+# request must match, so "weather in Paris tomorrow" or "in Rome and Oslo" go to the model.
+ROUTE_PATTERNS = {
+    "get_weather": [
+        rf"(?:(?:what|how)(?:'s|\s+is)\s+)?(?:the\s+)?weather\s+(?:like\s+)?(?:today\s+)?(?:in|for|at)\s+(?P<city>{CITY_PATTERN})(?:\s+(?:today|right\s+now|now))?",
+    ],
+    "send_email": [
+        r"(?:can\s+you\s+|please\s+)?send\s+(?:an\s+)?email\s+to\s+(?P<recipient>[\w.+-]+@[\w-]+(?:\.[\w-]+)+)\s+with\s+(?:the\s+)?subject\s+'(?P<subject>[^']*)'\s+and\s+(?:the\s+)?body\s+'(?P<body>.*)'",
+    ],
+}
+
+# Example requests for the nearest-neighbour classifier
+ROUTE_EXAMPLES = {
+    "get_weather": ["what's the weather in London", "is it raining in Paris", "how hot is it in Madrid today"],
+    "send_email": ["send an email to bob@example.com", "email alice about the meeting"],
+}
+
+# Emails are only sent on an exact pattern match, never on a similarity match.
+router = IntentRouter.from_registry(TOOL_REGISTRY, ROUTE_PATTERNS, ROUTE_EXAMPLES,
+                                   nearest_tools={"get_weather"})
+
+def route_locally(user_input):
+    """Returns a validated (tool_name, tool_input) from the local router, or None."""
+    tool_call = router.route(user_input)
+    if tool_call is None:
+        return None
+    tool_name, tool_input = tool_call
+    try:
+        return tool_name, TOOL_REGISTRY.validate(tool_name, tool_input).model_dump()
+    except ValidationError:
+        router.miss()
+        return None
+
+# Native tool definitions for Ollama's `tools=` parameter, built from the registry.
+# The model returns structured tool calls itself, so no JSON prompt format is needed.
+OLLAMA_TOOLS = TOOL_REGISTRY.ollama_tools()
+
+NATIVE_SYSTEM_PROMPT = """
+You are a helpful assistant with access to tools.
+Use the tools only when a user's request requires it, and ask the user for any required arguments they have not given.
+Otherwise, respond naturally.
+"""
+
+# Maximum tool-call rounds per user turn in native mode, so a model that keeps
+# calling tools cannot loop forever.
+MAX_TOOL_ROUNDS = 3
+
+# Model timings from the instrumented client, plus tool execution time
+telemetry = get_telemetry()
+
+# All tool calls of a turn run concurrently, each within its tool's limits.
+# Created on first use, so importing this module starts no event-loop thread.
+tool_executor = None
+
+def get_tool_executor():
+    global tool_executor
+    if tool_executor is None:
+        tool_executor = ToolExecutor(AVAILABLE_TOOLS, telemetry=telemetry)
+    return tool_executor
+
+def run_tool(tool_name, tool_input):
+    """Runs a tool with already validated arguments (timed, and cached if the tool allows)."""
+    return get_tool_executor().run(tool_name, tool_input)
+
+def validation_error_message(tool_name, error):
+    missing_args = [f for f in error.errors()]
+    return f"Validation failed for function '{tool_name}': The following arguments are missing or invalid: {missing_args}. Please provide the required information."
+
+def execute_tools(calls):
+    """
+    Validates each (tool_name, tool_input) call with its tool's Pydantic
+    schema and runs the valid ones concurrently. Returns one result per
+    call, in order, and the set of indexes of the invalid calls, whose
+    result is an error message the model can act on.
+    """
+    results = [None] * len(calls)
+    valid = []
+    for i, (tool_name, tool_input) in enumerate(calls):
+        if tool_name not in AVAILABLE_TOOLS:
+            results[i] = f"Error: unknown tool '{tool_name}'."
+            continue
+        try:
+            valid.append((i, tool_name, TOOL_REGISTRY.validate(tool_name, tool_input or {}).model_dump()))
+        except ValidationError as e:
+            results[i] = validation_error_message(tool_name, e)
+    for _, tool_name, tool_input in valid:
+        print(f"Bot: Calling '{tool_name}' with args {tool_input}")
+    outputs = get_tool_executor().run_all([(tool_name, tool_input) for _, tool_name, tool_input in valid])
+    for (i, _, _), output in zip(valid, outputs):
+        results[i] = output
+    return results, set(range(len(calls))) - {i for i, _, _ in valid}
+
+def request_tool_calls(session, chat_history):
+    """
+    Asks the model for one or more tool calls or a reply using the
+    structured-output schema. Returns a list of (tool_name, tool_input), or
+    [(None, reply_text)].
+    """
+    for attempt in range(MAX_PARSE_RETRIES + 1):
+        if attempt:
+            TOOL_REGISTRY.stats.retries += 1
+        stream = session.chat(
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                *chat_history
+            ],
+            stream=True,
+            format=TOOL_CALL_SCHEMA # Constrains the output to a valid tool call or reply
+        )
+        # Stop generating as soon as the JSON object is complete
+        model_response_str = parse_first_object(stream, on_field=TOOL_REGISTRY.accepts_field).text
+        print(f"\nModel response: {model_response_str}\n")
+        try:
+            return TOOL_REGISTRY.parse_calls(model_response_str)
+        except MalformedToolCall as e:
+            print(f"Malformed model response: {e}")
+    # Still unparseable: show the raw text as a natural response
+    return [(None, model_response_str)]
+
+def reply_text(content):
+    """The text of a RESPONSE_SCHEMA reply, or the raw content if it is not one."""
+    try:
+        tool_name, text = TOOL_REGISTRY.parse(content)
+    except MalformedToolCall:
+        return content
+    return text if tool_name is None else content
+
+def stream_reply(session, messages, tools=None):
+    """
+    Streams one assistant reply, printing text as it arrives.
+    Returns the full text and any tool calls the model made.
+    """
+    content_parts = []
+    tool_calls = []
+    for chunk in session.chat(messages, tools=tools, stream=True):
+        message = chunk['message']
+        if message.get('tool_calls'):
+            tool_calls.extend(message['tool_calls'])
+        text = message.get('content')
+        if text:
+            if not content_parts:
+                print("Bot: ", end='')
+            print(text, end='', flush=True)
+            content_parts.append(text)
+    if content_parts:
+        print()
+    return "".join(content_parts), tool_calls
+
+def native_turn(session, chat_history):
+    """
+    Handles one user turn with native tool calling: a single streamed request
+    answers plain questions directly, and tool results are followed by one
+    more streamed request to phrase them.
+    """
+    for _ in range(MAX_TOOL_ROUNDS):
+        content, tool_calls = stream_reply(
+            session,
+            [{"role": "system", "content": NATIVE_SYSTEM_PROMPT}, *chat_history],
+            tools=OLLAMA_TOOLS,
+        )
+        assistant_message = {"role": "assistant", "content": content}
+        if tool_calls:
+            assistant_message["tool_calls"] = tool_calls
+        chat_history.append(assistant_message)
+        if not tool_calls:
+            return
+
+        calls = [(call['function']['name'], call['function']['arguments']) for call in tool_calls]
+        results, _ = execute_tools(calls)
+        for (tool_name, _), result in zip(calls, results):
+            chat_history.append({
+                "role": "tool",
+                "content": str(result),
+                "tool_name": tool_name
+            })
+    print("Bot: Stopping after too many tool calls in one turn.")
+
 # --- 3. Chat Loop and Logic ---
-def main():
+def main(model_name="gemma3", native_tools=False, history_tokens=2048, tokenizer=None):
     """
-    Main function to run the chat interface.
+    Main function to run the chat interface. With native_tools=True the
+    model's built-in tool calling is used and replies are streamed.
+    The history sent with each request is kept under `history_tokens`
+    tokens, counted with the Hugging Face `tokenizer` if given.
     """
-    client = ollama.Client()
-    model_name = "gemma3"
+    # The session preloads the model and keeps it resident between turns.
+    # SYSTEM_PROMPT is always the first message so its prompt prefix is reused.
+    session = OllamaSession(model_name, client=instrumented_client())
+    client = session.client
+    executor = get_tool_executor()
     
     # Check if the model is available
     try:
@@ -105,13 +315,25 @@ def main():
         print(f"Error: The model '{model_name}' could not be found. Please ensure Ollama is running and you have pulled the model with 'ollama pull {model_name}'.")
         return
         
+    print(f"Loading {model_name}...")
+    session.warm()
+
     print(f"Chatbot powered by {model_name} is now active. Type 'exit' to quit.")
     print("Example prompts:")
     print("- What's the weather in London?")
     print("- Can you send an email to alice@example.com with the subject 'Meeting' and body 'Hello, let's meet tomorrow.'?")
     print("-" * 50)
     
-    chat_history = []
+    # Old turns are dropped (and summarized in the background) once the prompt
+    # would exceed the token budget; the current turn is always kept.
+    count_tokens = tokenizer_counter(tokenizer) if tokenizer else approximate_tokens
+    system_prompt = NATIVE_SYSTEM_PROMPT if native_tools else SYSTEM_PROMPT
+    chat_history = ChatHistory(
+        budget=history_tokens,
+        count_tokens=count_tokens,
+        reserved=count_tokens(system_prompt),
+        summarize=ollama_summarizer(client, model_name),
+    )
     
     while True:
         user_input = input("You: ")
@@ -119,92 +341,98 @@ def main():
             break
 
         if user_input.lower() == 'reset':
-            chat_history = []
+            chat_history.clear()
             print("Chat history has been reset.")
             continue
         
         chat_history.append({"role": "user", "content": user_input})
-        
+
+        # Obvious requests are dispatched by the local router without an LLM call
+        tool_call = route_locally(user_input)
+        if tool_call:
+            tool_name, tool_input = tool_call
+            print(f"Bot: Calling '{tool_name}' with args {tool_input}")
+            function_result = run_tool(tool_name, tool_input)
+            print(f"Bot: {function_result}")
+            chat_history.append({"role": "assistant", "content": function_result})
+            continue
+
+        if native_tools:
+            try:
+                native_turn(session, chat_history)
+            except ollama.ResponseError as e:
+                print(f"Bot: An error occurred with the Ollama API: {e.error}")
+                if "does not support tools" in str(e.error):
+                    print(f"Bot: '{model_name}' has no native tool support; try a model such as 'llama3.1'.")
+            except Exception as e:
+                print(f"Bot: An unexpected error occurred: {e}")
+            continue
+
         try:
-            # First, try to get a tool call from the model
-            response = client.chat(
-                model=model_name,
+            # First, try to get tool calls from the model
+            calls = request_tool_calls(session, chat_history)
+            if calls[0][0] is None:
+                # Not a tool call, handle it as a natural response.
+                print(f"Bot: {calls[0][1]}")
+                continue
+
+            print(f"\ntool calls: {calls}\n")
+
+            # Validate the arguments and call the valid functions, all at once
+            function_results, invalid = execute_tools(calls)
+
+            for i, ((tool_name, _), function_result) in enumerate(zip(calls, function_results)):
+                if i in invalid:
+                    # If validation fails, tell the user what's missing. The error
+                    # message is added to the history so the model knows what to ask for.
+                    print(f"Bot: {function_result}")
+                    chat_history.append({
+                        "role": "assistant",
+                        "content": function_result
+                    })
+                else:
+                    # Pass the function result back to the model for a natural language response
+                    chat_history.append({
+                        "role": "tool",
+                        "content": str(function_result),
+                        "name": tool_name
+                    })
+            if len(invalid) == len(calls):
+                continue
+
+            # Get the final response from the model
+            final_response = session.chat(
                 messages=[
                     {"role": "system", "content": SYSTEM_PROMPT},
                     *chat_history
                 ],
                 stream=False,
-                format="json" # This is crucial for getting structured output
+                format=RESPONSE_SCHEMA
             )
+            print(f"Bot: {reply_text(final_response['message']['content'])}")
 
-            # Check if the model's response is a tool call
-            try:
-                model_response_str = response['message']['content']
-                print(f"\nModel response: {model_response_str}\n")
-                tool_call = json.loads(model_response_str)
-            except json.JSONDecodeError:
-                # If the response isn't valid JSON, it's likely a natural language response
-                print(f"Bot: {response['message']['content']}")
-                continue
-
-            tool_name = tool_call.get("tool_name")
-            tool_input = tool_call.get("tool_input")
-            print(f"\ntool_name: {tool_name}, tool_input: {tool_input}\n")
-            
-            if tool_name and tool_input:
-                if tool_name in AVAILABLE_TOOLS:
-                    tool_info = AVAILABLE_TOOLS[tool_name]
-                    pydantic_schema = tool_info["schema"]
-                    
-                    try:
-                        # Validate the arguments using Pydantic
-                        validated_input = pydantic_schema(**tool_input)
-                        
-                        # Call the function with the validated arguments
-                        function_result = tool_info["function"](**validated_input.model_dump())
-                        print(f"Bot: Calling '{tool_name}' with args {tool_input}")
-                        
-                        # Pass the function result back to the model for a natural language response
-                        chat_history.append({
-                            "role": "tool",
-                            "content": function_result,
-                            "name": tool_name
-                        })
-
-                        # Get the final response from the model
-                        final_response = client.chat(
-                            model=model_name,
-                            messages=[
-                                {"role": "system", "content": SYSTEM_PROMPT},
-                                *chat_history
-                            ],
-                            stream=False
-                        )
-                        print(f"Bot: {final_response['message']['content']}")
-                        
-                    except ValidationError as e:
-                        # If validation fails, tell the user what's missing
-                        missing_args = [f for f in e.errors()]
-                        error_message = f"Validation failed for function '{tool_name}': The following arguments are missing or invalid: {missing_args}. Please provide the required information."
-                        print(f"Bot: {error_message}")
-                        
-                        # Add the error message to the history so the model knows what to ask for
-                        chat_history.append({
-                            "role": "assistant",
-                            "content": error_message
-                        })
-
-                else:
-                    print(f"Bot: I was asked to use a tool I don't know: '{tool_name}'.")
-                    
-            else:
-                # The response was JSON but not a tool call, handle it as a natural response.
-                print(f"Bot: {model_response_str}")
-        
         except ollama.RequestError as e:
             print(f"Bot: An error occurred with the Ollama API: {e}")
         except Exception as e:
             print(f"Bot: An unexpected error occurred: {e}")
 
+    chat_history.close()
+    executor.close()
+    session.report()
+    TOOL_REGISTRY.stats.report()
+    executor.report()
+    router.report()
+    chat_history.report()
+    telemetry.report()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Chat with a local model that can call tools.")
+    parser.add_argument("--model", default="gemma3", help="Ollama model to use")
+    parser.add_argument("--native-tools", action="store_true",
+                        help="use Ollama's native tool calling with streamed replies")
+    parser.add_argument("--history-tokens", type=int, default=2048,
+                        help="token budget for the system prompt and chat history sent with each request")
+    parser.add_argument("--tokenizer", default=None,
+                        help="Hugging Face tokenizer for counting history tokens (default: ~4 characters per token)")
+    args = parser.parse_args()
+    main(args.model, args.native_tools, args.history_tokens, args.tokenizer)
\ No newline at end of file
@@ -0,0 +1,287 @@
+# Async multi-session chat gateway in front of Ollama.
+#
+# Many users share one ollama.AsyncClient (and so one pooled set of HTTP
+# connections). Requests go into a bounded queue. Admission control rejects
+# new work with GatewayBusy when the queue, or a single session's backlog, is
+# full. A fixed number of workers serve sessions round-robin, so one chatty
+# user cannot starve the others. A session's requests run one at a time so
+# its history stays in order. Tokens are streamed back to each caller as they
+# arrive, through a bounded buffer, so a slow reader slows its own generation
+# down instead of piling tokens up in memory.
+#
+#   python ChatGateway.py --fake --users 32 --turns 3
+#
+# runs a load test against FakeOllama and prints queue wait and throughput.
+
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+from collections import deque
+
+import httpx
+import ollama
+
+from OllamaSession import DEFAULT_KEEP_ALIVE
+
+
+class GatewayBusy(Exception):
+    """The request was rejected because the gateway is at capacity."""
+
+
+class SessionClosed(Exception):
+    """The session was closed before the request was served."""
+
+
+class ChatSession:
+    """One user's conversation and pending requests."""
+
+    def __init__(self, session_id, system_prompt=None):
+        self.session_id = session_id
+        self.history = [{"role": "system", "content": system_prompt}] if system_prompt else []
+        self.pending = deque()
+        self.busy = False
+
+
+class _Request:
+    def __init__(self, content, max_buffered):
+        self.content = content
+        self.enqueued_at = time.perf_counter()
+        self.tokens = asyncio.Queue(maxsize=max_buffered)
+        self.abandoned = False  # The caller stopped reading the reply
+
+
+_DONE = object()
+
+
+class ChatGateway:
+    """
+    Shared-connection Ollama gateway with a bounded, fair request queue.
+    `workers` requests are generated concurrently; at most `max_queue`
+    requests may wait, and at most `max_per_session` per session. Up to
+    `max_buffered_tokens` tokens of a reply are buffered for its reader.
+    """
+
+    def __init__(self, model, host=None, workers=4, max_queue=64, max_per_session=2,
+                 keep_alive=DEFAULT_KEEP_ALIVE, system_prompt=None, max_buffered_tokens=256):
+        self.model = model
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_per_session = max_per_session
+        self.max_buffered_tokens = max_buffered_tokens
+        self.keep_alive = keep_alive
+        self.system_prompt = system_prompt
+        # One client, one connection pool sized to the number of workers
+        self.client = ollama.AsyncClient(
+            host=host,
+            limits=httpx.Limits(max_connections=workers, max_keepalive_connections=workers),
+        )
+        self.sessions = {}
+        self._ready = deque()  # session ids with pending work and no request in flight
+        self._queued = 0
+        self._cond = asyncio.Condition()
+        self._tasks = []
+        self.stats = {"queue_wait": [], "first_token": [], "completed": 0, "rejected": 0,
+                      "failed": 0, "tokens": 0, "started_at": None}
+
+    # --- Lifecycle ---
+
+    async def start(self):
+        self.stats["started_at"] = time.perf_counter()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        close = getattr(self.client, "close", None)
+        if close is not None:
+            await close()
+        else:
+            await self.client._client.aclose()  # Older ollama clients have no public close()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    # --- Public API ---
+
+    def open_session(self, session_id=None):
+        """Creates a session and returns its id."""
+        session_id = session_id or uuid.uuid4().hex
+        self.sessions.setdefault(session_id, ChatSession(session_id, self.system_prompt))
+        return session_id
+
+    async def close_session(self, session_id):
+        """
+        Removes a session. Its queued requests are dropped and their callers
+        get SessionClosed; a request already being served runs to the end.
+        """
+        async with self._cond:
+            session = self.sessions.pop(session_id, None)
+            if session is None:
+                return
+            self._queued -= len(session.pending)
+            if session_id in self._ready:
+                self._ready.remove(session_id)
+            while session.pending:
+                # Not started yet, so the token buffer is empty and this cannot block
+                session.pending.popleft().tokens.put_nowait(SessionClosed(f"Session {session_id} was closed."))
+
+    async def chat(self, session_id, content):
+        """
+        Queues a user message and yields the reply token by token.
+        Raises GatewayBusy (on the first iteration) if the request is not admitted.
+        """
+        request = await self._submit(session_id, content)
+        try:
+            while True:
+                item = await request.tokens.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Stop the worker if the caller gave up early, and unblock it if it is waiting on a full buffer
+            request.abandoned = True
+            while not request.tokens.empty():
+                request.tokens.get_nowait()
+
+    # --- Queueing ---
+
+    async def _submit(self, session_id, content):
+        async with self._cond:
+            session = self.sessions.get(session_id)
+            if session is None:
+                raise KeyError(f"Unknown session: {session_id}")
+            if self._queued >= self.max_queue or len(session.pending) >= self.max_per_session:
+                self.stats["rejected"] += 1
+                raise GatewayBusy("Gateway is at capacity, try again later.")
+            request = _Request(content, self.max_buffered_tokens)
+            session.pending.append(request)
+            self._queued += 1
+            if not session.busy and len(session.pending) == 1:
+                self._ready.append(session_id)
+                self._cond.notify()
+            return request
+
+    async def _worker(self):
+        while True:
+            async with self._cond:
+                await self._cond.wait_for(lambda: self._ready)
+                session_id = self._ready.popleft()
+                session = self.sessions.get(session_id)
+                if session is None or not session.pending:
+                    continue  # Closed while queued; close_session() already dropped its requests
+                request = session.pending.popleft()
+                session.busy = True
+                self._queued -= 1
+            try:
+                await self._serve(session, request)
+            finally:
+                async with self._cond:
+                    session.busy = False
+                    if session.pending and session.session_id in self.sessions:
+                        # Back of the line: other sessions get a turn first
+                        self._ready.append(session.session_id)
+                        self._cond.notify()
+
+    async def _serve(self, session, request):
+        started = time.perf_counter()
+        self.stats["queue_wait"].append(started - request.enqueued_at)
+        messages = [*session.history, {"role": "user", "content": request.content}]
+        reply = []
+        try:
+            stream = await self.client.chat(
+                model=self.model, messages=messages, stream=True, keep_alive=self.keep_alive
+            )
+            async for chunk in stream:
+                if request.abandoned:
+                    break
+                text = chunk['message']['content']
+                if text:
+                    if not reply:
+                        self.stats["first_token"].append(time.perf_counter() - started)
+                    reply.append(text)
+                    self.stats["tokens"] += 1
+                    # Waits while the reader's buffer is full
+                    await request.tokens.put(text)
+        except Exception as e:
+            self.stats["failed"] += 1
+            if not request.abandoned:
+                await request.tokens.put(e)
+            return
+        if request.abandoned:
+            self.stats["failed"] += 1
+            return
+        session.history.extend([
+            {"role": "user", "content": request.content},
+            {"role": "assistant", "content": "".join(reply)},
+        ])
+        self.stats["completed"] += 1
+        await request.tokens.put(_DONE)
+
+    # --- Reporting ---
+
+    def report(self):
+        s = self.stats
+        elapsed = time.perf_counter() - s["started_at"] if s["started_at"] else 0.0
+        print(f"\n--- Gateway ({self.workers} workers, queue {self.max_queue}) ---")
+        print(f"completed {s['completed']}, rejected {s['rejected']}, failed {s['failed']} in {elapsed:.2f}s")
+        if elapsed:
+            print(f"throughput {s['completed'] / elapsed:.2f} req/s, {s['tokens'] / elapsed:.1f} tokens/s")
+        for name in ("queue_wait", "first_token"):
+            samples = sorted(s[name])
+            if samples:
+                p95 = samples[min(len(samples) - 1, int(0.95 * len(samples)))]
+                print(f"{name}: median {statistics.median(samples) * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms")
+
+
+async def simulate_user(gateway, turns, results):
+    """One simulated user sending `turns` messages, retrying when the gateway is busy."""
+    session_id = gateway.open_session()
+    for turn in range(turns):
+        while True:
+            try:
+                async for _ in gateway.chat(session_id, f"Message {turn} from {session_id[:6]}"):
+                    pass
+                results["ok"] += 1
+                break
+            except GatewayBusy:
+                results["busy"] += 1
+                await asyncio.sleep(0.05)
+    await gateway.close_session(session_id)
+
+
+async def load_test(host, model, users, turns, workers, max_queue):
+    results = {"ok": 0, "busy": 0}
+    async with ChatGateway(model, host=host, workers=workers, max_queue=max_queue) as gateway:
+        await asyncio.gather(*(simulate_user(gateway, turns, results) for _ in range(users)))
+        gateway.report()
+    print(f"users {users} x {turns} turns: {results['ok']} answered, {results['busy']} busy retries")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the async chat gateway.")
+    parser.add_argument("--model", default="gemma3:1b")
+    parser.add_argument("--host", default=None, help="Ollama URL (default: OLLAMA_HOST or localhost)")
+    parser.add_argument("--fake", action="store_true", help="run against a local FakeOllama server")
+    parser.add_argument("--users", type=int, default=16)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--max-queue", type=int, default=64)
+    args = parser.parse_args()
+
+    if args.fake:
+        from FakeOllama import FakeOllamaServer
+
+        with FakeOllamaServer(token_delay=0.005) as server:
+            asyncio.run(load_test(server.url, args.model, args.users, args.turns, args.workers, args.max_queue))
+    else:
+        asyncio.run(load_test(args.host, args.model, args.users, args.turns, args.workers, args.max_queue))
@@ -0,0 +1,193 @@
+# Token-budgeted chat history.
+#
+# ChatHistory stands in for the plain `chat_history` list. Each message's
+# token count is computed once, when it is appended, using a Hugging Face
+# tokenizer if one is given and about 4 characters per token otherwise.
+# Once the history plus the reserved system prompt goes over the budget,
+# whole turns (a user message and everything after it up to the next user
+# message) are dropped from the front. The current turn, including any
+# pending tool call and its result, is never dropped.
+#
+# If a `summarize` function is given, dropped turns are summarized on a
+# background thread and the summary is sent as a system message ahead of
+# the remaining history, so per-turn prompt size stays bounded without
+# losing the gist of the conversation. The summary is kept to a quarter of
+# the budget; a longer one is condensed again, then cut to fit.
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Tokens the chat template adds around each message (role markers, separators)
+MESSAGE_OVERHEAD = 4
+
+SUMMARY_PROMPT = (
+    "Summarize the conversation below in a few sentences for your own later reference. "
+    "Keep names, cities, email addresses and any decisions or pending requests."
+)
+
+
+def approximate_tokens(text):
+    """About 4 characters per token for English text."""
+    return (len(text) + 3) // 4
+
+
+def tokenizer_counter(name):
+    """Returns a token counting function for a Hugging Face tokenizer, or the approximation if unavailable."""
+    try:
+        from transformers import AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(name)
+    except Exception as e:  # transformers missing, offline, or unknown name
+        print(f"Tokenizer '{name}' unavailable ({e}); estimating 4 characters per token.")
+        return approximate_tokens
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def ollama_summarizer(client, model, max_tokens=200):
+    """Returns a summarize(previous_summary, messages) function that asks `model` for a summary."""
+    def summarize(previous, messages):
+        lines = [f"Earlier summary: {previous}"] if previous else []
+        lines += [f"{m['role']}: {m.get('content', '')}" for m in messages]
+        response = client.chat(
+            model=model,
+            messages=[{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": "\n".join(lines)}],
+            options={"num_predict": max_tokens},
+        )
+        return response['message']['content'].strip()
+    return summarize
+
+
+class ChatHistory:
+    """
+    A list of chat messages kept under `budget` tokens, including `reserved`
+    tokens for the system prompt sent ahead of it. Iterating yields the
+    summary message (if any) followed by the kept messages.
+    """
+
+    def __init__(self, budget=2048, count_tokens=approximate_tokens, reserved=0, summarize=None):
+        self.budget = budget
+        self.count_tokens = count_tokens
+        self.reserved = reserved
+        self.summarize = summarize
+        self._messages = []  # (message, tokens)
+        self._tokens = 0
+        self._summary = None
+        self._summary_tokens = 0
+        self._generation = 0  # bumped by clear() so late summaries of a reset history are discarded
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1) if summarize else None
+        self.stats = {"dropped_turns": 0, "dropped_messages": 0, "summaries": 0, "max_tokens": 0}
+
+    # --- List-like interface ---
+
+    def append(self, message):
+        tokens = self.count_tokens(str(message.get("content") or "")) + MESSAGE_OVERHEAD
+        with self._lock:
+            self._messages.append((message, tokens))
+            self._tokens += tokens
+            dropped = self._compact()
+            self.stats["max_tokens"] = max(self.stats["max_tokens"], self._total())
+        if dropped and self._executor is not None:
+            self._executor.submit(self._summarize, dropped)
+
+    def extend(self, messages):
+        for message in messages:
+            self.append(message)
+
+    def clear(self):
+        with self._lock:
+            self._messages = []
+            self._tokens = 0
+            self._summary = None
+            self._summary_tokens = 0
+            self._generation += 1
+
+    def __iter__(self):
+        with self._lock:
+            messages = [m for m, _ in self._messages]
+            summary = self._summary
+        if summary:
+            yield {"role": "system", "content": f"Summary of the earlier conversation: {summary}"}
+        yield from messages
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __getitem__(self, index):
+        return self._messages[index][0]
+
+    @property
+    def tokens(self):
+        """Tokens of the next prompt: system prompt, summary and kept messages."""
+        with self._lock:
+            return self._total()
+
+    # --- Budget enforcement ---
+
+    def _total(self):
+        return self.reserved + self._summary_tokens + self._tokens
+
+    def _turn_starts(self):
+        return [i for i, (m, _) in enumerate(self._messages) if m.get("role") == "user"]
+
+    def _compact(self):
+        """Drops the oldest whole turns until under budget. Returns the dropped messages."""
+        dropped = []
+        while self._total() > self.budget:
+            starts = self._turn_starts()
+            if len(starts) < 2:
+                break  # Only the current turn is left; it is always kept
+            end = starts[1] if starts[0] == 0 else starts[0]
+            for message, tokens in self._messages[:end]:
+                dropped.append(message)
+                self._tokens -= tokens
+            del self._messages[:end]
+            self.stats["dropped_turns"] += 1
+        self.stats["dropped_messages"] += len(dropped)
+        return dropped
+
+    def _summarize(self, dropped):
+        with self._lock:
+            previous = self._summary
+            generation = self._generation
+        try:
+            summary = self._fit(self.summarize(previous, dropped))
+        except Exception as e:
+            print(f"\n(History summary failed: {e})")
+            return
+        tokens = self.count_tokens(summary) + MESSAGE_OVERHEAD
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._summary = summary
+            self._summary_tokens = tokens
+            self.stats["summaries"] += 1
+            dropped = self._compact()
+        if dropped:
+            self._executor.submit(self._summarize, dropped)
+
+    def _fit(self, summary):
+        """
+        Keeps the summary within a quarter of the budget: a summary that is too
+        long is summarized once more, then cut at a word boundary if needed.
+        """
+        limit = self.budget // 4 - MESSAGE_OVERHEAD
+        if self.count_tokens(summary) <= limit:
+            return summary
+        summary = self.summarize(None, [{"role": "assistant", "content": summary}])
+        tokens = self.count_tokens(summary)
+        while tokens > limit and summary:
+            cut = summary[:max(0, len(summary) * limit // tokens - 1)]
+            summary = cut.rsplit(" ", 1)[0] if " " in cut else cut
+            tokens = self.count_tokens(summary)
+        return summary
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def report(self):
+        s = self.stats
+        print(f"\n--- History (budget {self.budget} tokens) ---")
+        print(f"prompt tokens now {self.tokens}, max {s['max_tokens']}; dropped {s['dropped_turns']} turns "
+              f"({s['dropped_messages']} messages), {s['summaries']} summaries")
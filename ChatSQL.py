@@ -1,14 +1,23 @@
 import json
-#import pyodbc
-import ollama
+import os
+
+from pydantic import ValidationError
+
+from CompletionCache import CompletionCache, cache_key
+from IntentRouter import CITY_PATTERN, IntentRouter
+from ModelCascade import ModelCascade, default_tiers
+from SQLExecutor import DatabaseError, PyODBCBackend, SQLExecutor, SQLiteBackend
+from StreamingJSON import parse_first_object
+from Telemetry import get_telemetry, instrumented_client
+from ToolRegistry import MalformedToolCall, ToolRegistry
 
 # --- 1. Define SQL Operations as Tools ---
-# These remain the same as the previous implementation.
+# Parameters are named after the tool parameters and bound by name.
 SQL_OPERATIONS = {
-    "get_customer_by_id": "SELECT * FROM Customers WHERE CustomerID = ?",
-    "add_new_customer": "INSERT INTO Customers (FirstName, LastName, City) VALUES (?, ?, ?)",
-    "update_customer_city": "UPDATE Customers SET City = ? WHERE CustomerID = ?",
-    "delete_customer": "DELETE FROM Customers WHERE CustomerID = ?"
+    "get_customer_by_id": "SELECT * FROM Customers WHERE CustomerID = :customer_id",
+    "add_new_customer": "INSERT INTO Customers (FirstName, LastName, City) VALUES (:first_name, :last_name, :city)",
+    "update_customer_city": "UPDATE Customers SET City = :new_city WHERE CustomerID = :customer_id",
+    "delete_customer": "DELETE FROM Customers WHERE CustomerID = :customer_id"
 }
 
 # The tool definitions for the model
@@ -65,95 +74,267 @@ tools = [
     }
 ]
 
-# --- 2. The Main Refactored Function ---
-def chat_to_sql_with_tools(user_query):
-    """
-    Handles the entire chat-to-SQL workflow using Ollama for tool calling.
-    """
-    # 1. Generate the prompt for tool use
-    tool_descriptions = "\n".join([
-        f"Tool Name: {t['name']}\nDescription: {t['description']}" for t in tools
-    ])
-    prompt = f"""
+# Each tool's parameters are compiled once into a validator and a JSON schema.
+# TOOL_CALL_SCHEMA is passed as Ollama's `format=` so the model can only
+# return a well-formed call to one of the tools.
+TOOL_REGISTRY = ToolRegistry.from_tool_dicts(tools)
+TOOL_CALL_SCHEMA = TOOL_REGISTRY.call_schema(args_key="parameters")
+
+# Re-asks allowed when a response still fails to parse
+MAX_PARSE_RETRIES = 1
+
+# The static part of the prompt (instructions and tool descriptions) is built
+# once and sent first, as the system message, on every call. Only the user
+# message changes, so Ollama can reuse the cached prompt prefix between calls.
+SQL_SYSTEM_PROMPT = f"""
 You are an AI assistant that can call a set of tools to interact with a SQL database.
 Based on the user's request, identify the appropriate tool to call and the parameters for that tool.
-Respond with a JSON object containing the tool call. Do not generate any other text.
+Respond with a JSON object containing the tool call in the following format. Do not generate any other text.
+{{"tool_name": "name_of_the_tool", "parameters": {{"arg1": "value1"}}}}
 Available Tools:
-{tool_descriptions}
-
-User Request: {user_query}
+{TOOL_REGISTRY.prompt_block()}
 """
 
-    # 2. Get the model's response using Ollama
+# Connection string for your SQL Server, e.g.
+# 'DRIVER={ODBC Driver 17 for SQL Server};SERVER=YourServer;DATABASE=YourDatabase;UID=YourUser;PWD=YourPassword'
+# When CHATSQL_ODBC is not set, a local SQLite database is used instead.
+conn_str = os.environ.get("CHATSQL_ODBC")
+
+def create_executor():
+    """Creates the pooled executor for SQL Server (pyodbc) or local SQLite."""
+    if conn_str:
+        return SQLExecutor(PyODBCBackend(conn_str), SQL_OPERATIONS)
+    executor = SQLExecutor(SQLiteBackend(), SQL_OPERATIONS)
+    executor.create_schema()
+    return executor
+
+# Created on first use, so importing this module does not touch the database
+executor = None
+
+def get_executor():
+    global executor
+    if executor is None:
+        executor = create_executor()
+    return executor
+
+# Requests go to the smallest model first and only escalate to a larger one
+# when its tool call does not validate (or its token logprobs are low). Each
+# tier is a session that keeps its model resident between calls. The
+# instrumented client records Ollama's timings; SQL execution is timed too.
+# The cascade and its client are created on first use, so importing this
+# module does not connect to Ollama.
+telemetry = get_telemetry()
+session = None
+
+def get_session():
+    global session
+    if session is None:
+        session = ModelCascade(default_tiers(('gemma3:1b', 'gemma3:latest', 'llama3.1')), # Use the model names you pulled
+                               client=instrumented_client())
+    return session
+
+def check_tool_call(text):
+    """Raises unless the text is a valid call of a known tool; the cascade escalates on failure."""
+    data = json.loads(text)
+    TOOL_REGISTRY.validate(data["tool_name"], data["parameters"])
+
+# Validated tool calls are cached on disk by the exact request, so a repeated
+# request skips the model (LLM_CACHE=off to always ask it). The stream is
+# cancelled as soon as the JSON object closes, so the parsed object text is
+# stored here rather than by wrapping the client. The cache file is opened on
+# first use, not at import.
+completion_cache = None
+SQL_CHAT_OPTIONS = {'temperature': 0.1} # Lower temperature for more predictable JSON output
+
+def get_completion_cache():
+    global completion_cache
+    if completion_cache is None:
+        completion_cache = CompletionCache()
+    return completion_cache
+
+def cached_tool_call(messages):
+    """Returns (cache key, cached tool-call JSON text or None) for a request."""
+    if not get_completion_cache().cacheable(SQL_CHAT_OPTIONS):
+        return None, None
+    key = cache_key(get_session().model, messages, {"format": TOOL_CALL_SCHEMA, "options": SQL_CHAT_OPTIONS})
+    entry = completion_cache.get(key)
+    return key, "".join(entry[0]) if entry else None
+
+# Requests matching these patterns exactly skip the model. The named groups
+# are the tool parameters. A city is capitalized words only, and the whole
+# request must match, so "add customer Ann Lee from Rome and Bob Day" goes to the model.
+ROUTE_PATTERNS = {
+    "get_customer_by_id": [
+        r"(?:get|show|find|fetch|retrieve|look ?up)\s+(?:me\s+)?(?:the\s+)?customer\s+(?:with\s+)?(?:id\s+|number\s+|#)?(?P<customer_id>\d+)",
+    ],
+    "add_new_customer": [
+        rf"add\s+(?:a\s+)?(?:new\s+)?customer\s+(?P<first_name>[A-Za-z'-]+)\s+(?P<last_name>[A-Za-z'-]+)\s+(?:from|in)\s+(?P<city>{CITY_PATTERN})",
+    ],
+    "update_customer_city": [
+        rf"(?:update|change|set)\s+(?:the\s+)?city\s+(?:of|for)\s+customer\s+(?:id\s+|#)?(?P<customer_id>\d+)\s+to\s+(?P<new_city>{CITY_PATTERN})",
+        rf"(?:move|update)\s+customer\s+(?:id\s+|#)?(?P<customer_id>\d+)\s+to\s+(?P<new_city>{CITY_PATTERN})",
+    ],
+    "delete_customer": [
+        r"(?:delete|remove)\s+customer\s+(?:id\s+|#)?(?P<customer_id>\d+)",
+    ],
+}
+
+# Example requests for the nearest-neighbour classifier
+ROUTE_EXAMPLES = {
+    "get_customer_by_id": ["get customer 42", "show me the details of customer 7", "who is customer number 15"],
+    "add_new_customer": ["add a new customer", "create a customer record"],
+    "update_customer_city": ["change the city of customer 5 to Paris", "customer 3 moved to Berlin"],
+    "delete_customer": ["delete customer 9", "remove customer 12 from the database"],
+}
+
+# Only reads may be dispatched on a similarity match; writes need an exact pattern.
+router = IntentRouter.from_registry(TOOL_REGISTRY, ROUTE_PATTERNS, ROUTE_EXAMPLES,
+                                   nearest_tools={"get_customer_by_id"})
+
+def route_locally(user_query):
+    """Returns a validated (tool_name, params) from the local router, or None."""
+    tool_call = router.route(user_query)
+    if tool_call is None:
+        return None
+    tool_name, params = tool_call
+    try:
+        return tool_name, TOOL_REGISTRY.validate(tool_name, params).model_dump()
+    except ValidationError:
+        router.miss()
+        return None
+
+# --- 2. The Main Refactored Function ---
+def resolve_tool_call(user_query):
+    """
+    Turns a request into a validated (tool_name, params) with the local
+    router or the model. Returns (None, error message) on failure.
+    """
+    # 0. Obvious requests are dispatched by the local router without an LLM call
+    tool_call = route_locally(user_query)
+    if tool_call:
+        tool_name, params = tool_call
+        print(f"(routed locally to {tool_name})")
+        return tool_name, params
+
+    # 1. Get the model's response using Ollama
     # Note: Ensure the Ollama server is running and the model is downloaded.
+    messages = [
+        {'role': 'system', 'content': SQL_SYSTEM_PROMPT},
+        {'role': 'user', 'content': f"User Request: {user_query}"}
+    ]
+    key, cached = cached_tool_call(messages)
     try:
-        response = ollama.chat(
-            model='gemma3:latest', # Use the model name you pulled
-            messages=[{'role': 'user', 'content': prompt}],
-            options={'temperature': 0.1} # Lower temperature for more predictable JSON output
-        )
-        
-        # 3. Extract and parse the JSON response from the model
-        raw_response = response['message']['content']
-        print("--------------------------------------")
-        print(raw_response)
-        start = raw_response.find('{')
-        end = raw_response.rfind('}') + 1
-        raw_response = raw_response[start:end]
-        print(raw_response)
-        print("--------------------------------------")
-        tool_call = json.loads(raw_response.replace('json',''))
-        print(tool_call)
-        tool_name = tool_call.get("tool_name")
-        params = tool_call.get("parameters", {})
-        
-    except (json.JSONDecodeError, KeyError) as e:
-        return f"Error: Could not parse the model's response. The model may not have returned a valid JSON object. Details: {e}"
+        for attempt in range(MAX_PARSE_RETRIES + 1):
+            if attempt:
+                TOOL_REGISTRY.stats.retries += 1
+            if attempt or cached is None:
+                stream = get_session().chat(
+                    messages=messages,
+                    stream=True,
+                    validate=check_tool_call,
+                    format=TOOL_CALL_SCHEMA, # Only valid tool calls can be generated
+                    options=SQL_CHAT_OPTIONS
+                )
+
+                # 2. Parse the JSON as it streams. Generation is cancelled once the
+                # object closes, or as soon as an unknown tool_name appears.
+                raw_response = parse_first_object(stream, on_field=TOOL_REGISTRY.accepts_field).text
+            else:
+                raw_response = cached
+                print("(answered from the completion cache)")
+            print("--------------------------------------")
+            print(raw_response)
+            print("--------------------------------------")
+            try:
+                tool_name, params = TOOL_REGISTRY.parse(raw_response, args_key="parameters", validate=True)
+                if key is not None and raw_response is not cached:
+                    completion_cache.put(key, session.model, [raw_response])
+                break
+            except MalformedToolCall as e:
+                parse_error = e
+        else:
+            return None, f"Error: Could not parse the model's response. The model may not have returned a valid JSON object. Details: {parse_error}"
+
     except Exception as e:
-        return f"Ollama or network error: {e}"
+        return None, f"Ollama or network error: {e}"
 
-    # 4. Find the SQL statement and execute it
-    if tool_name in SQL_OPERATIONS:
-        sql_query = SQL_OPERATIONS[tool_name]
-        param_values = list(params.values()) if params else []
-        return sql_query, param_values
-        
-        # Connection string for your SQL Server
-        # IMPORTANT: Replace these with your actual database credentials
-        conn_str = 'DRIVER={ODBC Driver 17 for SQL Server};SERVER=YourServer;DATABASE=YourDatabase;UID=YourUser;PWD=YourPassword'
-        
-        # try:
-        #     conn = pyodbc.connect(conn_str)
-        #     cursor = conn.cursor()
-            
-        #     # The order of parameters must match the order in the SQL statement
-        #     # This handles cases where a function has no parameters
-        #     param_values = list(params.values()) if params else []
-        #     cursor.execute(sql_query, param_values)
-            
-        #     # Check if it's a SELECT query to fetch results
-        #     if sql_query.upper().strip().startswith("SELECT"):
-        #         results = cursor.fetchall()
-        #         return results
-        #     else:
-        #         conn.commit()
-        #         return "Operation successful."
-                
-        # except pyodbc.Error as ex:
-        #     return f"Database error: {ex}"
-        # finally:
-        #     if 'conn' in locals():
-        #         conn.close()
-    else:
-        return f"Error: The model requested an unsupported tool: {tool_name}"
+    if tool_name not in SQL_OPERATIONS:
+        return None, f"Error: The model requested an unsupported tool: {tool_name}"
+    return tool_name, params
+
+def format_result(tool_name, result):
+    if get_executor().statement(tool_name).is_query:
+        return result
+    if result is None:
+        return "Operation successful."
+    return f"Operation successful. {result} row(s) affected."
+
+def chat_to_sql_with_tools(user_query):
+    """
+    Handles the entire chat-to-SQL workflow using Ollama for tool calling.
+    """
+    tool_name, params = resolve_tool_call(user_query)
+    if tool_name is None:
+        return params
+
+    # 3. Execute the SQL statement for the tool
+    try:
+        with telemetry.timer("tool", tool=tool_name):
+            result = get_executor().execute(tool_name, params)
+    except (DatabaseError, ValueError, TimeoutError) as ex:
+        return f"Database error: {ex}"
+    return format_result(tool_name, result)
+
+def chat_to_sql_batch(user_queries):
+    """
+    Resolves several requests, then executes all their operations in one
+    transaction, with consecutive writes of the same operation sent as a
+    single executemany(). Returns one reply per request.
+    """
+    replies = [None] * len(user_queries)
+    calls = []  # (index, tool_name, params)
+    for i, user_query in enumerate(user_queries):
+        tool_name, params = resolve_tool_call(user_query)
+        if tool_name is None:
+            replies[i] = params
+        else:
+            calls.append((i, tool_name, params))
+    if not calls:
+        return replies
+    try:
+        with telemetry.timer("tool", tool="batch"):
+            results = get_executor().execute_batch([(tool_name, params) for _, tool_name, params in calls])
+    except (DatabaseError, ValueError, TimeoutError) as ex:
+        results = None
+        error = f"Database error (nothing in this batch was applied): {ex}"
+    for n, (i, tool_name, _) in enumerate(calls):
+        replies[i] = error if results is None else format_result(tool_name, results[n])
+    return replies
 
 # --- 3. Example Usage Loop ---
 if __name__ == "__main__":
+    session = get_session()
+    completion_cache = get_completion_cache()
+    print(f"Loading {session.tiers[0].model}...")
+    session.warm()
     print("Welcome to the SQL Chatbot. Type 'exit' to quit.")
     while True:
         user_message = input("You: ")
         if user_message.lower() == "exit":
             break
         
+        # Several requests separated by ';' are executed together as one batch
+        user_queries = [query.strip() for query in user_message.split(";") if query.strip()]
+        if len(user_queries) > 1:
+            for user_query, response in zip(user_queries, chat_to_sql_batch(user_queries)):
+                print(f"Bot ({user_query}):", response)
+            continue
         response = chat_to_sql_with_tools(user_message)
         print("Bot:", response)
+    session.report()
+    TOOL_REGISTRY.stats.report()
+    router.report()
+    completion_cache.report()
+    telemetry.report()
+    if executor is not None:
+        executor.close()
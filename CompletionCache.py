@@ -0,0 +1,341 @@
+# Exact-match completion cache on disk.
+#
+# The key is the SHA-256 of a canonical JSON encoding of the model id, the
+# full message list (or the rendered prompt) and every generation option
+# that can change the output (options, format, tools, max tokens...). Values
+# are the reply as the list of text pieces it was streamed in, so a hit is
+# replayed chunk by chunk to streaming callers just like a live response.
+#
+# Entries live in a small SQLite database. They expire after `ttl` seconds,
+# and the least recently used ones are evicted once the stored text exceeds
+# `max_bytes`. Only completed responses are stored; a stream the caller
+# closes early (e.g. once a JSON object is complete) is not.
+#
+# Sampling runs should not be answered from the cache. Requests with a
+# temperature above `max_temperature` bypass it automatically, and
+# bypass=True (or LLM_CACHE=off in the environment) turns it off entirely.
+# A request without a temperature runs at the backend's default, which for
+# Ollama is 0.8, so it is not cached; HF requests without do_sample are greedy.
+#
+# CachedClient wraps an ollama.Client, CachedBackend wraps any Backend, and
+# cached_generate_batch() fronts HFBatching.generate_batch for a prompt list.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Ollama's temperature when a request does not set one
+OLLAMA_DEFAULT_TEMPERATURE = 0.8
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS completions (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    chunks TEXT NOT NULL,
+    meta TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS completions_last_access ON completions (last_access);
+"""
+
+
+def _jsonable(value):
+    """JSON fallback for ollama/pydantic objects (messages, tool calls) and anything else."""
+    if hasattr(value, "model_dump"):
+        return value.model_dump(exclude_none=True)
+    return str(value)
+
+
+def _field(message, name):
+    """A message field from a dict or an ollama Message object."""
+    return message.get(name) if hasattr(message, "get") else getattr(message, name, None)
+
+
+def hf_default_temperature(model, options=None):
+    """Temperature a transformers model samples at when `options` set none (0.0 when it decodes greedily)."""
+    config = getattr(model, "generation_config", None)
+    do_sample = (options or {}).get("do_sample", getattr(config, "do_sample", False))
+    return (getattr(config, "temperature", None) or 1.0) if do_sample else 0.0
+
+
+def cache_key(model, messages, options=None):
+    """Stable hash of everything that determines a completion."""
+    payload = json.dumps({"model": model, "messages": messages, "options": options or {}},
+                         sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=_jsonable)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """SQLite-backed map from cache_key() to (text pieces, metadata) with TTL and LRU size eviction."""
+
+    def __init__(self, path=".completion_cache.sqlite", max_bytes=64 * 1024 * 1024, ttl=7 * 24 * 3600,
+                 max_temperature=0.3, bypass=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_temperature = max_temperature
+        if bypass is None:
+            bypass = os.environ.get("LLM_CACHE", "").lower() in ("off", "0", "false", "bypass")
+        self.bypass = bypass
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+        self.stats = {"hits": 0, "misses": 0, "bypassed": 0, "stores": 0, "expired": 0, "evicted": 0}
+
+    def cacheable(self, options=None, default_temperature=OLLAMA_DEFAULT_TEMPERATURE):
+        """
+        False for sampling requests (temperature above max_temperature) or when
+        bypassed. A missing temperature counts as `default_temperature`, the
+        backend's own default; do_sample=False is greedy.
+        """
+        options = options or {}
+        if options.get("do_sample") is False:
+            temperature = 0.0
+        else:
+            temperature = options.get("temperature", default_temperature)
+        if self.bypass or (temperature is not None and temperature > self.max_temperature):
+            with self._lock:
+                self.stats["bypassed"] += 1
+            return False
+        return True
+
+    def get(self, key):
+        """Returns (chunks, meta) for a live entry, or None. Counts a hit or a miss."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT chunks, meta, created_at FROM completions WHERE key = ?",
+                                   (key,)).fetchone()
+            if row is not None and now - row[2] > self.ttl:
+                self._db.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self._db.commit()
+                self.stats["expired"] += 1
+                row = None
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self._db.execute("UPDATE completions SET last_access = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self.stats["hits"] += 1
+        return json.loads(row[0]), json.loads(row[1])
+
+    def put(self, key, model, chunks, meta=None):
+        """Stores a completed reply's text pieces, then evicts down to max_bytes."""
+        chunks_json = json.dumps(list(chunks), ensure_ascii=False)
+        meta_json = json.dumps(meta or {}, default=_jsonable)
+        size = len(chunks_json.encode("utf-8")) + len(meta_json)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO completions (key, model, chunks, meta, size, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model, chunks_json, meta_json, size, now, now),
+            )
+            self.stats["stores"] += 1
+            self._evict(now)
+            self._db.commit()
+
+    def _evict(self, now):
+        """Drops expired entries, then least recently used ones until under max_bytes. Caller holds the lock."""
+        self.stats["expired"] += self._db.execute("DELETE FROM completions WHERE created_at < ?",
+                                                  (now - self.ttl,)).rowcount
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+        while total > self.max_bytes:
+            row = self._db.execute("SELECT key, size FROM completions ORDER BY last_access LIMIT 1").fetchone()
+            if row is None:
+                break
+            self._db.execute("DELETE FROM completions WHERE key = ?", (row[0],))
+            self.stats["evicted"] += 1
+            total -= row[1]
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM completions")
+            self._db.commit()
+
+    @property
+    def hit_rate(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+    def report(self):
+        s = self.stats
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions").fetchone()
+        print(f"\n--- Completion cache ({entries} entries, {size / 1024:.1f} KiB) ---")
+        print(f"hits {s['hits']}, misses {s['misses']} (hit rate {self.hit_rate:.0%}), bypassed {s['bypassed']}, "
+              f"stored {s['stores']}, expired {s['expired']}, evicted {s['evicted']}")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class CachedClient:
+    """
+    Drop-in wrapper for an ollama.Client whose chat() is answered from the
+    cache when possible. Everything else is passed through to the client.
+    """
+
+    # chat() arguments that do not change the reply
+    IGNORED = ("model", "messages", "stream", "keep_alive")
+
+    def __init__(self, client, cache):
+        self.client = client
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def close(self):
+        """Closes the wrapped client's connections."""
+        close = getattr(self.client, "close", None)
+        if close is not None:
+            close()
+        else:
+            self.client._client.close()  # Older ollama clients have no public close()
+
+    def chat(self, model="", messages=None, stream=False, **kwargs):
+        options = {k: v for k, v in kwargs.items() if k not in self.IGNORED}
+        if not self.cache.cacheable(kwargs.get("options")):
+            return self.client.chat(model=model, messages=messages, stream=stream, **kwargs)
+        key = cache_key(model, messages, options)
+        entry = self.cache.get(key)
+        if entry is not None:
+            chunks, meta = entry
+            return self._replay(model, chunks, meta) if stream else self._response(model, "".join(chunks), meta)
+
+        response = self.client.chat(model=model, messages=messages, stream=stream, **kwargs)
+        if stream:
+            return self._recording_stream(key, model, response)
+        message = response["message"]
+        self.cache.put(key, model, [message["content"] or ""], self._meta(response))
+        return response
+
+    @staticmethod
+    def _meta(response):
+        message = response["message"]
+        meta = {name: response.get(name) for name in ("done_reason", "eval_count", "prompt_eval_count", "logprobs")}
+        for name in ("tool_calls", "thinking"):
+            if _field(message, name):
+                meta[name] = _field(message, name)
+        return meta
+
+    @staticmethod
+    def _message(content, meta):
+        message = {"role": "assistant", "content": content}
+        for name in ("tool_calls", "thinking"):
+            if meta.get(name):
+                message[name] = meta[name]
+        return message
+
+    def _response(self, model, content, meta):
+        import ollama
+
+        # A real ChatResponse, so callers can use attribute access as well as indexing
+        return ollama.ChatResponse(model=model, message=self._message(content, meta), done=True,
+                                   done_reason=meta.get("done_reason"), eval_count=meta.get("eval_count"),
+                                   prompt_eval_count=meta.get("prompt_eval_count"), logprobs=meta.get("logprobs"))
+
+    def _replay(self, model, chunks, meta):
+        import ollama
+
+        for text in chunks:
+            yield ollama.ChatResponse(model=model, message={"role": "assistant", "content": text}, done=False)
+        yield self._response(model, "", meta)
+
+    def _recording_stream(self, key, model, stream):
+        pieces = []
+        tool_calls = []
+        try:
+            for chunk in stream:
+                message = chunk["message"]
+                if message["content"]:
+                    pieces.append(message["content"])
+                tool_calls.extend(_field(message, "tool_calls") or [])
+                if chunk.get("done"):
+                    meta = self._meta(chunk)
+                    if tool_calls:
+                        meta["tool_calls"] = tool_calls
+                    self.cache.put(key, model, pieces, meta)
+                yield chunk
+        finally:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+
+
+class CachedBackend:
+    """Wraps a Backends.Backend so repeated requests are replayed from the cache."""
+
+    def __init__(self, backend, cache):
+        self.backend = backend
+        self.cache = cache
+        self.name = backend.name
+        self.model = backend.model
+        self.last_token_count = 0
+
+    def stream(self, messages, max_new_tokens=256):
+        backend = self.backend
+        options = {"backend": backend.name, "max_new_tokens": max_new_tokens,
+                   **getattr(backend, "options", {}), **getattr(backend, "generate_kwargs", {})}
+        if not self.cache.cacheable(options, self._default_temperature(options)):
+            yield from backend.stream(messages, max_new_tokens)
+            self.last_token_count = backend.last_token_count
+            return
+        key = cache_key(backend.model, messages, options)
+        entry = self.cache.get(key)
+        if entry is not None:
+            chunks, meta = entry
+            self.last_token_count = meta.get("tokens", 0)
+            yield from chunks
+            return
+        pieces = []
+        for text in backend.stream(messages, max_new_tokens):
+            pieces.append(text)
+            yield text
+        self.last_token_count = backend.last_token_count
+        self.cache.put(key, backend.model, pieces, {"tokens": backend.last_token_count})
+
+    def _default_temperature(self, options):
+        backend = self.backend
+        if backend.name == "ollama":
+            return OLLAMA_DEFAULT_TEMPERATURE
+        model = getattr(backend, "hf_model", None) or getattr(getattr(backend, "pipe", None), "model", None)
+        # The gemma sampler decodes greedily unless told otherwise
+        return hf_default_temperature(model, options) if model is not None else 0.0
+
+    def close(self):
+        self.backend.close()
+
+
+def cached_generate_batch(cache, model_id, model, tokenizer, prompts, **kwargs):
+    """
+    HFBatching.generate_batch() for only the prompts not already cached.
+    Returns the answers in prompt order.
+    """
+    from HFBatching import generate_batch
+
+    options = {k: v for k, v in kwargs.items() if k not in ("max_batch_size", "bucket_width", "stats")}
+    if not cache.cacheable(options, hf_default_temperature(model, options)):
+        return generate_batch(model, tokenizer, prompts, **kwargs)
+    keys = [cache_key(model_id, prompt, options) for prompt in prompts]
+    answers = [None] * len(prompts)
+    missing = []
+    for i, key in enumerate(keys):
+        entry = cache.get(key)
+        if entry is None:
+            missing.append(i)
+        else:
+            answers[i] = "".join(entry[0])
+    if missing:
+        generated = generate_batch(model, tokenizer, [prompts[i] for i in missing], **kwargs)
+        for i, answer in zip(missing, generated):
+            answers[i] = answer
+            cache.put(keys[i], model_id, [answer])
+    return answers
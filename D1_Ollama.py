@@ -1,4 +1,7 @@
-import ollama
+from CompletionCache import CachedClient, CompletionCache
+from ModelCascade import ModelCascade, default_tiers
+from OllamaSession import OllamaSession
+from Telemetry import get_telemetry, instrumented_client
 
 model0 = 'gemma3:1b'
 model1 = 'gemma3:latest'
@@ -6,22 +9,48 @@ model2 = 'llama3.1'
 model3 = 'gpt-oss'
 model = model0
 
-client = ollama.Client()
+# With the cascade every prompt is answered by model0 first and only passed
+# on to model1..model3 when the reply fails a cheap check (low token
+# logprobs, a refusal, an empty or cut-off reply). Set use_cascade = False to
+# always ask `model`.
+use_cascade = True
+
+# The session keeps the model loaded between prompts (keep_alive) and
+# preloads it before the first prompt. The instrumented client records
+# Ollama's load/prefill/decode timings for every request. Prompts asked
+# before are replayed from the on-disk completion cache (LLM_CACHE=off to
+# always ask the model). Only low-temperature requests are cached, so the
+# temperature is set explicitly instead of using Ollama's default of 0.8.
+chat_options = {'temperature': 0.2}
+completion_cache = CompletionCache()
+cached_client = CachedClient(instrumented_client(), completion_cache)
+if use_cascade:
+    session = ModelCascade(default_tiers([model0, model1, model2, model3]), client=cached_client)
+else:
+    session = OllamaSession(model, client=cached_client)
+client = session.client
 try:
+    print(f"Loading {model0 if use_cascade else model}...")
+    session.warm()
     while True:
-        prompt = input(f'\nAsk {model}?\n')
+        prompt = input(f'\nAsk {session.model}?\n')
         if prompt == '/bye':
             break
         
-        stream = client.chat(
-            model=model,
+        stream = session.chat(
             messages=[{'role': 'user', 'content': prompt}],
-            stream=True
+            stream=True,
+            options=chat_options
         )
         
         for chunk in stream:
             print(chunk['message']['content'], end='', flush=True)
+        if use_cascade:
+            print(f"\n[{session.tiers[session.last_tier].model}]")
 finally:
+    session.report()
+    completion_cache.report()
+    get_telemetry().report()
     # Explicitly close the client and its underlying connections
-    client._client.close()
+    client.close()
     print("\nOllama client connection closed.")
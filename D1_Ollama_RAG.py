@@ -1,80 +1,262 @@
+import argparse
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
 import ollama
-import requests
-from bs4 import BeautifulSoup
+
+from HTMLText import StreamingTextExtractor, extract_text, text_key
+from PageCache import PageCache
+from RAGBatch import parse_batch_file, run_batch
+from RAGRetrieval import PageIndex
+from Telemetry import get_telemetry, instrumented_client
+from VectorStore import VectorStore
+
+# Downloaded pages and their extracted text are cached on disk and revalidated
+# with conditional GETs, so asking about a known page skips network and parsing.
+page_cache = PageCache()
+
+# Request timings (Ollama's own fields plus page fetch/parse and indexing)
+telemetry = get_telemetry()
+
+# Text extraction stops after this many characters (None extracts the whole page)
+max_text_chars = None
+
+# Failures of an Ollama call: an error reply, or the server being unreachable
+OLLAMA_ERRORS = (ollama.ResponseError, ConnectionError, httpx.HTTPError)
+
+def ollama_error(e):
+    """Readable message for one of OLLAMA_ERRORS."""
+    return e.error if isinstance(e, ollama.ResponseError) else str(e)
 
 def get_page_content(url):
-    """Downloads the content of a webpage from the given URL."""
-    try:
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an exception for HTTP errors
-        return response.text
-    except requests.exceptions.RequestException as e:
-        print(f"Error downloading page from {url}: {e}")
-        return None
+    """Downloads the content of a webpage from the given URL (or the page cache)."""
+    return page_cache.get_body(url)
+
+def get_page_text(url):
+    """Returns the readable text of a webpage, extracting it only when the page changed."""
+    # Fresh downloads are parsed chunk by chunk while they arrive
+    with telemetry.timer("fetch_parse"):
+        return page_cache.get_text(url, extract_text_from_html,
+                                   make_extractor=lambda: StreamingTextExtractor(max_text_chars),
+                                   text_key=text_key(max_text_chars))
 
 def extract_text_from_html(html_content):
     """Extracts readable text from HTML content."""
-    if not html_content:
-        return ""
-    soup = BeautifulSoup(html_content, 'html.parser')
-    # Remove script and style elements
-    for script_or_style in soup(['script', 'style']):
-        script_or_style.extract()
-    text = soup.get_text()
-    # Break into lines and remove leading/trailing space on each
-    lines = (line.strip() for line in text.splitlines())
-    # Break multi-hyphenated words and remove empty lines
-    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-    # Drop blank lines
-    text = '\n'.join(chunk for chunk in chunks if chunk)
-    return text
+    return extract_text(html_content, max_text_chars)
 
 model = 'gemma3' # You can change this to any Ollama model you have
-client = ollama.Client()
-
-while True:
-    url = input("\nEnter a URL to analyze or type '/bye' to exit: ")
-    if url == '/bye':
-        break
-
-    print(f"\nDownloading content from: {url}")
-    html_content = get_page_content(url)
-
-    if html_content:
-        print("Extracting text from HTML...")
-        page_text = extract_text_from_html(html_content)
-        
-        if not page_text.strip():
-            print("No readable text found on the page.")
+
+# Retrieval settings: only the top_k best matching chunks are sent to the model,
+# so prompt size no longer grows with the size of the page.
+chunk_size = 1500   # characters per chunk
+chunk_overlap = 200 # characters repeated between neighbouring chunks
+top_k = 4           # chunks sent with each question
+embed_model = None  # e.g. 'nomic-embed-text' to add embedding search on top of BM25
+
+# With a store directory (--store), every indexed page is also embedded into a
+# persistent on-disk vector store, so '/all' can answer from all pages seen so
+# far (across runs) without re-fetching or re-embedding them. Off by default,
+# since it needs store_embed_model pulled in Ollama.
+store_dir = None
+store_embed_model = 'nomic-embed-text'
+store_nprobe = None  # IVF lists searched once the store has an index (see VectorStore.build_ivf)
+
+def build_prompt(context, question):
+    """Builds the question prompt from the retrieved chunks."""
+    return f"Based on the following text, please answer the question.\n\n--- TEXT ---\n{context}\n\n--- QUESTION ---\n{question}"
+
+def build_index(client, page_text):
+    """Chunks and indexes the page text, falling back to BM25 if embedding fails."""
+    with telemetry.timer("index"):
+        try:
+            return PageIndex(page_text, chunk_size, chunk_overlap, client=client, embed_model=embed_model)
+        except OLLAMA_ERRORS as e:
+            print(f"Embedding failed ({ollama_error(e)}), falling back to BM25 only.")
+            return PageIndex(page_text, chunk_size, chunk_overlap)
+
+def open_store():
+    """Maps the vector store from disk (instant at any size), or None if disabled."""
+    return VectorStore(store_dir) if store_dir else None
+
+def store_page(client, store, url, page_text, index):
+    """Adds an indexed page to the vector store unless the same text is already stored."""
+    if store is None or not index.chunks:
+        return
+    fingerprint = hashlib.sha256(page_text.encode("utf-8")).hexdigest()
+    if store.fingerprint(url) == fingerprint:
+        return
+    try:
+        with telemetry.timer("store"):
+            if index.embeddings is not None and index.embed_model == store_embed_model:
+                embeddings = index.embeddings
+            else:
+                embeddings = client.embed(model=store_embed_model, input=index.chunks)["embeddings"]
+            store.add(url, index.chunks, embeddings, fingerprint)
+    except OLLAMA_ERRORS as e:
+        print(f"Could not add the page to the vector store ({ollama_error(e)}).")
+
+def store_context(client, store, question):
+    """Top chunks for the question from every stored page, labelled with their source."""
+    query_vec = client.embed(model=store_embed_model, input=question)["embeddings"][0]
+    hits = store.search(query_vec, k=top_k, nprobe=store_nprobe)
+    return "\n\n...\n\n".join(f"[{source}]\n{text}" for _, source, text in hits), len(hits)
+
+def answer_question(client, index, question):
+    """Streams the model's answer to a question about an indexed page."""
+    try:
+        # With embed_model set this embeds the question, which can fail like any Ollama call
+        context = index.context_for(question, k=top_k)
+    except OLLAMA_ERRORS as e:
+        print(f"\nError from Ollama: {ollama_error(e)}")
+        return
+    except Exception as e:
+        print(f"\nAn unexpected error occurred: {e}")
+        return
+    print(f"\n--- Answering with {model} ({min(top_k, len(index.chunks))} of {len(index.chunks)} chunks) ---")
+    stream_answer(client, build_prompt(context, question))
+
+def answer_from_store(client, store, question):
+    """Streams the model's answer to a question about all pages in the vector store."""
+    try:
+        context, hits = store_context(client, store, question)
+    except OLLAMA_ERRORS as e:
+        print(f"\nError from Ollama: {ollama_error(e)}")
+        return
+    print(f"\n--- Answering with {model} ({hits} chunks from {len(store.documents)} stored pages) ---")
+    stream_answer(client, build_prompt(context, question))
+
+def answer_text(client, index, question):
+    """The model's full answer to a question about an indexed page, or an error message."""
+    try:
+        context = index.context_for(question, k=top_k)
+        response = client.chat(
+            model=model,
+            messages=[{'role': 'user', 'content': build_prompt(context, question)}],
+        )
+        return response['message']['content']
+    except OLLAMA_ERRORS as e:
+        return f"Error from Ollama: {ollama_error(e)}"
+    except Exception as e:
+        return f"An unexpected error occurred: {e}"
+
+def stream_answer(client, prompt):
+    """Streams the model's answer to a prompt."""
+    try:
+        # Using stream=True to get a streaming response
+        stream = client.chat(
+            model=model,
+            messages=[{'role': 'user', 'content': prompt}],
+            stream=True,
+        )
+
+        # Print the streaming response
+        for chunk in stream:
+            print(chunk['message']['content'], end='', flush=True)
+        print("\n\n--- End of Answer ---")
+    except OLLAMA_ERRORS as e:
+        print(f"\nError from Ollama: {ollama_error(e)}")
+    except Exception as e:
+        print(f"\nAn unexpected error occurred: {e}")
+
+def main():
+    client = instrumented_client()
+    store = open_store()
+    # Pages are chunked and indexed once per URL and reused for later questions
+    page_indexes = {}
+
+    while True:
+        url = input("\nEnter a URL to analyze, '/all' to ask about every stored page, or '/bye' to exit: ")
+        if url == '/bye':
+            break
+
+        if url == '/all':
+            if store is None:
+                print("The vector store is off. Start with --store DIR to keep pages across runs.")
+                continue
+            if not store.documents:
+                print("The vector store is empty. Analyze a page first.")
+                continue
+            user_prompt = input(f"\nWhat would you like to ask about the {len(store.documents)} stored pages?\n> ")
+            if user_prompt.strip():
+                answer_from_store(client, store, user_prompt)
             continue
 
-        # Limit the text length to avoid exceeding model context window
-        max_text_length = 124000  # Adjust based on your model's context window
-        if len(page_text) > max_text_length:
-            print(f"Trimming text from {len(page_text)} to {max_text_length} characters.")
-            page_text = page_text[:max_text_length]
-        
+        index = page_indexes.get(url)
+        if index is None:
+            print(f"\nLoading content from: {url}")
+            page_text = get_page_text(url)
+            if page_text is None:
+                continue
+
+            if not page_text.strip():
+                print("No readable text found on the page.")
+                continue
+
+            print("Indexing page...")
+            index = build_index(client, page_text)
+            page_indexes[url] = index
+            print(f"Indexed {len(page_text)} characters as {len(index.chunks)} chunks.")
+            store_page(client, store, url, page_text, index)
+
         user_prompt = input("\nWhat would you like to ask about this page? (e.g., 'Summarize this page')\n> ")
         if not user_prompt.strip():
             print("No prompt provided. Please enter a URL and a prompt.")
             continue
 
-        prompt = f"Based on the following text, please answer the question.\n\n--- TEXT ---\n{page_text}\n\n--- QUESTION ---\n{user_prompt}"
+        answer_question(client, index, user_prompt)
 
-        print(f"\n--- Answering with {model} ---")
-        try:
-            # Using stream=True to get a streaming response
-            stream = client.chat(
-                model=model,
-                messages=[{'role': 'user', 'content': prompt}],
-                stream=True,
-            )
-
-            # Print the streaming response
-            for chunk in stream:
-                print(chunk['message']['content'], end='', flush=True)
-            print("\n\n--- End of Answer ---")
-        except ollama.ResponseError as e:
-            print(f"\nError from Ollama: {e.error}")
-        except Exception as e:
-            print(f"\nAn unexpected error occurred: {e}")
\ No newline at end of file
+def main_batch(path, fetch_workers=8, per_host=2, answer_workers=2):
+    """Answers every question in a prompts.txt-style file, indexing pages as they load."""
+    client = instrumented_client()
+    store = open_store()
+    jobs = parse_batch_file(path)
+    print(f"Loading {len(jobs)} pages ({fetch_workers} downloads at once, {per_host} per host)...")
+
+    # Questions are answered by a pool while later pages are still loading, and
+    # each answer is printed as soon as it is done. Whole answers are printed
+    # under a lock so output from different pages does not interleave.
+    print_lock = threading.Lock()
+
+    def show(url, text):
+        with print_lock:
+            print(f"\n===== {url} =====\n{text}", flush=True)
+
+    with ThreadPoolExecutor(max_workers=answer_workers) as answer_pool:
+
+        def on_page(url, page_text, questions):
+            if page_text is None:
+                show(url, "Could not fetch the page.")
+                return
+            if not page_text.strip():
+                show(url, "No readable text found on the page.")
+                return
+            index = build_index(client, page_text)
+            store_page(client, store, url, page_text, index)
+            for question in questions:
+                future = answer_pool.submit(answer_text, client, index, question)
+                future.add_done_callback(lambda f, question=question: show(
+                    url, f"Question: {question}\n\n{f.result()}\n\n--- End of Answer ---"))
+
+        run_batch(jobs, page_cache, on_page, fetch_workers=fetch_workers, per_host=per_host,
+                  max_chars=max_text_chars)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ask questions about web pages with a local Ollama model.")
+    parser.add_argument("--batch", help="file of URLs and questions in the shape of prompts.txt")
+    parser.add_argument("--fetch-workers", type=int, default=8, help="concurrent downloads in batch mode")
+    parser.add_argument("--per-host", type=int, default=2, help="concurrent downloads per host in batch mode")
+    parser.add_argument("--answer-workers", type=int, default=2, help="questions answered at once in batch mode")
+    parser.add_argument("--store", default=None, metavar="DIR",
+                        help="keep every indexed page in a persistent vector store in DIR (e.g. .rag_store)")
+    args = parser.parse_args()
+    store_dir = args.store
+    try:
+        if args.batch:
+            main_batch(args.batch, args.fetch_workers, args.per_host, args.answer_workers)
+        else:
+            main()
+    finally:
+        page_cache.close()
+        telemetry.report()
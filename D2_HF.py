@@ -1,6 +1,10 @@
 from transformers import pipeline
 import torch
 
+from CompletionCache import CompletionCache, cached_generate_batch
+from CPUProfile import load_model
+from SpeculativeDecoding import print_stats, speculative_generate
+
 # Check if GPU is available
 gpu_available = torch.cuda.is_available()
 device_name = torch.cuda.get_device_name(0) if gpu_available else "No GPU found"
@@ -12,28 +16,65 @@ model_id1 = "meta-llama/Meta-Llama-3.1-8B-Instruct"
 model_id2 = "meta-llama/Llama-3.2-1B"
 model_id3 = "meta-llama/Llama-3.1-8B"
 
-pipeline1 = pipeline(
-    "text-generation",
-    model=model_id1,
-    model_kwargs={"torch_dtype": torch.bfloat16},
-    device_map="auto",
-)
-
-messages = [
-    #{"role": "system", "content": "You are a pirate chatbot who always responds in pirate speak!"},
-    {"role": "system", "content": "You are the wise professor who always uses big words and explain things with great detail."},
-    {"role": "user", "content": "How many planets in the solar system?"},
+# On a GPU this loads bfloat16 weights with device_map="auto"; without one,
+# CPUProfile loads an int8-quantized, memory-mapped snapshot instead.
+model1, tokenizer1 = load_model(model_id1, torch_dtype=torch.bfloat16, device_map="auto")
+pipeline1 = pipeline("text-generation", model=model1, tokenizer=tokenizer1)
+
+system_prompt = {"role": "system", "content": "You are the wise professor who always uses big words and explain things with great detail."}
+#system_prompt = {"role": "system", "content": "You are a pirate chatbot who always responds in pirate speak!"}
+
+questions = [
+    "How many planets in the solar system?",
+    "Why is Pluto no longer called a planet?",
+    "Which planet has the most moons?",
 ]
 
+prompts = [
+    pipeline1.tokenizer.apply_chat_template(
+        [system_prompt, {"role": "user", "content": question}], tokenize=False, add_generation_prompt=True
+    )
+    for question in questions
+]
+
+# Speculative decoding: the small model_id2 drafts `lookahead` tokens at a
+# time and the 8B model verifies them in one pass. Decoding is greedy, and
+# the output matches what the 8B model alone would produce greedily.
+use_speculative = False
+lookahead = 4
+
+if use_speculative:
+    draft_model, _ = load_model(model_id2, torch_dtype=torch.bfloat16, device_map="auto")
+    answers = []
+    for prompt in prompts:
+        input_ids = tokenizer1(prompt, add_special_tokens=False)["input_ids"]
+        result = speculative_generate(model1, draft_model, input_ids, max_new_tokens=1024, lookahead=lookahead,
+                                      eos_token_id=model1.generation_config.eos_token_id)
+        answers.append(tokenizer1.decode(result["tokens"], skip_special_tokens=True))
+        print_stats(result, lookahead)
+else:
+    # All questions are generated together: the prompts are grouped by length and
+    # run as left-padded batches, and the answers come back in question order.
+    # Questions answered before with the same settings come from the on-disk
+    # completion cache; only the rest are generated (LLM_CACHE=off to skip it).
+    completion_cache = CompletionCache()
+    answers = cached_generate_batch(
+        completion_cache,
+        model_id1,
+        pipeline1.model,
+        pipeline1.tokenizer,
+        prompts,
+        max_batch_size=8,
+        add_special_tokens=False,
+        max_new_tokens=1024,
+        do_sample=True,
+        temperature=0.1,
+        top_p=0.95
+    )
 
-outputs = pipeline1(
-    messages,
-    max_new_tokens=1024,
-    do_sample=True,
-    temperature=0.1,
-    top_p=0.95
-)
-question = messages[-1]["content"]
-print(f"\nQuestion to professor:{question}\n")
+for question, answer in zip(questions, answers):
+    print(f"\nQuestion to professor:{question}\n")
+    print(answer)
 
-print(outputs[0]["generated_text"][-1]['content'])
\ No newline at end of file
+if not use_speculative:
+    completion_cache.report()
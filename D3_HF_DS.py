@@ -1,21 +1,24 @@
 # Load model directly
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
+
+from CPUProfile import load_model
+from HFStreaming import BoxedAnswer, print_summary, stream_generate
 
 LLM = "deepseek-ai/DeepSeek-V3.1-Base"
 #LLM = "deepseek-ai/DeepSeek-R1-Distill-Qwen-7B"
 #LLM = "deepseek-ai/DeepSeek-R1-Distill-Llama-8B"
 
 
-tokenizer = AutoTokenizer.from_pretrained(LLM, trust_remote_code=True)
-
 # To speed up inference, we can make several optimizations:
 # 1. torch_dtype=torch.bfloat16: Use bfloat16 for faster computation and less memory,
 #    if your GPU supports it (Ampere or newer). Use torch.float16 for older GPUs.
 # 2. attn_implementation="flash_attention_2": Use Flash Attention for a significant speed boost
 #    on compatible hardware (Ampere or newer). Requires `flash-attn` to be installed.
 # 3. device_map="auto" is good, but for single-GPU, device_map="cuda" is also fine.
-model = AutoModelForCausalLM.from_pretrained(
+# 4. Without a GPU, load_model() switches to the CPU profile: float32 weights
+#    with int8 dynamic quantization of the Linear layers, tuned thread counts,
+#    and a memory-mapped local snapshot so later runs start quickly.
+model, tokenizer = load_model(
     LLM,
     trust_remote_code=True,
     torch_dtype=torch.bfloat16,
@@ -38,5 +41,15 @@ inputs = tokenizer.apply_chat_template(
     return_tensors="pt",
 ).to(model.device)
 
-outputs = model.generate(**inputs, max_new_tokens=500)
-print(tokenizer.decode(outputs[0][inputs["input_ids"].shape[-1]:]))
\ No newline at end of file
+# Stream the answer as it is generated and stop as soon as the \boxed{} answer
+# is complete (or at a stop string / token budget) instead of always running
+# all 500 tokens.
+result = stream_generate(
+    model,
+    tokenizer,
+    inputs,
+    conditions=[BoxedAnswer()],  # HFStreaming.StopString / TokenBudget can be added here
+    max_new_tokens=500,
+    on_text=lambda text: print(text, end="", flush=True),
+)
+print_summary(result)
@@ -1,17 +1,24 @@
 import torch
 from transformers import pipeline
 
+from CompletionCache import CompletionCache, cache_key, cached_generate_batch, hf_default_temperature
+from CPUProfile import load_model
+from PrefixCache import PrefixCache, split_prompt
+
 # 1. Initialize the pipeline
 # We use the "text-generation" task because Gemma is a generative model.
 # "google/gemma-2b-it" is an instruction-tuned version, great for Q&A.
-pipe = pipeline(
-    "text-generation",
-    #model="google/gemma-2b-it",
-    model="google/gemma-3-4b-it",
-    ##model="unsloth/gemma-3-27b-it-qat",
-    model_kwargs={"torch_dtype": torch.bfloat16}, # Use bfloat16 for less memory
-    device="cuda", # Use "cuda" for GPU or "cpu" for CPU
+# Without a GPU, load_model() uses the CPU profile (int8 Linear layers and a
+# memory-mapped snapshot) instead of bfloat16 on "cuda".
+model_id = "google/gemma-3-4b-it"
+#model_id = "google/gemma-2b-it"
+##model_id = "unsloth/gemma-3-27b-it-qat"
+model, tokenizer = load_model(
+    model_id,
+    torch_dtype=torch.bfloat16, # Use bfloat16 for less memory
+    device_map="cuda",
 )
+pipe = pipeline("text-generation", model=model, tokenizer=tokenizer)
 
 # 2. Define your context and question
 context = """
@@ -30,28 +37,62 @@ questions = ["Who is the president of France?",
 # 3. Create a prompt for the model
 # Gemma models respond well to a specific chat-like format. We create a prompt
 # that instructs the model to answer the question based *only* on the provided text.
+prompts = []
 for question in questions:
     messages = [
         {"role": "user", "content": f"Answer the following question based only on the provided context.\n\nContext:\n{context}\n\nQuestion:\n{question}"},
     ]
-    print(f"Question: {question}")
-
 
     # The apply_chat_template function formats the input correctly for the model.
-    prompt = pipe.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-
-    # 4. Generate the answer
-    outputs = pipe(
-        prompt,
-        max_new_tokens=256, # The maximum number of tokens (words/sub-words) to generate
-        do_sample=True,
-        temperature=0.1, # Lower temperature = more predictable, less "creative" output
-        top_p=0.95,
-    )
-
-    # 5. Print the result
-    # The output contains the original prompt, so we extract only the generated text.
-    generated_text = outputs[0]["generated_text"]
-    answer = generated_text[len(prompt):] # Get the text that comes after the prompt
+    prompts.append(pipe.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True))
+
+generation_kwargs = dict(
+    max_new_tokens=256, # The maximum number of tokens (words/sub-words) to generate
+    do_sample=True,
+    temperature=0.1, # Lower temperature = more predictable, less "creative" output
+    top_p=0.95,
+)
+
+# 4. Generate the answers
+# Every prompt starts with the same instruction and context, so by default
+# that prefix is prefilled once and its KV cache is reused. Only each
+# question's own tokens are prefilled. With use_prefix_cache = False the
+# prompts are instead grouped by length and run as left-padded batches. In
+# both modes the answers come back in question order and contain only the
+# generated text. The prompts already start with the BOS token from the chat
+# template, so none is added.
+# Questions answered before with the same settings are replayed from the
+# on-disk completion cache in either mode (LLM_CACHE=off to skip it).
+use_prefix_cache = True
+completion_cache = CompletionCache()
+
+if use_prefix_cache:
+    prefix_cache = PrefixCache(pipe.model)
+    use_completion_cache = completion_cache.cacheable(generation_kwargs,
+                                                      hf_default_temperature(pipe.model, generation_kwargs))
+    answers = []
+    for question, prompt in zip(questions, prompts):
+        key = cache_key(model_id, prompt, generation_kwargs)
+        cached = completion_cache.get(key) if use_completion_cache else None
+        if cached is not None:
+            answers.append("".join(cached[0]))
+            continue
+        prefix_text = prompt[:prompt.rindex(question)]
+        ids, prefix_length = split_prompt(pipe.tokenizer, prompt, prefix_text, add_special_tokens=False)
+        new_tokens = prefix_cache.generate(ids, prefix_length, **generation_kwargs)
+        answers.append(pipe.tokenizer.decode(new_tokens, skip_special_tokens=True))
+        if use_completion_cache:
+            completion_cache.put(key, model_id, [answers[-1]])
+else:
+    answers = cached_generate_batch(completion_cache, model_id, pipe.model, pipe.tokenizer, prompts,
+                                    max_batch_size=8, add_special_tokens=False, **generation_kwargs)
+
+# 5. Print the results
+for question, answer in zip(questions, answers):
+    print(f"Question: {question}")
     print(answer)
-    print("-"*50)
\ No newline at end of file
+    print("-"*50)
+
+if use_prefix_cache:
+    prefix_cache.report()
+completion_cache.report()
@@ -0,0 +1,222 @@
+# A small fake Ollama server for local tests and benchmarks.
+#
+# It speaks enough of the Ollama HTTP API (/api/chat, /api/generate,
+# /api/embed, /api/show, /api/tags, /api/version) for the ollama Python
+# client to work against it, streams NDJSON chunks with a configurable
+# prefill and per-token delay, and fills in the timing fields
+# (load_duration, prompt_eval_count, eval_duration, ...) like the real server.
+#
+#   python FakeOllama.py --port 11435 --token-delay 0.01
+#   OLLAMA_HOST=http://127.0.0.1:11435 python D1_Ollama.py
+
+import argparse
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def default_reply(messages):
+    """Echoes the last user message back."""
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            return f"You said: {message.get('content', '')}"
+    return "Hello from the fake Ollama server."
+
+
+def fake_embedding(text, dim=64):
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    return [(digest[i % len(digest)] - 128) / 128 for i in range(dim)]
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real server
+
+    def log_message(self, format, *args):
+        pass  # Keep test output quiet
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/api/version":
+            self._send_json({"version": "0.0.0-fake"})
+        elif self.path == "/api/tags":
+            self._send_json({"models": [{"name": self.server.model_name, "model": self.server.model_name}]})
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        request = self._read_json()
+        self.server.count_request()
+        if self.path == "/api/chat":
+            self._generate(request, request.get("messages", []), chat=True)
+        elif self.path == "/api/generate":
+            prompt = request.get("prompt", "")
+            self._generate(request, [{"role": "user", "content": prompt}] if prompt else [], chat=False)
+        elif self.path == "/api/embed":
+            inputs = request.get("input", "")
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            self._send_json({"model": request.get("model"), "embeddings": [fake_embedding(t) for t in inputs]})
+        elif self.path == "/api/show":
+            self._send_json({"modelfile": "", "parameters": "", "template": "", "details": {}, "capabilities": ["completion"]})
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def _generate(self, request, messages, chat):
+        server = self.server
+        model = request.get("model", server.model_name)
+        stream = request.get("stream", True)
+        reply = server.reply(messages) if messages else ""
+        if request.get("format") is not None and messages:
+            reply = json.dumps({"response": reply})
+        tokens = [piece + " " for piece in reply.split(" ")] if reply else []
+        if tokens:
+            tokens[-1] = tokens[-1][:-1]
+        prompt_chars = sum(len(str(m.get("content", ""))) for m in messages)
+
+        load_seconds = server.load_model(model, request.get("keep_alive"))
+        start = time.perf_counter()
+        time.sleep(server.prefill_delay)
+        prompt_eval_seconds = time.perf_counter() - start
+
+        def chunk(text, done, extra=None):
+            payload = {"model": model, "created_at": datetime.now(timezone.utc).isoformat(), "done": done}
+            if chat:
+                payload["message"] = {"role": "assistant", "content": text}
+            else:
+                payload["response"] = text
+            if extra:
+                payload.update(extra)
+            return payload
+
+        def final_stats(eval_seconds):
+            return {
+                "done_reason": "stop",
+                "total_duration": int((load_seconds + prompt_eval_seconds + eval_seconds) * 1e9),
+                "load_duration": int(load_seconds * 1e9),
+                "prompt_eval_count": max(1, prompt_chars // 4),
+                "prompt_eval_duration": int(prompt_eval_seconds * 1e9),
+                "eval_count": len(tokens),
+                "eval_duration": int(eval_seconds * 1e9),
+            }
+
+        if not stream:
+            start = time.perf_counter()
+            time.sleep(server.token_delay * len(tokens))
+            self._send_json(chunk("".join(tokens), True, final_stats(time.perf_counter() - start)))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        start = time.perf_counter()
+        try:
+            for token in tokens:
+                time.sleep(server.token_delay)
+                self._write_chunk(chunk(token, False))
+            self._write_chunk(chunk("", True, final_stats(time.perf_counter() - start)))
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            server.count_cancelled()  # The client closed the stream early
+
+    def _write_chunk(self, payload):
+        data = json.dumps(payload).encode("utf-8") + b"\n"
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    """
+    Threaded fake server. `reply(messages)` produces the assistant text;
+    `load_delay` is charged the first time each model is used (and again
+    after keep_alive=0), so cold vs warm behaviour can be observed.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, token_delay=0.01, prefill_delay=0.0,
+                 load_delay=0.0, reply=default_reply, model_name="fake"):
+        super().__init__((host, port), FakeOllamaHandler)
+        self.token_delay = token_delay
+        self.prefill_delay = prefill_delay
+        self.load_delay = load_delay
+        self.reply = reply
+        self.model_name = model_name
+        self.requests = 0
+        self.cancelled = 0
+        self._loaded = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def count_cancelled(self):
+        with self._lock:
+            self.cancelled += 1
+
+    def load_model(self, model, keep_alive):
+        """Returns the simulated load time for this request."""
+        with self._lock:
+            cold = model not in self._loaded
+            if keep_alive in (0, "0", "0s"):
+                self._loaded.discard(model)
+            else:
+                self._loaded.add(model)
+        if cold and self.load_delay:
+            time.sleep(self.load_delay)
+            return self.load_delay
+        return 0.0
+
+    def start(self):
+        """Serves in a background thread and returns self."""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fake Ollama server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--token-delay", type=float, default=0.01, help="seconds per generated token")
+    parser.add_argument("--prefill-delay", type=float, default=0.0, help="seconds before the first token")
+    parser.add_argument("--load-delay", type=float, default=0.0, help="seconds to 'load' a cold model")
+    args = parser.parse_args()
+    server = FakeOllamaServer(args.host, args.port, args.token_delay, args.prefill_delay, args.load_delay)
+    print(f"Fake Ollama listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,103 @@
+# Stateful multi-turn chat for the gemma library.
+#
+# gm.text.ChatSampler with multi_turn=True keeps the KV cache from earlier
+# turns, so each turn only prefills the new user message rather than the
+# whole conversation, and per-turn cost stays flat instead of growing with
+# the history.
+#
+# The cache has a fixed size (cache_length). GemmaChatSession counts the
+# tokens each turn adds. When the next turn might not fit, it starts a fresh
+# sampler and replays only the most recent turns that fit in `keep_tokens`.
+# The replay is a single prefill: those turns are sent as a transcript in
+# front of the new message, so nothing is regenerated.
+
+import time
+
+import jax.random as jrandom
+from gemma import gm
+
+# Tokens the chat template adds around each turn (<start_of_turn>user\n ... <end_of_turn>\n)
+TURN_OVERHEAD = 8
+
+
+class GemmaChatSession:
+    """
+    Incremental chat over one gemma model. `cache_length` bounds the KV
+    cache; on overflow the oldest turns are dropped and up to `keep_tokens`
+    of recent history are replayed.
+    """
+
+    def __init__(self, model, params, cache_length=4096, max_new_tokens=512, keep_tokens=None, seed=0):
+        self.model = model
+        self.params = params
+        self.cache_length = cache_length
+        self.max_new_tokens = max_new_tokens
+        self.keep_tokens = keep_tokens if keep_tokens is not None else cache_length // 2
+        self.tokenizer = gm.text.Gemma3Tokenizer()
+        self.rng = jrandom.PRNGKey(seed)
+        self.history = []  # (user text, model text, tokens used by the turn)
+        self.cached_tokens = 0  # tokens currently held in the sampler's cache
+        self.latencies = []  # (seconds, prefilled tokens) per turn
+        self.resets = 0
+        self._new_sampler()
+
+    def _new_sampler(self):
+        self.sampler = gm.text.ChatSampler(
+            model=self.model,
+            params=self.params,
+            multi_turn=True,
+            cache_length=self.cache_length,
+            max_out_length=self.max_new_tokens,
+        )
+        self.cached_tokens = 0
+
+    def count_tokens(self, text):
+        return len(self.tokenizer.encode(text)) + TURN_OVERHEAD
+
+    def _slide_window(self, prompt_tokens):
+        """Starts a new sampler and returns the recent-history transcript to send with the next message."""
+        kept = []
+        budget = self.keep_tokens - prompt_tokens
+        for user, reply, tokens in reversed(self.history):
+            if tokens > budget:
+                break
+            kept.append((user, reply, tokens))
+            budget -= tokens
+        kept.reverse()
+        self.history = kept
+        self._new_sampler()
+        self.resets += 1
+        if not kept:
+            return ""
+        lines = ["Earlier in this conversation:"]
+        for user, reply, _ in kept:
+            lines.append(f"User: {user}")
+            lines.append(f"Gemma: {reply}")
+        return "\n".join(lines) + "\n\n"
+
+    def chat(self, message):
+        """Sends one user message and returns the model's reply."""
+        prompt = message
+        prompt_tokens = self.count_tokens(message)
+        if self.cached_tokens + prompt_tokens + self.max_new_tokens > self.cache_length:
+            prompt = self._slide_window(prompt_tokens) + message
+            prompt_tokens = self.count_tokens(prompt)
+
+        self.rng, turn_rng = jrandom.split(self.rng)
+        start = time.perf_counter()
+        reply = self.sampler.chat(prompt, rng=turn_rng, max_new_tokens=self.max_new_tokens)
+        elapsed = time.perf_counter() - start
+
+        turn_tokens = self.count_tokens(message) + self.count_tokens(reply)
+        self.cached_tokens += prompt_tokens + self.count_tokens(reply)
+        self.history.append((message, reply, turn_tokens))
+        self.latencies.append((elapsed, prompt_tokens))
+        return reply
+
+    def report(self):
+        if not self.latencies:
+            return
+        print(f"\n--- {len(self.latencies)} turns, {self.resets} window resets, "
+              f"{self.cached_tokens}/{self.cache_length} cache tokens in use ---")
+        for i, (seconds, prefilled) in enumerate(self.latencies, 1):
+            print(f"turn {i}: {seconds:.2f}s, {prefilled} tokens prefilled")
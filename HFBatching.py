@@ -0,0 +1,232 @@
+# Length-bucketed batch generation for Hugging Face causal LMs.
+#
+# Running `pipe(prompt)` once per prompt leaves most of the hardware idle.
+# Here prompts are tokenized, sorted by length and grouped into batches whose
+# lengths differ by at most `bucket_width` tokens, which keeps padding small.
+# Each batch is left-padded (so every row's new tokens start at the same
+# column) and run through one `model.generate` call. Results always come back
+# in the order the prompts were given.
+#
+# BatchingGenerator does the same for prompts that arrive over time: submit()
+# returns a Future, and a background thread collects pending prompts until it
+# has `max_batch_size` of them or the oldest has waited `max_wait` seconds.
+#
+#   python HFBatching.py --model sshleifer/tiny-gpt2 --device cpu --prompts 32
+#
+# compares throughput against the one-prompt-at-a-time loop.
+
+import argparse
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+
+
+def prepare_tokenizer(tokenizer):
+    """Left padding, and a pad token (the EOS token) for models that have none."""
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    return tokenizer
+
+
+def length_buckets(lengths, max_batch_size, bucket_width=64):
+    """
+    Groups indices into batches of similar length. Indices are sorted by
+    length and a new batch starts when it is full or when the next prompt is
+    more than `bucket_width` tokens longer than the batch's shortest one.
+    """
+    batches = []
+    batch = []
+    for i in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        if batch and (len(batch) >= max_batch_size or lengths[i] - lengths[batch[0]] > bucket_width):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _generate(model, tokenizer, prompts, add_special_tokens, generate_kwargs):
+    """Runs one left-padded batch. Returns (texts, new token counts)."""
+    inputs = tokenizer(prompts, return_tensors="pt", padding=True, add_special_tokens=add_special_tokens)
+    inputs = inputs.to(model.device)
+    with torch.inference_mode():
+        output = model.generate(**inputs, pad_token_id=tokenizer.pad_token_id, **generate_kwargs)
+    new_tokens = output[:, inputs["input_ids"].shape[1]:]
+    texts = tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+    counts = (new_tokens != tokenizer.pad_token_id).sum(dim=1).tolist()
+    return texts, counts
+
+
+def generate_batch(model, tokenizer, prompts, max_batch_size=8, bucket_width=64,
+                   add_special_tokens=True, stats=None, **generate_kwargs):
+    """
+    Generates a completion for every prompt (already formatted text) and
+    returns them in the same order. Pass add_special_tokens=False for prompts
+    built with the chat template, which already contain the BOS token.
+    """
+    prepare_tokenizer(tokenizer)
+    lengths = [len(ids) for ids in tokenizer(prompts, add_special_tokens=add_special_tokens)["input_ids"]]
+    results = [None] * len(prompts)
+    for batch in length_buckets(lengths, max_batch_size, bucket_width):
+        texts, counts = _generate(model, tokenizer, [prompts[i] for i in batch], add_special_tokens, generate_kwargs)
+        for i, text in zip(batch, texts):
+            results[i] = text
+        if stats is not None:
+            longest = max(lengths[i] for i in batch)
+            stats["batches"] = stats.get("batches", 0) + 1
+            stats["tokens"] = stats.get("tokens", 0) + sum(counts)
+            stats["padding"] = stats.get("padding", 0) + sum(longest - lengths[i] for i in batch)
+    return results
+
+
+class BatchingGenerator:
+    """
+    Collects prompts submitted from any thread and generates them in
+    length-bucketed batches on one background thread.
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size=8, max_wait=0.05, bucket_width=64,
+                 add_special_tokens=True, **generate_kwargs):
+        self.model = model
+        self.tokenizer = prepare_tokenizer(tokenizer)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.bucket_width = bucket_width
+        self.add_special_tokens = add_special_tokens
+        self.generate_kwargs = generate_kwargs
+        self.stats = {"batches": 0, "prompts": 0}
+        self._pending = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, prompt):
+        """Queues a prompt and returns a Future for its completion text."""
+        future = Future()
+        self._pending.put((prompt, future))
+        return future
+
+    def generate(self, prompts):
+        """Submits all prompts and returns their completions in order."""
+        futures = [self.submit(p) for p in prompts]
+        return [f.result() for f in futures]
+
+    def close(self):
+        self._pending.put(None)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _collect(self):
+        """Blocks for one prompt, then gathers more until the batch is full or max_wait has passed."""
+        first = self._pending.get()
+        if first is None:
+            return None
+        items = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._pending.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._pending.put(None)  # Finish this batch, then stop
+                break
+            items.append(item)
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            if items is None:
+                return
+            # Any failure fails this batch's futures; the thread keeps serving later prompts
+            try:
+                self._serve(items)
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _serve(self, items):
+        prompts = [prompt for prompt, _ in items]
+        lengths = [len(ids) for ids in
+                   self.tokenizer(prompts, add_special_tokens=self.add_special_tokens)["input_ids"]]
+        for batch in length_buckets(lengths, self.max_batch_size, self.bucket_width):
+            try:
+                texts, _ = _generate(self.model, self.tokenizer, [prompts[i] for i in batch],
+                                     self.add_special_tokens, self.generate_kwargs)
+            except Exception as e:
+                for i in batch:
+                    items[i][1].set_exception(e)
+                continue
+            for i, text in zip(batch, texts):
+                if not items[i][1].done():
+                    items[i][1].set_result(text)
+            self.stats["batches"] += 1
+            self.stats["prompts"] += len(batch)
+
+
+def compare_throughput(model, tokenizer, prompts, max_batch_size=8, bucket_width=64, **generate_kwargs):
+    """Times the per-prompt loop against generate_batch on the same prompts and prints both."""
+    prepare_tokenizer(tokenizer)
+    results = {}
+
+    start = time.perf_counter()
+    tokens = 0
+    for prompt in prompts:
+        _, counts = _generate(model, tokenizer, [prompt], True, generate_kwargs)
+        tokens += counts[0]
+    results["sequential"] = (time.perf_counter() - start, tokens)
+
+    stats = {}
+    start = time.perf_counter()
+    generate_batch(model, tokenizer, prompts, max_batch_size, bucket_width, stats=stats, **generate_kwargs)
+    results["batched"] = (time.perf_counter() - start, stats["tokens"])
+
+    print(f"\n--- {len(prompts)} prompts, max batch {max_batch_size}, bucket width {bucket_width} ---")
+    for name, (seconds, tokens) in results.items():
+        print(f"{name:<10} {seconds:7.2f}s  {len(prompts) / seconds:7.2f} prompts/s  {tokens / seconds:8.1f} tok/s")
+    print(f"batched: {stats['batches']} batches, {stats['padding']} padding tokens")
+    return results
+
+
+def sample_prompts(count):
+    """Questions of varied length for the comparison."""
+    subjects = ["the solar system", "the Eiffel Tower", "photosynthesis", "the French Revolution",
+                "black holes", "the printing press", "plate tectonics", "the Roman Empire"]
+    prompts = []
+    for i in range(count):
+        subject = subjects[i % len(subjects)]
+        detail = " Please include background, key facts and one surprising detail." * (i % 4)
+        prompts.append(f"Tell me about {subject}.{detail}")
+    return prompts
+
+
+if __name__ == "__main__":
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    parser = argparse.ArgumentParser(description="Compare per-prompt and length-bucketed batch generation.")
+    parser.add_argument("--model", default="sshleifer/tiny-gpt2")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--prompts", type=int, default=32)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--bucket-width", type=int, default=64)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModelForCausalLM.from_pretrained(args.model).to(args.device).eval()
+    compare_throughput(model, tokenizer, sample_prompts(args.prompts), args.max_batch_size, args.bucket_width,
+                       max_new_tokens=args.max_new_tokens, do_sample=False)
@@ -0,0 +1,183 @@
+# Streaming generation with task-aware stopping for Hugging Face models.
+#
+# model.generate() runs in a background thread and a TextIteratorStreamer
+# hands decoded text to the caller as it is produced. Generation stops as
+# soon as any stop condition is met, for example once a balanced
+# \boxed{...} answer is complete, a stop string appears, or a token budget
+# is used up, instead of always running to max_new_tokens. Each call
+# reports how many tokens, and roughly how much time, the early stop saved.
+#
+#   python HFStreaming.py --model sshleifer/tiny-gpt2 --device cpu --stop-string "."
+
+import argparse
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+BOXED_RE = re.compile(r"\\boxed\s*\{")
+
+
+def boxed_answer(text):
+    """
+    Returns the contents of the first complete, brace-balanced \\boxed{...}
+    in text that holds an answer, or None. Empty ones such as the "\\boxed{}"
+    of a restated instruction are skipped.
+    """
+    for match in BOXED_RE.finditer(text):
+        depth = 1
+        for i in range(match.end(), len(text)):
+            if text[i] == "{":
+                depth += 1
+            elif text[i] == "}":
+                depth -= 1
+                if depth == 0:
+                    break
+        else:
+            return None  # Still open; later matches are nested inside it
+        contents = text[match.end():i]
+        if contents.strip():
+            return contents
+    return None
+
+
+class StopCondition(ABC):
+    """Decides from the generated text and token count whether to stop."""
+
+    @abstractmethod
+    def check(self, text, tokens):
+        """Returns the reason to stop, or None to keep generating."""
+
+
+class BoxedAnswer(StopCondition):
+    """Stops once a \\boxed{...} answer with non-blank contents is complete."""
+
+    def check(self, text, tokens):
+        return "boxed answer" if boxed_answer(text) is not None else None
+
+
+class StopString(StopCondition):
+    def __init__(self, stop):
+        self.stop = stop
+
+    def check(self, text, tokens):
+        return f"stop string {self.stop!r}" if self.stop in text else None
+
+
+class TokenBudget(StopCondition):
+    def __init__(self, max_tokens):
+        self.max_tokens = max_tokens
+
+    def check(self, text, tokens):
+        return f"token budget {self.max_tokens}" if tokens >= self.max_tokens else None
+
+
+class TextStoppingCriteria(StoppingCriteria):
+    """Adapts StopConditions to transformers' StoppingCriteria (batch size 1)."""
+
+    def __init__(self, tokenizer, prompt_length, conditions):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.conditions = conditions
+        self.reason = None
+        self.tokens = 0
+
+    def __call__(self, input_ids, scores, **kwargs):
+        new_tokens = input_ids[0, self.prompt_length:]
+        self.tokens = len(new_tokens)
+        text = self.tokenizer.decode(new_tokens, skip_special_tokens=True)
+        for condition in self.conditions:
+            self.reason = condition.check(text, self.tokens)
+            if self.reason:
+                break
+        done = self.reason is not None
+        return torch.full((input_ids.shape[0],), done, dtype=torch.bool, device=input_ids.device)
+
+
+def stream_generate(model, tokenizer, inputs, conditions=(), max_new_tokens=500, on_text=None, **generate_kwargs):
+    """
+    Streams a completion for tokenized `inputs` (a batch of one), calling
+    `on_text(piece)` as text arrives, and stops at the first condition that
+    fires. Returns a dict with the text, token counts, stop reason and timings.
+    """
+    prompt_length = inputs["input_ids"].shape[1]
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    stopping = TextStoppingCriteria(tokenizer, prompt_length, list(conditions))
+    errors = []
+
+    def run():
+        try:
+            with torch.inference_mode():
+                model.generate(**inputs, max_new_tokens=max_new_tokens, streamer=streamer,
+                               stopping_criteria=StoppingCriteriaList([stopping]), **generate_kwargs)
+        except Exception as e:
+            errors.append(e)
+            streamer.end()
+
+    start = time.perf_counter()
+    first_token = None
+    pieces = []
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    for text in streamer:
+        if not text:
+            continue
+        if first_token is None:
+            first_token = time.perf_counter() - start
+        pieces.append(text)
+        if on_text is not None:
+            on_text(text)
+    thread.join()
+    if errors:
+        raise errors[0]
+    elapsed = time.perf_counter() - start
+
+    tokens = stopping.tokens
+    saved = max(0, max_new_tokens - tokens) if stopping.reason else 0
+    per_token = (elapsed - (first_token or 0)) / max(1, tokens - 1)
+    return {
+        "text": "".join(pieces),
+        "tokens": tokens,
+        "stop_reason": stopping.reason or ("eos" if tokens < max_new_tokens else "max_new_tokens"),
+        "first_token": first_token,
+        "elapsed": elapsed,
+        "tokens_saved": saved,
+        # The tokens not generated would each have cost about one decode step
+        "seconds_saved": saved * per_token,
+    }
+
+
+def print_summary(result):
+    first = f"{result['first_token']:.2f}s" if result["first_token"] is not None else "n/a"
+    print(f"\n--- {result['tokens']} tokens in {result['elapsed']:.2f}s (first token {first}), "
+          f"stopped by {result['stop_reason']} ---")
+    if result["tokens_saved"]:
+        print(f"saved {result['tokens_saved']} tokens, about {result['seconds_saved']:.2f}s")
+
+
+if __name__ == "__main__":
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    parser = argparse.ArgumentParser(description="Stream a completion with early stopping.")
+    parser.add_argument("--model", default="sshleifer/tiny-gpt2")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--prompt", default="Solve: what is 54*24? Show steps, final answer in \\boxed{}.")
+    parser.add_argument("--max-new-tokens", type=int, default=500)
+    parser.add_argument("--stop-string", default=None)
+    parser.add_argument("--token-budget", type=int, default=None)
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModelForCausalLM.from_pretrained(args.model).to(args.device).eval()
+    conditions = [BoxedAnswer()]
+    if args.stop_string:
+        conditions.append(StopString(args.stop_string))
+    if args.token_budget:
+        conditions.append(TokenBudget(args.token_budget))
+    inputs = tokenizer(args.prompt, return_tensors="pt").to(model.device)
+    result = stream_generate(model, tokenizer, inputs, conditions, args.max_new_tokens,
+                             on_text=lambda text: print(text, end="", flush=True))
+    print_summary(result)
@@ -0,0 +1,170 @@
+# Streaming HTML-to-text extraction.
+#
+# The extractor is fed the page in chunks as it downloads and never builds a
+# DOM: text inside script/style/nav-like elements is dropped as it arrives,
+# finished lines are cleaned up immediately, and parsing stops once the
+# configured text budget is reached.
+
+import codecs
+from html.parser import HTMLParser
+
+# Bump when the extraction rules change, so cached text from an older version is re-extracted
+EXTRACTOR_VERSION = "stream-1"
+
+# Elements whose content is never shown as page text
+SKIP_TAGS = {"script", "style", "nav", "noscript", "template", "svg", "iframe"}
+
+# Elements that start a new line of text
+BLOCK_TAGS = {
+    "address", "article", "aside", "blockquote", "br", "dd", "div", "dl", "dt",
+    "figcaption", "footer", "form", "h1", "h2", "h3", "h4", "h5", "h6", "header",
+    "hr", "li", "main", "ol", "p", "pre", "section", "table", "td", "th", "title",
+    "tr", "ul",
+}
+
+
+class StreamingTextExtractor(HTMLParser):
+    """
+    Incremental HTML-to-text extractor. Call feed() with each chunk of the
+    page; it returns False once `max_chars` characters of text have been
+    collected and no more input is needed. close() returns the text.
+
+    Text is cleaned up like extract_text_bs4 (stripped lines, runs of double
+    spaces split into separate lines, blank lines dropped), and block-level
+    elements additionally start a new line.
+    """
+
+    def __init__(self, max_chars=None):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.done = False
+        self._skip_depth = 0
+        self._pending = []  # text of the line currently being built
+        self._lines = []
+        self._length = 0
+
+    # --- HTMLParser callbacks ---
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self._end_line()
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self._end_line()
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            if self._skip_depth:
+                self._skip_depth -= 1
+        elif tag in BLOCK_TAGS:
+            self._end_line()
+
+    def handle_data(self, data):
+        if self._skip_depth or self.done:
+            return
+        if "\n" not in data:
+            self._pending.append(data)
+            return
+        first, *middle, last = data.split("\n")
+        self._pending.append(first)
+        self._end_line()
+        for line in middle:
+            self._add_line(line)
+        self._pending.append(last)
+
+    # --- Line handling ---
+
+    def _end_line(self):
+        if self._pending:
+            self._add_line("".join(self._pending))
+            self._pending = []
+
+    def _add_line(self, line):
+        if self.done:
+            return
+        for phrase in line.strip().split("  "):
+            phrase = phrase.strip()
+            if not phrase:
+                continue
+            self._lines.append(phrase)
+            self._length += len(phrase) + 1
+            if self.max_chars is not None and self._length >= self.max_chars:
+                self.done = True
+                return
+
+    # --- Public API ---
+
+    def feed(self, data):
+        """Parses the next chunk. Returns False once the text budget is reached."""
+        if not self.done:
+            super().feed(data)
+        return not self.done
+
+    def close(self):
+        """Flushes buffered input and returns the extracted text."""
+        if not self.done:
+            super().close()
+            self._end_line()
+        text = "\n".join(self._lines)
+        if self.max_chars is not None:
+            text = text[:self.max_chars]
+        return text
+
+
+def text_key(max_chars=None):
+    """PageCache text key for this extractor and text budget."""
+    return f"{EXTRACTOR_VERSION}:{max_chars}"
+
+
+def extract_text(html_content, max_chars=None, chunk_size=64 * 1024):
+    """Extracts readable text from an HTML string, stopping at max_chars."""
+    if not html_content:
+        return ""
+    extractor = StreamingTextExtractor(max_chars)
+    for start in range(0, len(html_content), chunk_size):
+        if not extractor.feed(html_content[start:start + chunk_size]):
+            break
+    return extractor.close()
+
+
+def extract_text_from_chunks(chunks, max_chars=None, encoding="utf-8"):
+    """
+    Extracts text from an iterable of str or bytes chunks (e.g.
+    `response.iter_content()`), reading no further than the text budget needs.
+    """
+    extractor = StreamingTextExtractor(max_chars)
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk)
+        if not extractor.feed(chunk):
+            break
+    else:
+        extractor.feed(decoder.decode(b"", final=True))
+    return extractor.close()
+
+
+def extract_text_bs4(html_content):
+    """
+    The original BeautifulSoup-based extractor from D1_Ollama_RAG, kept as
+    the reference implementation for BenchHTMLText.py.
+    """
+    from bs4 import BeautifulSoup
+
+    if not html_content:
+        return ""
+    soup = BeautifulSoup(html_content, 'html.parser')
+    # Remove script and style elements
+    for script_or_style in soup(['script', 'style']):
+        script_or_style.extract()
+    text = soup.get_text()
+    # Break into lines and remove leading/trailing space on each
+    lines = (line.strip() for line in text.splitlines())
+    # Break multi-hyphenated words and remove empty lines
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    # Drop blank lines
+    text = '\n'.join(chunk for chunk in chunks if chunk)
+    return text
@@ -0,0 +1,231 @@
+# Benchmark: replay a prompt workload against any backend in Backends.py.
+#
+# For every prompt this records time to first token (TTFT), end-to-end
+# latency and decode speed (tokens after the first one, per second of
+# decoding), then reports p50/p95/p99 of each plus peak memory, and can write
+# everything to a JSON file. With --baseline it compares the run against an
+# earlier results file and exits non-zero on a regression.
+#
+#   python InferenceBench.py --backend ollama --fake --workload prompts.txt
+#   python InferenceBench.py --backend hf-generate --model sshleifer/tiny-gpt2 --device cpu
+#   python InferenceBench.py --backend ollama --fake --json run.json --baseline base.json
+#
+# Workloads are either a text file with one prompt per line (URLs and blank
+# lines are skipped, as in prompts.txt) or a .jsonl file whose records have
+# "messages", "prompt" or "title"/"body" fields.
+
+import argparse
+import json
+import platform
+import resource
+import sys
+import time
+
+from Backends import BACKENDS, create_backend
+from BatchRunner import record_messages
+
+
+def load_workload(path, limit=None):
+    """Returns a list of chat message lists."""
+    workload = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                messages = record_messages(json.loads(line))
+            elif line.startswith(("http://", "https://")):
+                continue
+            else:
+                messages = [{"role": "user", "content": line}]
+            workload.append(messages)
+            if limit and len(workload) >= limit:
+                break
+    return workload
+
+
+def percentile(samples, p):
+    """Linear-interpolated percentile of a list of numbers (p in 0-100)."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = (len(ordered) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(samples):
+    return {
+        "p50": percentile(samples, 50),
+        "p95": percentile(samples, 95),
+        "p99": percentile(samples, 99),
+        "mean": sum(samples) / len(samples) if samples else None,
+    }
+
+
+def peak_memory_mb():
+    """Peak RSS of this process, and peak CUDA memory if torch is in use."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    memory = {"rss_mb": rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024}
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        memory["cuda_mb"] = torch.cuda.max_memory_allocated() / (1024 * 1024)
+    return memory
+
+
+def run_one(backend, messages, max_new_tokens):
+    """Streams one reply and returns its timings."""
+    start = time.perf_counter()
+    first_token = None
+    chars = 0
+    for text in backend.stream(messages, max_new_tokens):
+        if first_token is None:
+            first_token = time.perf_counter() - start
+        chars += len(text)
+    total = time.perf_counter() - start
+    if first_token is None:
+        first_token = total
+    tokens = backend.last_token_count
+    decode_seconds = total - first_token
+    return {
+        "ttft": first_token,
+        "e2e": total,
+        "tokens": tokens,
+        "chars": chars,
+        "decode_tps": (tokens - 1) / decode_seconds if tokens > 1 and decode_seconds > 0 else None,
+    }
+
+
+def run_benchmark(backend, workload, max_new_tokens=128, warmup=1, repeat=1):
+    """Runs `warmup` untimed prompts, then the workload `repeat` times. Returns the results dict."""
+    for messages in workload[:warmup]:
+        for _ in backend.stream(messages, max_new_tokens):
+            pass
+
+    runs = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for i, messages in enumerate(workload):
+            result = run_one(backend, messages, max_new_tokens)
+            result["prompt"] = i
+            runs.append(result)
+    elapsed = time.perf_counter() - start
+
+    decode = [r["decode_tps"] for r in runs if r["decode_tps"] is not None]
+    tokens = sum(r["tokens"] for r in runs)
+    return {
+        "backend": backend.name,
+        "model": backend.model,
+        "max_new_tokens": max_new_tokens,
+        "requests": len(runs),
+        "elapsed": elapsed,
+        "tokens_per_second": tokens / elapsed if elapsed else None,
+        "ttft": summarize([r["ttft"] for r in runs]),
+        "e2e": summarize([r["e2e"] for r in runs]),
+        "decode_tps": summarize(decode),
+        "peak_memory": peak_memory_mb(),
+        "platform": {"python": platform.python_version(), "machine": platform.machine()},
+        "runs": runs,
+    }
+
+
+def print_results(results):
+    print(f"\n--- {results['backend']} / {results['model']}: {results['requests']} requests "
+          f"in {results['elapsed']:.2f}s ---")
+    for name, unit, scale in (("ttft", "ms", 1000), ("e2e", "ms", 1000), ("decode_tps", "tok/s", 1)):
+        s = results[name]
+        if s["p50"] is None:
+            print(f"{name:<11} no samples")
+            continue
+        print(f"{name:<11} p50 {s['p50'] * scale:9.1f}  p95 {s['p95'] * scale:9.1f}  "
+              f"p99 {s['p99'] * scale:9.1f} {unit}")
+    if results["tokens_per_second"]:
+        print(f"overall     {results['tokens_per_second']:.1f} tok/s")
+    memory = ", ".join(f"{k} {v:.1f}" for k, v in results["peak_memory"].items())
+    print(f"peak memory {memory}")
+
+
+def check_regression(results, baseline, tolerance):
+    """Returns a list of metrics that are more than `tolerance` (a fraction) worse than the baseline."""
+    regressions = []
+    for name in ("ttft", "e2e"):
+        old, new = baseline[name]["p50"], results[name]["p50"]
+        if old and new and new > old * (1 + tolerance):
+            regressions.append(f"{name} p50 {old * 1000:.1f} ms -> {new * 1000:.1f} ms")
+    old, new = baseline["decode_tps"]["p50"], results["decode_tps"]["p50"]
+    if old and new and new < old * (1 - tolerance):
+        regressions.append(f"decode_tps p50 {old:.1f} -> {new:.1f} tok/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark text generation backends on a prompt workload.")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="ollama")
+    parser.add_argument("--model", default=None, help="model name (default depends on the backend)")
+    parser.add_argument("--host", default=None, help="Ollama URL for the ollama backend")
+    parser.add_argument("--fake", action="store_true", help="run the ollama backend against a local FakeOllama server")
+    parser.add_argument("--device", default=None, help="device for the HF backends, e.g. cpu or cuda")
+    parser.add_argument("--workload", default="prompts.txt", help="prompts .txt or .jsonl file")
+    parser.add_argument("--limit", type=int, default=None, help="use at most this many prompts")
+    parser.add_argument("--max-new-tokens", type=int, default=128)
+    parser.add_argument("--warmup", type=int, default=1, help="untimed prompts before measuring")
+    parser.add_argument("--repeat", type=int, default=1, help="times to replay the workload")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown vs. the baseline")
+    args = parser.parse_args()
+
+    workload = load_workload(args.workload, args.limit)
+    if not workload:
+        print(f"No prompts found in {args.workload}")
+        return 1
+
+    default_models = {"ollama": "gemma3", "hf-pipeline": "sshleifer/tiny-gpt2",
+                      "hf-generate": "sshleifer/tiny-gpt2", "gemma": "GEMMA3_1B_IT"}
+    model = args.model or ("fake" if args.fake else default_models[args.backend])
+    kwargs = {}
+    if args.backend in ("hf-pipeline", "hf-generate") and args.device:
+        kwargs["device"] = args.device
+
+    server = None
+    if args.backend == "ollama":
+        if args.fake:
+            from FakeOllama import FakeOllamaServer
+
+            server = FakeOllamaServer(token_delay=0.002).start()
+            kwargs["host"] = server.url
+        else:
+            kwargs["host"] = args.host
+
+    try:
+        backend = create_backend(args.backend, model, **kwargs)
+        results = run_benchmark(backend, workload, args.max_new_tokens, args.warmup, args.repeat)
+        backend.close()
+    finally:
+        if server is not None:
+            server.stop()
+
+    results["workload"] = args.workload
+    print_results(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.json}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = check_regression(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION: {line}")
+        if regressions:
+            return 1
+        print(f"No regressions vs. {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+# Local intent router that runs before the LLM.
+#
+# Obvious requests ("get customer 42", "weather in London") are mapped to a
+# tool call in microseconds instead of a full model round trip:
+#
+# 1. Patterns: per-tool regexes whose named groups are the tool arguments.
+# 2. Nearest neighbour: the request is embedded and compared with embeddings
+#    of each tool's description and example requests. If the best tool wins
+#    by a clear margin and its arguments can be extracted from the text, the
+#    call is dispatched directly. Only tools that opt in (reads) are
+#    dispatched this way; writes always need an exact pattern match.
+#
+# Anything else returns None and the caller falls back to the model. The
+# default embedding is a hashed character-trigram vector, so the router needs
+# no model at all; any text -> vector function (e.g. Ollama embeddings) can
+# be passed instead.
+
+import hashlib
+import math
+import re
+
+# Requests containing a negation are never dispatched by the nearest-neighbour stage
+NEGATION_RE = re.compile(r"\b(?:not|don't|do not|never|no)\b", re.IGNORECASE)
+
+# Nor are requests joining several things or about another time, whose
+# arguments a single extractor match would only partly cover
+COMPOUND_RE = re.compile(r"\b(?:and|or|then|tomorrow|tonight|yesterday|next|last|this\s+weekend)\b",
+                         re.IGNORECASE)
+
+# Capitalized words that end a place name rather than belong to it
+NOT_PLACE_WORDS = (
+    r"(?:Today|Tonight|Tomorrow|Yesterday|Now|This|Next|Last|And|Or|But|"
+    r"Monday|Tuesday|Wednesday|Thursday|Friday|Saturday|Sunday|"
+    r"January|February|March|April|May|June|July|August|September|October|November|December)\b"
+)
+
+# A place name: capitalized words ("New York", "St. Louis"), optionally joined
+# by a lowercase particle ("Rio de Janeiro"). Case-sensitive even inside an
+# IGNORECASE pattern, so "london and paris tomorrow" is not one city.
+PLACE_WORD = rf"(?!{NOT_PLACE_WORDS})[A-Z][\w'.-]*"
+CITY_PATTERN = rf"(?-i:{PLACE_WORD}(?:\s+(?:(?:de|da|del|la|le|on|upon|am)\s+)?{PLACE_WORD})*)"
+
+# Generic argument extractors used by the nearest-neighbour stage, by argument name
+ARGUMENT_PATTERNS = {
+    "customer_id": re.compile(r"\b(\d+)\b"),
+    "city": re.compile(rf"\b(?:in|for|at)\s+({CITY_PATTERN})"),
+    "new_city": re.compile(rf"\b(?:to|in)\s+({CITY_PATTERN})"),
+    "recipient": re.compile(r"\b([\w.+-]+@[\w-]+(?:\.[\w-]+)+)\b"),
+}
+
+
+def hashed_trigram_embedding(text, dim=1024):
+    """Sparse {bucket: weight} vector of hashed character trigrams of each word."""
+    vector = {}
+    for word in re.findall(r"\w+", text.lower()):
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            digest = hashlib.blake2b(padded[i:i + 3].encode(), digest_size=4).digest()
+            bucket = int.from_bytes(digest, "little") % dim
+            vector[bucket] = vector.get(bucket, 0.0) + 1.0
+    norm = math.sqrt(sum(w * w for w in vector.values())) or 1.0
+    return {k: w / norm for k, w in vector.items()}
+
+
+def cosine(a, b):
+    """Cosine similarity of sparse dict vectors or dense lists."""
+    if isinstance(a, dict):
+        if len(a) > len(b):
+            a, b = b, a
+        return sum(w * b.get(k, 0.0) for k, w in a.items())
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class Route:
+    """
+    How to recognise one tool: patterns, examples and its required arguments.
+    Unless allow_nearest=True the tool is only dispatched on an exact pattern
+    match; only read-only tools should opt in to the nearest-neighbour stage.
+    """
+
+    def __init__(self, name, description, required, patterns=(), examples=(), allow_nearest=False):
+        self.name = name
+        self.description = description
+        self.required = list(required)
+        self.patterns = [re.compile(p, re.IGNORECASE) for p in patterns]
+        self.examples = [description, *examples]
+        self.allow_nearest = allow_nearest
+
+
+class IntentRouter:
+    """
+    Pattern matcher plus nearest-neighbour classifier over tool descriptions.
+    `threshold` is the minimum similarity and `margin` the minimum lead over
+    the runner-up tool for a nearest-neighbour match to be trusted.
+    """
+
+    def __init__(self, routes, threshold=0.35, margin=0.05, embed=hashed_trigram_embedding):
+        self.routes = {route.name: route for route in routes}
+        self.threshold = threshold
+        self.margin = margin
+        self.embed = embed
+        # Example embeddings are computed once when the router is built
+        self.index = [(route.name, embed(text)) for route in routes for text in route.examples]
+        self.stats = {"requests": 0, "pattern": 0, "nearest": 0, "fallback": 0}
+        self.last_stage = None
+
+    @classmethod
+    def from_registry(cls, registry, patterns=None, examples=None, nearest_tools=None, **kwargs):
+        """
+        Builds routes from a ToolRegistry's descriptions and required
+        arguments. Only tools in `nearest_tools` (default: none) may be
+        dispatched by the nearest-neighbour stage, so writes never are
+        unless a caller lists them explicitly.
+        """
+        patterns = patterns or {}
+        examples = examples or {}
+        nearest_tools = set(nearest_tools or ())
+        routes = [
+            Route(tool.name, tool.description, tool.schema.get("required", []),
+                  patterns.get(tool.name, ()), examples.get(tool.name, ()),
+                  allow_nearest=tool.name in nearest_tools)
+            for tool in registry.tools.values()
+        ]
+        return cls(routes, **kwargs)
+
+    def classify(self, text):
+        """Returns (tool_name, similarity, margin) of the nearest tool."""
+        query = self.embed(text)
+        best = {}
+        for name, vector in self.index:
+            score = cosine(query, vector)
+            if score > best.get(name, -1.0):
+                best[name] = score
+        ranked = sorted(best.items(), key=lambda item: item[1], reverse=True)
+        if not ranked:
+            return None, 0.0, 0.0
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+        return ranked[0][0], ranked[0][1], ranked[0][1] - runner_up
+
+    def route(self, text):
+        """Returns (tool_name, arguments) if the request is obvious, else None."""
+        self.stats["requests"] += 1
+        text = text.strip().rstrip("?!.")
+
+        for route in self.routes.values():
+            for pattern in route.patterns:
+                match = pattern.fullmatch(text)
+                if match:
+                    self.stats["pattern"] += 1
+                    self.last_stage = "pattern"
+                    args = {k: v.strip() for k, v in match.groupdict().items() if v is not None}
+                    return route.name, args
+
+        name, score, lead = self.classify(text)
+        if (name and self.routes[name].allow_nearest
+                and not NEGATION_RE.search(text) and not COMPOUND_RE.search(text)
+                and score >= self.threshold and lead >= self.margin):
+            args = {}
+            for arg in self.routes[name].required:
+                pattern = ARGUMENT_PATTERNS.get(arg)
+                match = pattern.search(text) if pattern else None
+                if not match:
+                    break
+                args[arg] = match.group(1)
+            else:
+                self.stats["nearest"] += 1
+                self.last_stage = "nearest"
+                return name, args
+
+        self.stats["fallback"] += 1
+        self.last_stage = "fallback"
+        return None
+
+    def miss(self):
+        """Records that a routed call failed validation and went to the model after all."""
+        if self.last_stage in ("pattern", "nearest"):
+            self.stats[self.last_stage] -= 1
+            self.stats["fallback"] += 1
+            self.last_stage = "fallback"
+
+    @property
+    def hit_rate(self):
+        requests = self.stats["requests"]
+        return (self.stats["pattern"] + self.stats["nearest"]) / requests if requests else 0.0
+
+    def report(self):
+        s = self.stats
+        print(f"Router: {s['requests']} requests, hit rate {self.hit_rate:.1%} "
+              f"(pattern {s['pattern']}, nearest {s['nearest']}, model {s['fallback']}), "
+              f"threshold {self.threshold}, margin {self.margin}")
@@ -0,0 +1,263 @@
+# Model cascade: answer with the smallest model that is good enough.
+#
+# Every request goes to the first (smallest) tier. Its reply is put through
+# cheap checks, and only if one fails is the request sent to the next, larger
+# tier. The last tier's reply is always accepted. The checks are:
+#   - invalid: the caller's `validate(text)` raised, e.g. a tool call that is
+#     not valid JSON for the tool schema;
+#   - logprob: the mean token log-probability is below the tier's
+#     `min_mean_logprob` (asked from Ollama with logprobs=True; skipped if the
+#     installed client does not accept logprobs, or the server sends none);
+#   - length: the reply is shorter than `min_chars` or was cut off at the
+#     token limit;
+#   - refusal: the reply opens with a refusal or "I don't know" ("I'm sorry,
+#     I can't...", not "I'm sorry to hear...").
+# Thresholds are set per tier, so a mid-size tier can be trusted more easily
+# than the smallest one.
+#
+# With stream=True every tier streams. A lower tier's chunks are buffered
+# while its reply is judged:
+#   - without `validate`, the refusal, length and logprob checks run on the
+#     first `decide_chars` characters. A reply that passes is flushed and the
+#     rest of it streams live; one that fails is cancelled and escalated;
+#   - with `validate`, the reply is accepted (and its generation stopped) as
+#     soon as the text so far passes validate(), e.g. once a JSON tool call
+#     closes, and escalated if it ends without passing.
+#
+# Each tier is an OllamaSession, so models stay resident between requests
+# (keep_alive) and their latencies are recorded. report() prints, per tier,
+# how many requests it served and why it escalated the others.
+
+import inspect
+import re
+import time
+
+import ollama
+
+from OllamaSession import OllamaSession
+
+# "I can't", "I cannot", "I am unable", "I'm not able", "I do not know", ...
+_CANNOT = r"i\s*(?:can(?:no|'|’)?t|(?:am|'m|’m)\s+(?:unable|not\s+able)|do(?:n'|n’|\s+no)t\s+know)\b"
+
+# An apology only counts when it leads into a refusal, so sympathy such as
+# "I'm sorry to hear that..." is accepted.
+REFUSAL_RE = re.compile(
+    r"^\W*(?:"
+    rf"(?:(?:(?:i\s*(?:'|’)?m|i\s+am)\s+)?(?:sorry|afraid)|i\s+apologi[sz]e)\W+(?:but\s+)?{_CANNOT}|"
+    rf"(?:unfortunately\W+)?{_CANNOT}|"
+    r"as\s+an\s+ai\b"
+    r")",
+    re.IGNORECASE,
+)
+
+# The usual tiers, smallest first, as listed in D1_Ollama.py
+DEFAULT_MODELS = ("gemma3:1b", "gemma3:latest", "llama3.1", "gpt-oss")
+
+
+class Tier:
+    """One model of the cascade and the checks its replies must pass to be accepted."""
+
+    def __init__(self, model, min_mean_logprob=None, min_chars=1, check_refusal=True, check_truncated=True,
+                 decide_chars=64):
+        self.model = model
+        self.min_mean_logprob = min_mean_logprob
+        self.min_chars = min_chars
+        self.check_refusal = check_refusal
+        self.check_truncated = check_truncated
+        self.decide_chars = decide_chars  # streamed text judged before it is flushed
+
+    def __repr__(self):
+        return f"Tier({self.model!r})"
+
+
+def default_tiers(models=DEFAULT_MODELS):
+    """Tiers for `models`, with stricter thresholds for the smaller ones. The last tier has none."""
+    thresholds = (-0.6, -0.9, -1.2)
+    return [Tier(model, min_mean_logprob=thresholds[i] if i < min(len(thresholds), len(models) - 1) else None)
+            for i, model in enumerate(models)]
+
+
+def accepts_logprobs(client):
+    """
+    Whether client.chat() takes logprobs=True: the installed ollama client must
+    have the parameter, and `client` (which may wrap one) must pass it on.
+    """
+    if "logprobs" not in inspect.signature(ollama.Client.chat).parameters:
+        return False
+    try:
+        parameters = inspect.signature(client.chat).parameters.values()
+    except (TypeError, ValueError):
+        return True  # No signature to inspect; assume it forwards to ollama
+    return any(p.name == "logprobs" or p.kind is inspect.Parameter.VAR_KEYWORD for p in parameters)
+
+
+def mean_logprob(logprobs):
+    """Mean of the per-token log-probabilities in Ollama's `logprobs` field, or None."""
+    values = [entry["logprob"] for entry in logprobs or ()]
+    return sum(values) / len(values) if values else None
+
+
+class TierStats:
+    def __init__(self):
+        self.served = 0
+        self.escalated = {}  # reason -> count
+        self.seconds = 0.0
+
+    def escalate(self, reason):
+        self.escalated[reason] = self.escalated.get(reason, 0) + 1
+
+
+class ModelCascade:
+    """
+    chat() with OllamaSession's signature that walks the tiers smallest
+    first. `last_tier` is the index of the tier that produced the last reply.
+    """
+
+    def __init__(self, tiers=None, client=None, keep_alive=None):
+        self.tiers = tiers or default_tiers()
+        kwargs = {"keep_alive": keep_alive} if keep_alive else {}
+        self.sessions = [OllamaSession(tier.model, client=client, **kwargs) for tier in self.tiers]
+        self.client = self.sessions[0].client
+        self.stats = [TierStats() for _ in self.tiers]
+        self.logprobs_supported = accepts_logprobs(self.client)
+        self.last_tier = None
+
+    @property
+    def model(self):
+        """Name of the whole cascade (e.g. for cache keys)."""
+        return " > ".join(tier.model for tier in self.tiers)
+
+    def warm(self):
+        """Loads the first tier. Larger tiers are loaded the first time a request escalates to them."""
+        return self.sessions[0].warm()
+
+    # --- Checks ---
+
+    def check(self, tier, text, response, logprobs, validate=None):
+        """Returns why the reply should be escalated, or None to accept it."""
+        if validate is not None:
+            try:
+                validate(text)
+            except Exception:
+                return "invalid"
+        if len(text.strip()) < tier.min_chars:
+            return "length"
+        if tier.check_truncated and response.get("done_reason") == "length":
+            return "length"
+        if tier.check_refusal and REFUSAL_RE.match(text):
+            return "refusal"
+        if tier.min_mean_logprob is not None:
+            mean = mean_logprob(logprobs)
+            if mean is not None and mean < tier.min_mean_logprob:
+                return "logprob"
+        return None
+
+    # --- Requests ---
+
+    def _logprob_kwargs(self, i):
+        want_logprobs = self.tiers[i].min_mean_logprob is not None and self.logprobs_supported
+        return {"logprobs": True} if want_logprobs else {}
+
+    def _ask(self, i, messages, kwargs):
+        """Full (non-streamed) reply from tier i, as (text, final response, logprobs)."""
+        response = self.sessions[i].chat(messages, stream=False, **kwargs, **self._logprob_kwargs(i))
+        return response['message']['content'] or "", response, response.get("logprobs")
+
+    def chat(self, messages, stream=False, validate=None, **kwargs):
+        """
+        Returns the reply of the first tier whose output passes the checks.
+        `validate(text)` should raise for an unusable reply. With stream=True
+        the chunks of the accepted tier are yielded (see the module notes).
+        """
+        if stream:
+            return self._stream(messages, validate, kwargs)
+        for i in range(len(self.tiers)):
+            start = time.perf_counter()
+            text, response, logprobs = self._ask(i, messages, kwargs)
+            self.stats[i].seconds += time.perf_counter() - start
+            if i == len(self.tiers) - 1 or self._accept(i, text, response, logprobs, validate):
+                self._served(i)
+                return response
+
+    def _accept(self, i, text, response, logprobs, validate):
+        reason = self.check(self.tiers[i], text, response, logprobs, validate)
+        if reason is None:
+            return True
+        self.stats[i].escalate(reason)
+        return False
+
+    def _served(self, i):
+        self.stats[i].served += 1
+        self.last_tier = i
+
+    def _stream(self, messages, validate, kwargs):
+        last = len(self.tiers) - 1
+        for i in range(last):
+            start = time.perf_counter()
+            stream = self.sessions[i].chat(messages, stream=True, **kwargs, **self._logprob_kwargs(i))
+            try:
+                chunks, settled = self._judge_stream(i, stream, validate)
+                if chunks is not None:
+                    self._served(i)
+                    yield from chunks
+                    if not settled:
+                        yield from stream  # Accepted on its opening; the rest streams live
+                    return
+            finally:
+                self.stats[i].seconds += time.perf_counter() - start
+                close = getattr(stream, "close", None)
+                if close is not None:
+                    close()  # Cancels the generation of an escalated or finished reply
+        self._served(last)
+        start = time.perf_counter()
+        try:
+            yield from self.sessions[last].chat(messages, stream=True, **kwargs)
+        finally:
+            self.stats[last].seconds += time.perf_counter() - start
+
+    def _judge_stream(self, i, stream, validate):
+        """
+        Reads tier i's stream until its reply can be judged. Returns (chunks
+        read, settled) if it is accepted, where settled means the reply is
+        complete, or (None, None) after recording why it was escalated.
+        """
+        tier = self.tiers[i]
+        chunks, parts, logprobs = [], [], []
+        for chunk in stream:
+            chunks.append(chunk)
+            parts.append(chunk['message']['content'] or "")
+            logprobs.extend(chunk.get("logprobs") or ())
+            text = "".join(parts)
+            if validate is not None:
+                try:
+                    validate(text)
+                except Exception:
+                    continue
+                # Complete as far as the caller is concerned; the other checks still apply
+                if self._accept(i, text, {}, logprobs, validate):
+                    return chunks, True
+                return None, None
+            if len(text.strip()) >= max(tier.decide_chars, tier.min_chars):
+                # Judged on its opening: a refusal or unsure start shows up early
+                if self._accept(i, text, {}, logprobs, None):
+                    return chunks, False
+                return None, None
+        response = chunks[-1] if chunks else {}
+        if self._accept(i, "".join(parts), response, logprobs, validate):
+            return chunks, True
+        return None, None
+
+    def report(self):
+        """Prints, per tier, the requests served and the escalations by reason."""
+        total = sum(s.served for s in self.stats)
+        print(f"\n--- Model cascade ({total} requests) ---")
+        for tier, s in zip(self.tiers, self.stats):
+            asked = s.served + sum(s.escalated.values())
+            share = s.served / total if total else 0.0
+            reasons = ", ".join(f"{reason} {n}" for reason, n in sorted(s.escalated.items())) or "none"
+            mean = s.seconds / asked if asked else 0.0
+            print(f"{tier.model:<16} served {s.served:<5} ({share:.0%}), asked {asked}, "
+                  f"mean {mean:.3f}s; escalated: {reasons}")
+        for session in self.sessions:
+            if any(session.latencies.values()):
+                session.report()
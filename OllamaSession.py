@@ -0,0 +1,85 @@
+# Shared Ollama session used by the chat scripts.
+#
+# - warm() loads the model once at startup so the first user request does not
+#   pay the model-load cost.
+# - Every request passes keep_alive, so the model stays resident between
+#   turns for a configurable time instead of Ollama's 5 minute default.
+# - Callers put the static system/tool text first and identical on every call
+#   so the server can reuse its cached prompt prefix.
+# - Latency is recorded separately for cold requests (the model had to be
+#   loaded) and warm ones, and report() prints the comparison.
+
+import statistics
+import time
+
+import ollama
+
+DEFAULT_KEEP_ALIVE = "30m"
+
+# A request counts as cold when Ollama reports at least this much load time
+COLD_LOAD_SECONDS = 0.25
+
+
+class OllamaSession:
+    """Wraps an ollama.Client for one model with warm-up, keep_alive and latency stats."""
+
+    def __init__(self, model, keep_alive=DEFAULT_KEEP_ALIVE, client=None):
+        self.model = model
+        self.keep_alive = keep_alive
+        self.client = client or ollama.Client()
+        self.latencies = {"cold": [], "warm": []}  # (time to first token, total) in seconds
+
+    def warm(self):
+        """Loads the model into memory without generating anything."""
+        start = time.perf_counter()
+        response = self.client.generate(model=self.model, prompt="", keep_alive=self.keep_alive)
+        elapsed = time.perf_counter() - start
+        self._record(response, elapsed, elapsed)
+        return elapsed
+
+    def _record(self, response, first_token, total):
+        load_seconds = (response.get("load_duration") or 0) / 1e9
+        kind = "cold" if load_seconds >= COLD_LOAD_SECONDS else "warm"
+        self.latencies[kind].append((first_token, total))
+
+    def chat(self, messages, stream=False, **kwargs):
+        """client.chat() for this session's model with keep_alive applied."""
+        start = time.perf_counter()
+        response = self.client.chat(
+            model=self.model,
+            messages=messages,
+            stream=stream,
+            keep_alive=self.keep_alive,
+            **kwargs,
+        )
+        if stream:
+            return self._timed_stream(response, start)
+        elapsed = time.perf_counter() - start
+        self._record(response, elapsed, elapsed)
+        return response
+
+    def _timed_stream(self, stream, start):
+        first_token = None
+        try:
+            for chunk in stream:
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                if chunk.get("done"):
+                    self._record(chunk, first_token, time.perf_counter() - start)
+                yield chunk
+        finally:
+            # Closing early (e.g. once a JSON object is complete) drops the
+            # connection, which makes Ollama stop generating
+            stream.close()
+
+    def report(self):
+        """Prints median cold and warm latency."""
+        print(f"\n--- Latency for {self.model} (keep_alive={self.keep_alive}) ---")
+        for kind in ("cold", "warm"):
+            samples = self.latencies[kind]
+            if not samples:
+                print(f"{kind}: no requests")
+                continue
+            first = statistics.median(s[0] for s in samples)
+            total = statistics.median(s[1] for s in samples)
+            print(f"{kind}: {len(samples)} requests, median first token {first:.3f}s, median total {total:.3f}s")
@@ -0,0 +1,282 @@
+# Disk-backed cache for downloaded pages and their extracted text.
+#
+# Bodies and extracted text are stored as content-addressed blobs (named by
+# their SHA-256) under `cache_dir/blobs`, and a small SQLite index maps each
+# URL to its blobs plus the ETag/Last-Modified validators. Fresh entries are
+# served without touching the network; stale ones are revalidated with a
+# conditional GET over a pooled keep-alive session. The total blob size is
+# kept under `max_bytes` by evicting the least recently used URLs.
+#
+# Extracted text is stored with a caller-chosen `text_key` naming the
+# extractor (and its settings) that produced it, so text from an older
+# extractor is re-extracted instead of being served.
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    body_hash TEXT NOT NULL,
+    text_hash TEXT,
+    text_key TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    size INTEGER NOT NULL
+);
+"""
+
+
+class PageCache:
+    """
+    URL -> (body, extracted text) cache with conditional revalidation and
+    size-bounded LRU eviction. Safe to share between threads.
+    """
+
+    def __init__(self, cache_dir=".page_cache", max_bytes=256 * 1024 * 1024, max_age=3600,
+                 timeout=(5, 30), pool_size=10):
+        self.cache_dir = cache_dir
+        self.blob_dir = os.path.join(cache_dir, "blobs")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age = max_age  # seconds an entry is served without revalidation
+        self.timeout = timeout
+
+        # One keep-alive session for all requests so connections are reused
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"), check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(pages)")}
+        if "text_key" not in columns:
+            # Caches written before text keys existed: their text is treated as unkeyed
+            self._db.execute("ALTER TABLE pages ADD COLUMN text_key TEXT")
+        self._db.commit()
+
+    # --- Blob storage ---
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def _write_blob(self, data):
+        """Stores bytes under their SHA-256 and returns the digest."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        self._db.execute("INSERT OR IGNORE INTO blobs (hash, size) VALUES (?, ?)", (digest, len(data)))
+        return digest
+
+    def _read_blob(self, digest):
+        try:
+            with open(self._blob_path(digest), "rb") as f:
+                return f.read().decode("utf-8")
+        except FileNotFoundError:
+            return None
+
+    # --- Index ---
+
+    def _entry(self, url):
+        row = self._db.execute(
+            "SELECT body_hash, text_hash, text_key, etag, last_modified, fetched_at FROM pages WHERE url = ?",
+            (url,)
+        ).fetchone()
+        if row is None:
+            return None
+        keys = ("body_hash", "text_hash", "text_key", "etag", "last_modified", "fetched_at")
+        return dict(zip(keys, row))
+
+    def _touch(self, url):
+        self._db.execute("UPDATE pages SET last_access = ? WHERE url = ?", (time.time(), url))
+        self._db.commit()
+
+    def _evict(self):
+        """Drops least recently used URLs until the blobs fit in max_bytes."""
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        while total > self.max_bytes:
+            row = self._db.execute("SELECT url FROM pages ORDER BY last_access LIMIT 1").fetchone()
+            if row is None:
+                break
+            self._db.execute("DELETE FROM pages WHERE url = ?", row)
+            total -= self._collect_garbage()
+        self._db.commit()
+
+    def _collect_garbage(self):
+        """Deletes blobs no longer referenced by any URL and returns the bytes freed."""
+        orphans = self._db.execute(
+            "SELECT hash, size FROM blobs WHERE hash NOT IN "
+            "(SELECT body_hash FROM pages UNION SELECT text_hash FROM pages WHERE text_hash IS NOT NULL)"
+        ).fetchall()
+        freed = 0
+        for digest, size in orphans:
+            try:
+                os.remove(self._blob_path(digest))
+            except FileNotFoundError:
+                pass
+            self._db.execute("DELETE FROM blobs WHERE hash = ?", (digest,))
+            freed += size
+        return freed
+
+    # --- Public API ---
+
+    def get_body(self, url, on_chunk=None, on_complete=None):
+        """
+        Returns the page body, from disk if the cached copy is fresh or the
+        server confirms it is unchanged, otherwise from a new download.
+        Returns None if the page cannot be fetched and nothing is cached.
+
+        When the body is downloaded, `on_chunk` is called with each decoded
+        chunk as it arrives so it can be parsed while the rest is in flight,
+        and `on_complete` is called once the whole body has been received.
+        If the download fails part way, on_complete is not called and the
+        stale cached body (if any) is returned instead.
+        """
+        with self._lock:
+            entry = self._entry(url)
+            if entry and time.time() - entry["fetched_at"] < self.max_age:
+                body = self._read_blob(entry["body_hash"])
+                if body is not None:
+                    self._touch(url)
+                    return body
+                entry = None  # Blob went missing, fall through to a full download
+
+        if entry and not os.path.exists(self._blob_path(entry["body_hash"])):
+            entry = None  # Nothing to revalidate; a 304 would leave us without a body
+
+        headers = {}
+        if entry:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        try:
+            response, body = self._download(url, headers, on_chunk, on_complete)
+            if body is None:
+                with self._lock:
+                    body = self._read_blob(entry["body_hash"])
+                    if body is not None:
+                        now = time.time()
+                        self._db.execute(
+                            "UPDATE pages SET fetched_at = ?, last_access = ? WHERE url = ?", (now, now, url)
+                        )
+                        self._db.commit()
+                        return body
+                # The cached copy was evicted while the request was in flight; fetch it in full
+                entry = None
+                response, body = self._download(url, {}, on_chunk, on_complete)
+        except requests.exceptions.RequestException as e:
+            print(f"Error downloading page from {url}: {e}")
+            if entry:
+                print("Using the stale cached copy instead.")
+                return self._read_blob(entry["body_hash"])
+            return None
+
+        with self._lock:
+            now = time.time()
+            body_hash = self._write_blob(body.encode("utf-8"))
+            # Keep the extracted text only if the body did not actually change
+            unchanged = entry and entry["body_hash"] == body_hash
+            text_hash = entry["text_hash"] if unchanged else None
+            text_key = entry["text_key"] if unchanged else None
+            self._db.execute(
+                "INSERT OR REPLACE INTO pages "
+                "(url, body_hash, text_hash, text_key, etag, last_modified, fetched_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, body_hash, text_hash, text_key, response.headers.get("ETag"),
+                 response.headers.get("Last-Modified"), now, now),
+            )
+            self._collect_garbage()
+            self._evict()
+            return body
+
+    def _download(self, url, headers, on_chunk, on_complete):
+        """GETs url, returning (response, body); body is None for a 304 Not Modified."""
+        response = self.session.get(url, headers=headers, timeout=self.timeout, stream=True)
+        if response.status_code == 304:
+            response.close()
+            if not headers:
+                raise requests.exceptions.HTTPError("304 Not Modified for an unconditional request",
+                                                    response=response)
+            return response, None
+        response.raise_for_status()  # Raise an exception for HTTP errors
+        response.encoding = response.encoding or "utf-8"
+        parts = []
+        for chunk in response.iter_content(chunk_size=64 * 1024, decode_unicode=True):
+            parts.append(chunk)
+            if on_chunk is not None:
+                on_chunk(chunk)
+        if on_complete is not None:
+            on_complete()
+        return response, "".join(parts)
+
+    def get_text(self, url, extract, make_extractor=None, text_key=""):
+        """
+        Returns the extracted text of the page. `extract` (html -> text) is
+        only called when the body is new or has changed since it was last
+        extracted, or when the stored text has a different `text_key`. If
+        `make_extractor` is given, a fresh download is instead fed to the
+        streaming extractor it returns while the body arrives.
+        """
+        extractor = make_extractor() if make_extractor else None
+        received = []
+
+        body = self.get_body(url, on_chunk=extractor.feed if extractor else None,
+                             on_complete=lambda: received.append(True))
+        if body is None:
+            return None
+        text = self.cached_text(url, text_key)
+        if text is not None:
+            return text
+        # The streamed text is used whenever the extractor saw a complete download,
+        # including one where it stopped early at its budget. A cached body, or the
+        # stale copy returned after a failed download, is extracted in full.
+        if received and extractor is not None:
+            text = extractor.close()
+        else:
+            text = extract(body)
+        self.store_text(url, text, text_key)
+        return text
+
+    def cached_text(self, url, text_key=""):
+        """Returns the text stored under `text_key` for the current body of url, or None."""
+        with self._lock:
+            entry = self._entry(url)
+            if entry and entry["text_hash"] and entry["text_key"] == text_key:
+                return self._read_blob(entry["text_hash"])
+            return None
+
+    def store_text(self, url, text, text_key=""):
+        """Records the extracted text for a cached URL, replacing text stored under any other key."""
+        with self._lock:
+            if self._entry(url) is None:
+                return
+            text_hash = self._write_blob(text.encode("utf-8"))
+            self._db.execute("UPDATE pages SET text_hash = ?, text_key = ? WHERE url = ?",
+                             (text_hash, text_key, url))
+            self._collect_garbage()
+            self._evict()
+
+    def close(self):
+        self.session.close()
+        with self._lock:
+            self._db.close()
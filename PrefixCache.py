@@ -0,0 +1,170 @@
+# Prefix KV-cache reuse for many questions over one shared prompt prefix.
+#
+# D4_HF_Gemma.py asks several questions about the same context, and every
+# call re-encodes the instruction and the context. PrefixCache runs the
+# prefix through the model once, keeps its `past_key_values`, and gives
+# each question a copy of that cache. Only the question tokens then need
+# prefilling. Caches are kept in an LRU keyed by a hash of the prefix token
+# ids, bounded by their total size in bytes.
+#
+#   python PrefixCache.py --model sshleifer/tiny-gpt2 --device cpu --context-repeat 20
+#
+# compares per-question prefill time with and without the cached prefix.
+
+import argparse
+import copy
+import hashlib
+import time
+from collections import OrderedDict
+
+import torch
+
+
+def cache_nbytes(cache):
+    """Total size of the key/value tensors in a transformers Cache."""
+    if hasattr(cache, "layers"):
+        tensors = [t for layer in cache.layers for t in (layer.keys, layer.values) if t is not None]
+    else:
+        tensors = [*cache.key_cache, *cache.value_cache]
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def common_prefix_length(a, b):
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+def split_prompt(tokenizer, prompt, prefix_text, add_special_tokens=True):
+    """
+    Tokenizes `prompt` and returns (ids, prefix length), where the prefix is
+    the part of `prefix_text` that tokenizes identically inside the prompt.
+    Token merges at the boundary mean this can be slightly shorter than
+    `prefix_text` itself.
+    """
+    ids = tokenizer(prompt, add_special_tokens=add_special_tokens)["input_ids"]
+    prefix_ids = tokenizer(prefix_text, add_special_tokens=add_special_tokens)["input_ids"]
+    # Leave at least one token to prefill, so generate() has an input
+    return ids, min(common_prefix_length(ids, prefix_ids), len(ids) - 1)
+
+
+class PrefixCache:
+    """
+    Memory-bounded LRU of prefilled prefixes for one model. Keys are
+    sha256 hashes of the prefix token ids.
+    """
+
+    def __init__(self, model, max_bytes=512 * 1024 * 1024):
+        self.model = model
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (cache, nbytes)
+        self.bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "prefill_seconds": 0.0}
+
+    @staticmethod
+    def key(prefix_ids):
+        return hashlib.sha256(repr(list(prefix_ids)).encode("ascii")).hexdigest()
+
+    def _prefill(self, prefix_ids):
+        input_ids = torch.tensor([prefix_ids], device=self.model.device)
+        start = time.perf_counter()
+        with torch.inference_mode():
+            cache = self.model(input_ids=input_ids, use_cache=True).past_key_values
+        self.stats["prefill_seconds"] += time.perf_counter() - start
+        return cache
+
+    def get(self, prefix_ids):
+        """Returns a private copy of the prefilled cache for `prefix_ids`, prefilling it on a miss."""
+        key = self.key(prefix_ids)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            cache = entry[0]
+        else:
+            self.stats["misses"] += 1
+            cache = self._prefill(prefix_ids)
+            nbytes = cache_nbytes(cache)
+            self._entries[key] = (cache, nbytes)
+            self.bytes += nbytes
+            self._evict()
+        # generate() appends to the cache in place, so each caller gets its own copy
+        return copy.deepcopy(cache)
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, nbytes) = self._entries.popitem(last=False)
+            self.bytes -= nbytes
+            self.stats["evictions"] += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def generate(self, input_ids, prefix_length, **generate_kwargs):
+        """
+        Generates from `input_ids` (a list of token ids) whose first
+        `prefix_length` tokens are served from the cache. Returns the new
+        token ids.
+        """
+        cache = self.get(input_ids[:prefix_length])
+        ids = torch.tensor([input_ids], device=self.model.device)
+        with torch.inference_mode():
+            output = self.model.generate(
+                input_ids=ids,
+                attention_mask=torch.ones_like(ids),
+                past_key_values=cache,
+                **generate_kwargs,
+            )
+        return output[0, len(input_ids):]
+
+    def report(self):
+        s = self.stats
+        print(f"\n--- Prefix cache: {len(self._entries)} entries, {self.bytes / 1024 / 1024:.1f} MB ---")
+        print(f"hits {s['hits']}, misses {s['misses']}, evictions {s['evictions']}, "
+              f"prefix prefill {s['prefill_seconds']:.3f}s")
+
+
+def prefill_seconds(model, input_ids, cache=None):
+    """Times one forward pass over `input_ids` (the part not already in `cache`)."""
+    ids = torch.tensor([input_ids], device=model.device)
+    start = time.perf_counter()
+    with torch.inference_mode():
+        model(input_ids=ids, past_key_values=cache, use_cache=True)
+    return time.perf_counter() - start
+
+
+def compare_prefill(model, tokenizer, prompts, prefix_text, add_special_tokens=True):
+    """Prints per-question prefill time for the full prompt vs. the question tokens after a cached prefix."""
+    prefix_cache = PrefixCache(model)
+    print(f"{'prompt tokens':>14} {'prefix':>7} {'full ms':>9} {'cached ms':>10} {'speedup':>8}")
+    for prompt in prompts:
+        ids, prefix_length = split_prompt(tokenizer, prompt, prefix_text, add_special_tokens)
+        full = prefill_seconds(model, ids)
+        cache = prefix_cache.get(ids[:prefix_length])
+        cached = prefill_seconds(model, ids[prefix_length:], cache)
+        print(f"{len(ids):>14} {prefix_length:>7} {full * 1000:>9.1f} {cached * 1000:>10.1f} {full / cached:>7.1f}x")
+    prefix_cache.report()
+
+
+if __name__ == "__main__":
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    parser = argparse.ArgumentParser(description="Measure prefill time saved by reusing a prefix KV cache.")
+    parser.add_argument("--model", default="sshleifer/tiny-gpt2")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--context-repeat", type=int, default=10, help="repeat the context to make it longer")
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModelForCausalLM.from_pretrained(args.model).to(args.device).eval()
+    context = ("The Eiffel Tower is a wrought-iron lattice tower on the Champ de Mars in Paris, France. "
+               "It is named after the engineer Gustave Eiffel, whose company designed and built the tower. ")
+    context *= args.context_repeat
+    prefix = f"Answer the following question based only on the provided context.\n\nContext:\n{context}\n\nQuestion:\n"
+    questions = ["Who is the president of France?", "Who was the Eiffel Tower named after?",
+                 "When was the tower built?", "Where is the tower?"]
+    compare_prefill(model, tokenizer, [prefix + q for q in questions], prefix)
@@ -0,0 +1,83 @@
+# Batch ingestion for D1_Ollama_RAG.
+#
+# A batch file has the shape of prompts.txt: a URL on its own line followed
+# by the questions to ask about that page, then the next URL, and so on.
+# Pages are downloaded concurrently by a thread pool (with a per-host limit)
+# and their HTML is converted to text in a process pool, so parsing never
+# blocks downloads. Each page is handed to `on_page` as soon as it is ready,
+# so total time is bounded by the slowest page rather than the sum of all.
+
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+from HTMLText import extract_text, text_key
+
+
+def parse_batch_file(path):
+    """Returns a list of (url, [questions]) from a prompts.txt-style file."""
+    jobs = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith(("http://", "https://")):
+                jobs.append((line, []))
+            elif jobs:
+                jobs[-1][1].append(line)
+            else:
+                print(f"Skipping question with no URL before it: {line}")
+    return jobs
+
+
+class HostLimiter:
+    """Limits how many downloads run at once against the same host."""
+
+    def __init__(self, per_host):
+        self.per_host = per_host
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    def for_url(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.per_host)
+            return self._semaphores[host]
+
+
+def run_batch(jobs, page_cache, on_page, fetch_workers=8, per_host=2, parse_workers=None,
+              max_chars=None):
+    """
+    Fetches and extracts every page in `jobs` concurrently and calls
+    on_page(url, text, questions) in the calling thread as each page becomes
+    ready. `text` is None if the page could not be downloaded.
+    """
+    limiter = HostLimiter(per_host)
+    key = text_key(max_chars)
+
+    with ProcessPoolExecutor(max_workers=parse_workers) as parse_pool, \
+            ThreadPoolExecutor(max_workers=fetch_workers) as fetch_pool:
+
+        def load(url):
+            with limiter.for_url(url):
+                body = page_cache.get_body(url)
+            if body is None:
+                return None
+            text = page_cache.cached_text(url, key)
+            if text is None:
+                # CPU-bound extraction runs in another process; this thread just waits
+                text = parse_pool.submit(extract_text, body, max_chars).result()
+                page_cache.store_text(url, text, key)
+            return text
+
+        futures = {fetch_pool.submit(load, url): (url, questions) for url, questions in jobs}
+        for future in as_completed(futures):
+            url, questions = futures[future]
+            try:
+                text = future.result()
+            except Exception as e:
+                print(f"\nFailed to load {url}: {e}")
+                text = None
+            on_page(url, text, questions)
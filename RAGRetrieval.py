@@ -0,0 +1,150 @@
+# Retrieval stage for D1_Ollama_RAG: split a page into overlapping chunks,
+# index them once with BM25 (and optionally Ollama embeddings) and return only
+# the top-k chunks for each question, so the prompt size depends on k and not
+# on the length of the page.
+
+import math
+import re
+from collections import Counter
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """Lower-cases the text and splits it into word tokens."""
+    return TOKEN_RE.findall(text.lower())
+
+
+def chunk_text(text, chunk_size=1500, overlap=200):
+    """
+    Splits text into chunks of at most `chunk_size` characters.
+    Chunks are built from whole lines where possible, and the last
+    `overlap` characters' worth of lines are repeated at the start of the
+    next chunk so an answer spanning a boundary is not lost. Overlap lines
+    are dropped where keeping them would exceed `chunk_size`.
+    """
+    if overlap >= chunk_size:
+        raise ValueError("overlap must be smaller than chunk_size")
+
+    # Hard-split any single line that is longer than a chunk
+    lines = []
+    for line in text.splitlines():
+        while len(line) > chunk_size:
+            lines.append(line[:chunk_size])
+            line = line[chunk_size - overlap:]
+        if line:
+            lines.append(line)
+
+    chunks = []
+    current = []
+    current_len = 0
+    for line in lines:
+        if current and current_len + len(line) + 1 > chunk_size:
+            chunks.append("\n".join(current))
+            # Carry the tail of the previous chunk over as overlap
+            carried = []
+            carried_len = 0
+            for prev in reversed(current):
+                if carried_len + len(prev) + 1 > overlap:
+                    break
+                carried.insert(0, prev)
+                carried_len += len(prev) + 1
+            # Drop overlap lines that would push the new chunk past chunk_size
+            while carried and carried_len + len(line) + 1 > chunk_size:
+                carried_len -= len(carried.pop(0)) + 1
+            current = carried
+            current_len = carried_len
+        current.append(line)
+        current_len += len(line) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def cosine(a, b):
+    """Cosine similarity of two equal-length vectors."""
+    dot = sum(x * y for x, y in zip(a, b))
+    norm_a = math.sqrt(sum(x * x for x in a))
+    norm_b = math.sqrt(sum(y * y for y in b))
+    if not norm_a or not norm_b:
+        return 0.0
+    return dot / (norm_a * norm_b)
+
+
+class BM25Index:
+    """
+    Okapi BM25 over a fixed list of chunks. Term statistics are computed
+    once when the index is built, so each query is a single pass over the
+    postings of the query terms.
+    """
+
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self.doc_lengths = []
+        self.postings = {}
+        for i, chunk in enumerate(chunks):
+            counts = Counter(tokenize(chunk))
+            self.doc_lengths.append(sum(counts.values()))
+            for term, freq in counts.items():
+                self.postings.setdefault(term, []).append((i, freq))
+        n = len(chunks)
+        self.avg_length = (sum(self.doc_lengths) / n) if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def scores(self, query):
+        """Returns a {chunk_index: score} dict for the chunks matching the query."""
+        scores = {}
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            idf = self.idf[term]
+            for i, freq in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[i] / (self.avg_length or 1))
+                scores[i] = scores.get(i, 0.0) + idf * freq * (self.k1 + 1) / (freq + norm)
+        return scores
+
+
+class PageIndex:
+    """
+    Chunk index for a single page. BM25 is always used; if an embedding
+    model is given the chunks are also embedded once with Ollama and the two
+    rankings are merged with reciprocal rank fusion.
+    """
+
+    def __init__(self, text, chunk_size=1500, overlap=200, client=None, embed_model=None):
+        self.chunks = chunk_text(text, chunk_size, overlap)
+        self.bm25 = BM25Index(self.chunks)
+        self.client = client
+        self.embed_model = embed_model
+        self.embeddings = None
+        if client is not None and embed_model and self.chunks:
+            self.embeddings = client.embed(model=embed_model, input=self.chunks)["embeddings"]
+
+    def search(self, query, k=4, rrf_k=60):
+        """Returns the indices of the top-k chunks for the query, best first."""
+        bm25_scores = self.bm25.scores(query)
+        rankings = [sorted(bm25_scores, key=bm25_scores.get, reverse=True)]
+
+        if self.embeddings is not None:
+            query_vec = self.client.embed(model=self.embed_model, input=query)["embeddings"][0]
+            sims = [cosine(query_vec, vec) for vec in self.embeddings]
+            rankings.append(sorted(range(len(sims)), key=sims.__getitem__, reverse=True))
+
+        fused = {}
+        for ranking in rankings:
+            for rank, i in enumerate(ranking):
+                fused[i] = fused.get(i, 0.0) + 1.0 / (rrf_k + rank + 1)
+        if not fused:
+            # Nothing matched lexically and no embeddings: fall back to the top of the page
+            return list(range(min(k, len(self.chunks))))
+        return sorted(fused, key=fused.get, reverse=True)[:k]
+
+    def context_for(self, query, k=4):
+        """Returns the top-k chunks joined in page order, ready to paste into a prompt."""
+        top = sorted(self.search(query, k))
+        return "\n\n...\n\n".join(self.chunks[i] for i in top)
@@ -0,0 +1,220 @@
+# Pooled SQL execution layer for ChatSQL.
+#
+# Operations are SQL statements with named parameters (":customer_id").
+# Each statement is compiled once per operation name into driver SQL with
+# "?" placeholders plus the order of its parameter names, so values are
+# always bound by name. Connections come from a bounded pool, and
+# execute_batch() runs consecutive writes of the same operation with a single
+# executemany() call in one transaction.
+#
+# SQLite (standard library) is the local backend; pyodbc is optional and
+# only imported when PyODBCBackend is used.
+
+import queue
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+PARAM_RE = re.compile(r"(?<![:\w]):([A-Za-z_]\w*)")
+
+CUSTOMERS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS Customers (
+    CustomerID INTEGER PRIMARY KEY AUTOINCREMENT,
+    FirstName TEXT NOT NULL,
+    LastName TEXT NOT NULL,
+    City TEXT
+)
+"""
+
+
+class DatabaseError(Exception):
+    """A driver error raised while executing an operation."""
+
+
+class PreparedStatement:
+    """A named-parameter statement compiled to "?" placeholders."""
+
+    def __init__(self, name, sql):
+        self.name = name
+        self.param_names = PARAM_RE.findall(sql)
+        self.sql = PARAM_RE.sub("?", sql)
+        self.is_query = sql.lstrip().upper().startswith("SELECT")
+
+    def bind(self, params):
+        """Returns the values in placeholder order, looked up by name."""
+        params = params or {}
+        missing = [name for name in self.param_names if name not in params]
+        if missing:
+            raise ValueError(f"Missing parameters for '{self.name}': {missing}")
+        return tuple(params[name] for name in self.param_names)
+
+
+class SQLiteBackend:
+    """Local SQLite database, used for development and testing."""
+
+    def __init__(self, database="chat_sql.sqlite"):
+        self.database = database
+        self.errors = (sqlite3.Error,)
+
+    def connect(self):
+        # SQLite also caches compiled statements per connection, keyed by SQL text
+        return sqlite3.connect(self.database, check_same_thread=False, cached_statements=256)
+
+
+class PyODBCBackend:
+    """SQL Server (or any ODBC database) through pyodbc."""
+
+    def __init__(self, connection_string):
+        import pyodbc  # Optional dependency, only needed for this backend
+
+        self.pyodbc = pyodbc
+        self.connection_string = connection_string
+        self.errors = (pyodbc.Error,)
+
+    def connect(self):
+        return self.pyodbc.connect(self.connection_string)
+
+
+class ConnectionPool:
+    """
+    At most `size` connections, created lazily and reused between requests.
+    A connection that raised a driver error is closed instead of reused.
+    """
+
+    def __init__(self, backend, size=4, timeout=30):
+        self.backend = backend
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        except self.backend.errors:
+            # The connection may be broken (e.g. a dropped server link), so don't hand it out again
+            self._discard(conn)
+            raise
+        except Exception:
+            conn.rollback()
+            self._release(conn)
+            raise
+        else:
+            self._release(conn)
+
+    def _acquire(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError(f"No database connection free after {self.timeout}s")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return self.backend.connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, conn):
+        self._idle.put(conn)
+        self._slots.release()
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class SQLExecutor:
+    """Runs named operations through a connection pool and a statement cache."""
+
+    def __init__(self, backend, operations, pool_size=4):
+        self.backend = backend
+        self.operations = operations
+        self.pool = ConnectionPool(backend, pool_size)
+        self._statements = {}
+
+    def statement(self, name):
+        """Returns the compiled statement for an operation, compiling it on first use."""
+        statement = self._statements.get(name)
+        if statement is None:
+            if name not in self.operations:
+                raise KeyError(f"Unknown SQL operation: {name}")
+            statement = self._statements[name] = PreparedStatement(name, self.operations[name])
+        return statement
+
+    def execute(self, name, params=None):
+        """
+        Executes one operation. SELECTs return a list of row dicts, other
+        statements return the number of affected rows.
+        """
+        statement = self.statement(name)
+        values = statement.bind(params)
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(statement.sql, values)
+                if statement.is_query:
+                    columns = [column[0] for column in cursor.description]
+                    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+                conn.commit()
+                return cursor.rowcount
+        except self.backend.errors as e:
+            raise DatabaseError(str(e)) from e
+
+    def execute_batch(self, calls):
+        """
+        Executes a list of (name, params) in order on one connection and in
+        one transaction. Consecutive writes of the same operation are sent
+        together with executemany(). Returns one result per call (row dicts
+        for queries, None for batched writes).
+        """
+        results = []
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                if hasattr(cursor, "fast_executemany"):
+                    cursor.fast_executemany = True  # pyodbc: send the batch as one round trip
+                i = 0
+                while i < len(calls):
+                    statement = self.statement(calls[i][0])
+                    if statement.is_query:
+                        cursor.execute(statement.sql, statement.bind(calls[i][1]))
+                        columns = [column[0] for column in cursor.description]
+                        results.append([dict(zip(columns, row)) for row in cursor.fetchall()])
+                        i += 1
+                        continue
+                    j = i
+                    while j < len(calls) and calls[j][0] == statement.name:
+                        j += 1
+                    cursor.executemany(statement.sql, [statement.bind(params) for _, params in calls[i:j]])
+                    results.extend([None] * (j - i))
+                    i = j
+                conn.commit()
+        except self.backend.errors as e:
+            raise DatabaseError(str(e)) from e
+        return results
+
+    def create_schema(self, script=CUSTOMERS_SCHEMA):
+        """Runs DDL statements, e.g. to set up the local SQLite database."""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            for sql in script.split(";"):
+                if sql.strip():
+                    cursor.execute(sql)
+            conn.commit()
+
+    def close(self):
+        self.pool.close()
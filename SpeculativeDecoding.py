@@ -0,0 +1,149 @@
+# Greedy speculative decoding with a small draft model.
+#
+# The draft model proposes `lookahead` tokens one at a time (cheap). The
+# target model then checks all of them in a single forward pass and keeps the
+# longest prefix that matches its own greedy choice, plus one token of its
+# own: the correction at the first mismatch, or a bonus token when every
+# proposal matched. The output is identical to the target's greedy decoding,
+# but when the draft agrees often, the target runs once per several tokens
+# instead of once per token.
+#
+# Both models keep a KV cache; after each round the caches are cropped back
+# to the accepted tokens with DynamicCache.crop. The two models must share a
+# tokenizer, e.g. Llama-3.2-1B drafting for Llama-3.1-8B.
+#
+#   python SpeculativeDecoding.py --target meta-llama/Llama-3.1-8B --draft meta-llama/Llama-3.2-1B --lookahead 2 4 6
+
+import argparse
+import time
+
+import torch
+from transformers import DynamicCache
+
+
+def _forward(model, input_ids, cache):
+    """Runs input_ids (1-D list) through the model on top of `cache`; returns greedy predictions per position."""
+    ids = torch.tensor([input_ids], device=model.device)
+    logits = model(input_ids=ids, past_key_values=cache, use_cache=True).logits
+    return logits[0].argmax(dim=-1).tolist()
+
+
+def speculative_generate(target, draft, input_ids, max_new_tokens=128, lookahead=4, eos_token_id=None):
+    """
+    Greedy generation from `input_ids` (a list of token ids) with `draft`
+    proposing `lookahead` tokens per round. Returns a dict with the new
+    token ids and acceptance/throughput statistics.
+    """
+    if target.config.vocab_size != draft.config.vocab_size:
+        raise ValueError("The draft and target models must share a vocabulary.")
+    eos = {eos_token_id} if isinstance(eos_token_id, int) else set(eos_token_id or [])
+    tokens = list(input_ids)
+    prompt_length = len(tokens)
+    target_cache, draft_cache = DynamicCache(), DynamicCache()
+    stats = {"drafted": 0, "accepted": 0, "target_forwards": 0, "rounds": 0}
+
+    start = time.perf_counter()
+    with torch.inference_mode():
+        # Invariant: both caches hold every token except the last one in `tokens`
+        if len(tokens) > 1:
+            _forward(target, tokens[:-1], target_cache)
+            _forward(draft, tokens[:-1], draft_cache)
+
+        while len(tokens) - prompt_length < max_new_tokens:
+            remaining = max_new_tokens - (len(tokens) - prompt_length)
+            k = min(lookahead, remaining)
+
+            # Draft k tokens greedily
+            proposals = []
+            draft_input = tokens[draft_cache.get_seq_length():]
+            for _ in range(k):
+                proposal = _forward(draft, draft_input, draft_cache)[-1]
+                proposals.append(proposal)
+                draft_input = [proposal]
+                if proposal in eos:
+                    break
+
+            # Verify them all with one target pass
+            target_input = tokens[target_cache.get_seq_length():] + proposals
+            predictions = _forward(target, target_input, target_cache)
+            stats["target_forwards"] += 1
+            stats["rounds"] += 1
+            offset = len(target_input) - len(proposals) - 1
+            accepted = 0
+            while accepted < len(proposals) and proposals[accepted] == predictions[offset + accepted]:
+                accepted += 1
+            stats["drafted"] += len(proposals)
+            stats["accepted"] += accepted
+            new = proposals[:accepted] + [predictions[offset + accepted]]
+
+            for token in new[:remaining]:
+                tokens.append(token)
+                if token in eos:
+                    break
+            if tokens[-1] in eos:
+                break
+
+            # Drop the rejected proposals from both caches
+            for cache in (target_cache, draft_cache):
+                excess = cache.get_seq_length() - (len(tokens) - 1)
+                if excess > 0:
+                    cache.crop(-excess)
+    elapsed = time.perf_counter() - start
+
+    generated = len(tokens) - prompt_length
+    return {
+        "tokens": tokens[prompt_length:],
+        "elapsed": elapsed,
+        "tokens_per_second": generated / elapsed if elapsed else 0.0,
+        "acceptance_rate": stats["accepted"] / stats["drafted"] if stats["drafted"] else 0.0,
+        "tokens_per_target_forward": generated / stats["target_forwards"] if stats["target_forwards"] else 0.0,
+        **stats,
+    }
+
+
+def greedy_generate(model, input_ids, max_new_tokens=128, eos_token_id=None):
+    """The target alone, for comparison. Returns (new token ids, seconds)."""
+    ids = torch.tensor([input_ids], device=model.device)
+    start = time.perf_counter()
+    with torch.inference_mode():
+        output = model.generate(input_ids=ids, attention_mask=torch.ones_like(ids), max_new_tokens=max_new_tokens,
+                                do_sample=False, eos_token_id=eos_token_id, pad_token_id=eos_token_id)
+    return output[0, len(input_ids):].tolist(), time.perf_counter() - start
+
+
+def print_stats(result, lookahead):
+    print(f"lookahead {lookahead}: {len(result['tokens'])} tokens in {result['elapsed']:.2f}s "
+          f"({result['tokens_per_second']:.1f} tok/s), acceptance {result['acceptance_rate']:.0%}, "
+          f"{result['tokens_per_target_forward']:.2f} tokens per target pass")
+
+
+def compare(target, draft, tokenizer, prompt, lookaheads=(2, 4, 6), max_new_tokens=64):
+    """Prints greedy target-only speed next to speculative decoding at each lookahead, and checks outputs match."""
+    input_ids = tokenizer(prompt)["input_ids"]
+    eos = tokenizer.eos_token_id
+    baseline, seconds = greedy_generate(target, input_ids, max_new_tokens, eos)
+    print(f"target only: {len(baseline)} tokens in {seconds:.2f}s ({len(baseline) / seconds:.1f} tok/s)")
+    for lookahead in lookaheads:
+        result = speculative_generate(target, draft, input_ids, max_new_tokens, lookahead, eos)
+        print_stats(result, lookahead)
+        if result["tokens"] != baseline[:len(result["tokens"])]:
+            print("  warning: output differs from the target's greedy decoding")
+
+
+if __name__ == "__main__":
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    parser = argparse.ArgumentParser(description="Compare greedy and speculative decoding for a target/draft pair.")
+    parser.add_argument("--target", default="meta-llama/Llama-3.1-8B")
+    parser.add_argument("--draft", default="meta-llama/Llama-3.2-1B")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--lookahead", type=int, nargs="+", default=[2, 4, 6])
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--prompt", default="The planets of the solar system are")
+    args = parser.parse_args()
+
+    dtype = torch.bfloat16 if args.device == "cuda" else torch.float32
+    tokenizer = AutoTokenizer.from_pretrained(args.target)
+    target = AutoModelForCausalLM.from_pretrained(args.target, torch_dtype=dtype).to(args.device).eval()
+    draft = AutoModelForCausalLM.from_pretrained(args.draft, torch_dtype=dtype).to(args.device).eval()
+    compare(target, draft, tokenizer, args.prompt, args.lookahead, args.max_new_tokens)
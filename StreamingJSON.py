@@ -0,0 +1,141 @@
+# Early-terminating JSON parsing of streamed tool-call responses.
+#
+# IncrementalJSONObject is fed the text of a streamed completion chunk by
+# chunk. It skips any text before the first "{", reports each top-level field
+# as soon as its value is complete (so "tool_name" can be checked while the
+# arguments are still streaming) and stops at the "}" that closes the first
+# top-level object. parse_first_object() then closes the stream, which drops
+# the connection and makes Ollama stop generating the tokens that would
+# otherwise follow the object.
+
+import json
+
+
+class IncrementalJSONObject:
+    """
+    Incremental scanner for the first top-level JSON object in a text stream.
+    `fields` holds top-level values that are already complete; `result`
+    holds the parsed object once `done` is True.
+    """
+
+    def __init__(self, on_field=None):
+        self.on_field = on_field
+        self.fields = {}
+        self.result = None
+        self.done = False
+        self.aborted = False
+        self._chars = []
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expect = "key"  # what comes next at depth 1: "key", "colon" or "value"
+        self._string_start = 0
+        self._key = None
+        self._value_start = 0
+
+    @property
+    def text(self):
+        """The object text seen so far (from its opening brace)."""
+        return "".join(self._chars)
+
+    def feed(self, text):
+        """Consumes the next piece of text. Returns True once the object is complete."""
+        for ch in text:
+            if self.done:
+                break
+            if not self._started:
+                if ch != "{":
+                    continue  # Skip prose or a ```json fence before the object
+                self._started = True
+            self._chars.append(ch)
+            self._step(ch, len(self._chars) - 1)
+        return self.done
+
+    def _step(self, ch, i):
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif ch == "\\":
+                self._escape = True
+            elif ch == '"':
+                self._in_string = False
+                if self._depth == 1:
+                    self._end_string(i)
+            return
+
+        if ch == '"':
+            self._in_string = True
+            self._string_start = i
+        elif ch in "{[":
+            self._depth += 1
+            if self._depth == 2 and self._expect == "value":
+                self._value_start = i
+        elif ch in "}]":
+            if self._depth == 1:
+                self._end_value(i)
+            self._depth -= 1
+            if self._depth == 0:
+                self._finish()
+        elif self._depth == 1:
+            if ch == ":" and self._expect == "colon":
+                self._expect = "value"
+                self._value_start = i + 1
+            elif ch == ",":
+                self._end_value(i)
+
+    def _end_string(self, i):
+        raw = "".join(self._chars[self._string_start:i + 1])
+        if self._expect == "key":
+            self._key = json.loads(raw)
+            self._expect = "colon"
+        elif self._expect == "value":
+            self._record(json.loads(raw))
+
+    def _end_value(self, i):
+        """Called at a top-level "," or "}" to record a non-string value."""
+        if self._expect == "value" and self._key is not None:
+            raw = "".join(self._chars[self._value_start:i]).strip()
+            if raw:
+                try:
+                    self._record(json.loads(raw))
+                except json.JSONDecodeError:
+                    pass  # Left for the final json.loads to report
+        self._expect = "key"
+        self._key = None
+
+    def _record(self, value):
+        key = self._key
+        self.fields[key] = value
+        self._expect = "done"  # value complete; wait for "," or "}"
+        if self.on_field is not None and self.on_field(key, value) is False:
+            self.aborted = True
+            self.done = True
+
+    def _finish(self):
+        self.done = True
+        try:
+            self.result = json.loads(self.text)
+        except json.JSONDecodeError:
+            self.result = None
+
+
+def parse_first_object(stream, on_field=None, text_of=lambda chunk: chunk['message']['content']):
+    """
+    Reads a streamed completion until its first top-level JSON object is
+    complete, then closes the stream to cancel the rest of the generation.
+
+    `on_field(name, value)` is called as each top-level field completes; if
+    it returns False, reading stops at once. Returns the IncrementalJSONObject
+    (check .done, .aborted, .result and .text).
+    """
+    parser = IncrementalJSONObject(on_field)
+    try:
+        for chunk in stream:
+            if parser.feed(text_of(chunk) or ""):
+                break
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+    return parser
@@ -0,0 +1,254 @@
+# Per-request inference telemetry.
+#
+# Ollama reports where each request's time went: load_duration (model
+# load), prompt_eval_duration/prompt_eval_count (prefill) and
+# eval_duration/eval_count (decode). InstrumentedClient wraps an
+# ollama.Client and records those fields for every chat/generate/embed call,
+# along with what the client itself saw: time to first chunk, end-to-end
+# time, and the remainder not covered by the server's total_duration
+# (queueing in the server plus transport). Scripts add their own spans
+# (page fetch and parse, tool execution) with telemetry.timer().
+#
+# Values go into fixed-bucket histograms (one bisect and two additions per
+# observation) and each request is also appended as a line to an optional
+# JSONL trace. Histograms are exported in the Prometheus text format.
+#
+#   LLM_TRACE=trace.jsonl LLM_METRICS=metrics.prom python D1_Ollama.py
+#
+# writes both files; report() prints a summary either way.
+
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import ollama
+
+# Bucket upper bounds: seconds from 1 ms to ~2 min, token counts from 1 to 32k
+SECONDS_BUCKETS = tuple(0.001 * 2 ** i for i in range(18))
+TOKEN_BUCKETS = tuple(2 ** i for i in range(16))
+
+
+class Histogram:
+    """Cumulative-style histogram with fixed upper bounds (Prometheus semantics on export)."""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (an over-estimate, as in Prometheus)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.bounds, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Telemetry:
+    """Histograms keyed by metric name and labels, plus an optional JSONL request trace."""
+
+    def __init__(self, trace_path=None, prefix="llm"):
+        self.prefix = prefix
+        self.histograms = {}  # (name, labels) -> Histogram
+        self._lock = threading.Lock()
+        self._trace = open(trace_path, "a", encoding="utf-8") if trace_path else None
+
+    def observe(self, name, value, **labels):
+        bounds = TOKEN_BUCKETS if name.endswith("_tokens") else SECONDS_BUCKETS
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(bounds)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observes the block's wall time as `<name>_seconds`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(f"{name}_seconds", time.perf_counter() - start, **labels)
+
+    def trace(self, record):
+        if self._trace is None:
+            return
+        line = json.dumps(record)
+        with self._lock:
+            self._trace.write(line + "\n")
+            self._trace.flush()
+
+    def record_response(self, endpoint, model, response, first_chunk, total):
+        """Records Ollama's timing fields from a final response (or last stream chunk) plus client timings."""
+        labels = {"endpoint": endpoint, "model": model}
+        server = {name: (response.get(name) or 0) / 1e9 for name in
+                  ("total_duration", "load_duration", "prompt_eval_duration", "eval_duration")}
+        counts = {name: response.get(name) or 0 for name in ("prompt_eval_count", "eval_count")}
+
+        self.observe("request_seconds", total, **labels)
+        if first_chunk is not None:
+            self.observe("first_chunk_seconds", first_chunk, **labels)
+        self.observe("load_seconds", server["load_duration"], **labels)
+        self.observe("prefill_seconds", server["prompt_eval_duration"], **labels)
+        self.observe("decode_seconds", server["eval_duration"], **labels)
+        # Whatever Ollama did not account for: its request queue plus transport
+        queue = max(0.0, total - server["total_duration"]) if server["total_duration"] else 0.0
+        self.observe("queue_seconds", queue, **labels)
+        self.observe("prompt_tokens", counts["prompt_eval_count"], **labels)
+        self.observe("output_tokens", counts["eval_count"], **labels)
+
+        self.trace({
+            "time": time.time(),
+            **labels,
+            "total": total,
+            "first_chunk": first_chunk,
+            "queue": queue,
+            "load": server["load_duration"],
+            "prefill": server["prompt_eval_duration"],
+            "decode": server["eval_duration"],
+            "prompt_tokens": counts["prompt_eval_count"],
+            "output_tokens": counts["eval_count"],
+            "decode_tps": counts["eval_count"] / server["eval_duration"] if server["eval_duration"] else None,
+        })
+
+    # --- Export ---
+
+    def prometheus_text(self):
+        """All histograms in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            items = sorted(self.histograms.items())
+        typed = set()
+        for (name, labels), h in items:
+            metric = f"{self.prefix}_{name}"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} histogram")
+                typed.add(metric)
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+            sep = "," if label_text else ""
+            cumulative = 0
+            for bound, n in zip((*h.bounds, "+Inf"), h.counts):
+                cumulative += n
+                le = bound if bound == "+Inf" else f"{bound:g}"
+                lines.append(f'{metric}_bucket{{{label_text}{sep}le="{le}"}} {cumulative}')
+            lines.append(f"{metric}_sum{{{label_text}}} {h.sum:g}")
+            lines.append(f"{metric}_count{{{label_text}}} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp, path)
+
+    def report(self):
+        """Prints count, mean and approximate p50/p95 for every histogram."""
+        with self._lock:
+            items = sorted(self.histograms.items())
+        if not items:
+            return
+        print("\n--- Telemetry ---")
+        for (name, labels), h in items:
+            label_text = " ".join(f"{v}" for _, v in labels)
+            unit = "" if name.endswith("_tokens") else "s"
+            print(f"{name:<20} {label_text:<28} n={h.count:<5} mean {h.sum / h.count:.3f}{unit}  "
+                  f"p50<={h.quantile(0.5):g}{unit}  p95<={h.quantile(0.95):g}{unit}")
+
+    def close(self):
+        if self._trace is not None:
+            self._trace.close()
+            self._trace = None
+
+
+class InstrumentedClient:
+    """
+    Drop-in wrapper for ollama.Client that records telemetry for chat,
+    generate and embed. Everything else is passed through to the client.
+    """
+
+    def __init__(self, client=None, telemetry=None):
+        self.client = client or ollama.Client()
+        self.telemetry = telemetry or get_telemetry()
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def close(self):
+        """Closes the wrapped client's connections."""
+        close = getattr(self.client, "close", None)
+        if close is not None:
+            close()
+        else:
+            self.client._client.close()  # Older ollama clients have no public close()
+
+    def chat(self, *args, **kwargs):
+        return self._call("chat", self.client.chat, args, kwargs)
+
+    def generate(self, *args, **kwargs):
+        return self._call("generate", self.client.generate, args, kwargs)
+
+    def embed(self, *args, **kwargs):
+        return self._call("embed", self.client.embed, args, kwargs)
+
+    def _call(self, endpoint, method, args, kwargs):
+        model = kwargs.get("model") or (args[0] if args else "")
+        start = time.perf_counter()
+        response = method(*args, **kwargs)
+        if kwargs.get("stream"):
+            return self._timed_stream(endpoint, model, response, start)
+        self.telemetry.record_response(endpoint, model, response, None, time.perf_counter() - start)
+        return response
+
+    def _timed_stream(self, endpoint, model, stream, start):
+        first_chunk = None
+        try:
+            for chunk in stream:
+                if first_chunk is None:
+                    first_chunk = time.perf_counter() - start
+                if chunk.get("done"):
+                    self.telemetry.record_response(endpoint, model, chunk, first_chunk,
+                                                   time.perf_counter() - start)
+                yield chunk
+        finally:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+
+
+_default = None
+
+
+def get_telemetry():
+    """
+    The process-wide Telemetry. LLM_TRACE names a JSONL trace file and
+    LLM_METRICS a Prometheus text file written at exit.
+    """
+    global _default
+    if _default is None:
+        _default = Telemetry(os.environ.get("LLM_TRACE"))
+        metrics_path = os.environ.get("LLM_METRICS")
+        if metrics_path:
+            atexit.register(_default.write_prometheus, metrics_path)
+        atexit.register(_default.close)
+    return _default
+
+
+def instrumented_client(host=None):
+    """An ollama.Client for `host` that records into the process-wide Telemetry."""
+    return InstrumentedClient(ollama.Client(host=host), get_telemetry())
@@ -0,0 +1,151 @@
+# Concurrent tool execution for the chat scripts.
+#
+# A turn may ask for several tool calls at once. ToolExecutor runs them
+# together on one asyncio event loop kept on a background thread: async tool
+# functions are awaited directly and plain functions run on a thread pool,
+# so a turn takes as long as its slowest call instead of the sum of them.
+#
+# Each tool can set, next to "function" and "schema" in AVAILABLE_TOOLS:
+#   "timeout":         seconds, including any wait for a free slot, before the
+#                      call is abandoned with an error result (a plain
+#                      function's thread still runs to the end);
+#   "max_concurrency": calls of this tool allowed to run at the same time. An
+#                      abandoned thread keeps its slot until it really ends;
+#   "cache_ttl":       seconds a result is reused for identical arguments.
+#                      Only for idempotent tools such as get_weather. Identical
+#                      calls already in progress share the one result.
+
+import asyncio
+import inspect
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_MAX_CONCURRENCY = 4
+
+
+class ToolExecutor:
+    """Runs lists of (tool_name, arguments) calls concurrently with per-tool limits and result caching."""
+
+    def __init__(self, available_tools, max_workers=16, telemetry=None):
+        self.tools = available_tools
+        self.telemetry = telemetry
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._semaphores = {}  # tool name -> asyncio.Semaphore, created on the loop
+        self._cache = {}  # (tool name, arguments JSON) -> (expiry time, result)
+        self._pending = {}  # (tool name, arguments JSON) -> asyncio.Future of a cacheable call in progress
+        self.stats = {"calls": 0, "cache_hits": 0, "timeouts": 0, "errors": 0, "batches": 0, "max_parallel": 0}
+
+    def run(self, tool_name, arguments):
+        """Runs a single call and returns its result."""
+        return self.run_all([(tool_name, arguments)])[0]
+
+    def run_all(self, calls):
+        """
+        Runs every (tool_name, arguments) call concurrently and returns their
+        results in the same order. Failures and timeouts come back as error
+        strings the model can act on instead of being raised.
+        """
+        if not calls:
+            return []
+        self.stats["batches"] += 1
+        self.stats["max_parallel"] = max(self.stats["max_parallel"], len(calls))
+        return asyncio.run_coroutine_threadsafe(self._run_all(calls), self._loop).result()
+
+    async def _run_all(self, calls):
+        return await asyncio.gather(*(self._call(name, arguments) for name, arguments in calls))
+
+    async def _call(self, tool_name, arguments):
+        self.stats["calls"] += 1
+        tool = self.tools.get(tool_name)
+        if tool is None:
+            self.stats["errors"] += 1
+            return f"Error: unknown tool '{tool_name}'."
+        ttl = tool.get("cache_ttl")
+        if not ttl:
+            return await self._execute(tool_name, tool, arguments)
+
+        key = (tool_name, json.dumps(arguments, sort_keys=True, default=str))
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            self.stats["cache_hits"] += 1
+            return cached[1]
+        if key in self._pending:
+            self.stats["cache_hits"] += 1
+            return await asyncio.shield(self._pending[key])
+
+        future = self._pending[key] = self._loop.create_future()
+        try:
+            result, ok = await self._execute(tool_name, tool, arguments, with_status=True)
+            if ok:
+                self._cache[key] = (time.monotonic() + ttl, result)
+            future.set_result(result)
+            return result
+        finally:
+            del self._pending[key]
+            if not future.done():
+                future.cancel()
+
+    async def _execute(self, tool_name, tool, arguments, with_status=False):
+        semaphore = self._semaphores.get(tool_name)
+        if semaphore is None:
+            semaphore = self._semaphores[tool_name] = asyncio.Semaphore(
+                tool.get("max_concurrency", DEFAULT_MAX_CONCURRENCY))
+        timeout = tool.get("timeout", DEFAULT_TIMEOUT)
+        function = tool["function"]
+        deadline = self._loop.time() + timeout
+
+        ok = False
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout)
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                semaphore.release()
+                raise asyncio.TimeoutError
+            if inspect.iscoroutinefunction(function):
+                try:
+                    result = await asyncio.wait_for(function(**arguments), remaining)
+                finally:
+                    semaphore.release()
+            else:
+                # The slot is freed when the thread ends, not when the wait times out,
+                # so abandoned threads still count against max_concurrency
+                call = self._loop.run_in_executor(self._pool, lambda: function(**arguments))
+
+                def finished(future):
+                    semaphore.release()
+                    if not future.cancelled():
+                        future.exception()  # Retrieved, so an abandoned call's error is not logged as lost
+
+                call.add_done_callback(finished)
+                result = await asyncio.wait_for(asyncio.shield(call), remaining)
+            ok = True
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            result = f"Error: '{tool_name}' did not finish within {timeout:g} seconds."
+        except Exception as e:
+            self.stats["errors"] += 1
+            result = f"Error: '{tool_name}' failed: {e}"
+        if self.telemetry is not None:
+            self.telemetry.observe("tool_seconds", time.perf_counter() - start, tool=tool_name)
+        return (result, ok) if with_status else result
+
+    def clear_cache(self):
+        self._loop.call_soon_threadsafe(self._cache.clear)
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def report(self):
+        s = self.stats
+        print("\n--- Tool execution ---")
+        print(f"{s['calls']} calls in {s['batches']} batches (up to {s['max_parallel']} at once), "
+              f"{s['cache_hits']} cache hits, {s['timeouts']} timeouts, {s['errors']} errors")
@@ -0,0 +1,242 @@
+# Compiled tool registry shared by ChatFunctions and ChatSQL.
+#
+# Each tool (a Pydantic model, or a `tools`-style dict with a JSON-schema
+# "parameters" block) is compiled once into a Pydantic validator and a JSON
+# schema. The registry then builds a single schema describing every valid
+# tool call, which is passed to Ollama's `format=` parameter so the model can
+# only produce well-formed calls. ParseStats counts malformed responses and
+# retries so the effect can be measured.
+
+import inspect
+import json
+from typing import Any, Optional
+
+from pydantic import Field, ValidationError, create_model
+
+JSON_TYPES = {
+    "string": str,
+    "integer": int,
+    "number": float,
+    "boolean": bool,
+    "array": list,
+    "object": dict,
+}
+
+
+# Schema for a plain reply when no tool call is wanted
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {"response": {"type": "string"}},
+    "required": ["response"],
+}
+
+
+class MalformedToolCall(ValueError):
+    """The model's response is not a valid tool call for this registry."""
+
+
+class CompiledTool:
+    """A tool's validator (Pydantic model), JSON schema and optional function."""
+
+    def __init__(self, name, description, model, function=None):
+        self.name = name
+        self.description = description
+        self.model = model
+        self.function = function
+        self.schema = model.model_json_schema()
+
+
+def model_from_json_schema(name, parameters):
+    """Builds a Pydantic model from a JSON-schema "parameters" object."""
+    required = set(parameters.get("required", []))
+    fields = {}
+    for field_name, spec in parameters.get("properties", {}).items():
+        field_type = JSON_TYPES.get(spec.get("type"), Any)
+        description = spec.get("description")
+        if field_name in required:
+            fields[field_name] = (field_type, Field(..., description=description))
+        else:
+            fields[field_name] = (Optional[field_type], Field(None, description=description))
+    return create_model(name, **fields)
+
+
+class ParseStats:
+    """Counts model responses that failed to parse and the retries they caused."""
+
+    def __init__(self):
+        self.responses = 0
+        self.malformed = 0
+        self.retries = 0
+
+    def record(self, ok):
+        self.responses += 1
+        if not ok:
+            self.malformed += 1
+
+    @property
+    def malformed_rate(self):
+        return self.malformed / self.responses if self.responses else 0.0
+
+    def report(self, label="Tool calls"):
+        print(f"{label}: {self.responses} responses, {self.malformed} malformed "
+              f"({self.malformed_rate:.1%}), {self.retries} retries")
+
+
+class ToolRegistry:
+    """Tools compiled once into validators, plus the tool-call schema for `format=`."""
+
+    def __init__(self):
+        self.tools = {}
+        self.stats = ParseStats()
+        self._call_schemas = {}
+
+    @classmethod
+    def from_available_tools(cls, available_tools):
+        """Builds a registry from {name: {"function": f, "schema": PydanticModel}}."""
+        registry = cls()
+        for name, tool_info in available_tools.items():
+            registry.register_model(name, tool_info["schema"], tool_info.get("function"))
+        return registry
+
+    @classmethod
+    def from_tool_dicts(cls, tools):
+        """Builds a registry from [{"name", "description", "parameters"}] dicts."""
+        registry = cls()
+        for tool in tools:
+            registry.register_dict(tool)
+        return registry
+
+    def register_model(self, name, model, function=None, description=None):
+        description = description or inspect.cleandoc(model.__doc__ or "")
+        self.tools[name] = CompiledTool(name, description, model, function)
+        self._call_schemas.clear()
+
+    def register_dict(self, tool, function=None):
+        model_name = "".join(part.title() for part in tool["name"].split("_")) + "Request"
+        model = model_from_json_schema(model_name, tool.get("parameters", {}))
+        self.tools[tool["name"]] = CompiledTool(tool["name"], tool["description"], model, function)
+        self._call_schemas.clear()
+
+    # --- Schemas ---
+
+    def call_schema(self, args_key="tool_input", allow_response=False, require_args=True, allow_multiple=False):
+        """
+        JSON schema matching exactly one valid tool call, for Ollama's
+        `format=` parameter. With allow_response a plain {"response": text}
+        reply is also allowed. With require_args=False arguments may be left
+        out, so missing ones can still be gathered from the user instead of
+        being invented by the model. With allow_multiple several calls may
+        be made at once as {"tool_calls": [call, ...]}; use parse_calls().
+        """
+        key = (args_key, allow_response, require_args, allow_multiple)
+        if key not in self._call_schemas:
+            options = []
+            for tool in self.tools.values():
+                args_schema = {k: v for k, v in tool.schema.items() if k not in ("title", "description")}
+                if not require_args:
+                    args_schema.pop("required", None)
+                options.append({
+                    "type": "object",
+                    "properties": {
+                        "tool_name": {"type": "string", "const": tool.name},
+                        args_key: args_schema,
+                    },
+                    "required": ["tool_name", args_key],
+                })
+            if allow_multiple:
+                options.append({
+                    "type": "object",
+                    "properties": {"tool_calls": {"type": "array", "items": {"anyOf": list(options)}, "minItems": 1}},
+                    "required": ["tool_calls"],
+                })
+            if allow_response:
+                options.append(RESPONSE_SCHEMA)
+            self._call_schemas[key] = {"anyOf": options}
+        return self._call_schemas[key]
+
+    def prompt_block(self):
+        """Tool names, descriptions and parameter schemas for the system prompt."""
+        return "\n".join(
+            f"- {tool.name}: " + json.dumps(
+                {"name": tool.name, "description": tool.description, "parameters": tool.schema},
+                indent=2,
+            )
+            for tool in self.tools.values()
+        )
+
+    def ollama_tools(self):
+        """The tools in the format of Ollama's native `tools=` parameter."""
+        return [
+            {
+                "type": "function",
+                "function": {"name": tool.name, "description": tool.description, "parameters": tool.schema},
+            }
+            for tool in self.tools.values()
+        ]
+
+    # --- Parsing and validation ---
+
+    def parse(self, raw_response, args_key="tool_input", validate=False):
+        """
+        Parses a response produced with call_schema(). Returns
+        (tool_name, arguments), or (None, text) for a plain response.
+        With validate=True the arguments are also checked by the tool's
+        validator and returned as its model_dump().
+        Raises MalformedToolCall and records the outcome in self.stats.
+        """
+        return self._recorded(lambda data: self._parse_call(data, args_key, validate), raw_response)
+
+    def parse_calls(self, raw_response, args_key="tool_input", validate=False):
+        """
+        Like parse(), for a schema built with allow_multiple=True. Returns a
+        list of (tool_name, arguments), or [(None, text)] for a plain response.
+        """
+        def parse_data(data):
+            if isinstance(data, dict) and "tool_calls" in data:
+                calls = data["tool_calls"]
+                if not isinstance(calls, list) or not calls:
+                    raise MalformedToolCall("'tool_calls' must be a non-empty list")
+                return [self._parse_call(call, args_key, validate) for call in calls]
+            return [self._parse_call(data, args_key, validate)]
+        return self._recorded(parse_data, raw_response)
+
+    def _recorded(self, parse_data, raw_response):
+        """Runs parse_data on the decoded JSON, recording the outcome and raising MalformedToolCall."""
+        try:
+            result = parse_data(json.loads(raw_response))
+        except (json.JSONDecodeError, ValidationError, MalformedToolCall) as e:
+            self.stats.record(False)
+            if isinstance(e, json.JSONDecodeError):
+                raise MalformedToolCall(f"invalid JSON: {e}") from e
+            if isinstance(e, ValidationError):
+                raise MalformedToolCall(f"invalid arguments: {e}") from e
+            raise
+        self.stats.record(True)
+        return result
+
+    def _parse_call(self, data, args_key, validate):
+        if not isinstance(data, dict):
+            raise MalformedToolCall(f"expected a JSON object, got {type(data).__name__}")
+        if "response" in data and "tool_name" not in data:
+            return None, str(data["response"])
+        tool_name = data.get("tool_name")
+        if tool_name not in self.tools:
+            raise MalformedToolCall(f"unknown tool '{tool_name}'")
+        arguments = data.get(args_key) or {}
+        if not isinstance(arguments, dict):
+            raise MalformedToolCall(f"'{args_key}' must be an object")
+        if validate:
+            arguments = self.validate(tool_name, arguments).model_dump()
+        return tool_name, arguments
+
+    def accepts_field(self, name, value):
+        """
+        on_field callback for StreamingJSON: rejects an unknown tool_name as
+        soon as it has streamed, before the arguments are generated.
+        """
+        return name != "tool_name" or value in self.tools
+
+    def validate(self, tool_name, arguments):
+        """Validates the arguments with the tool's compiled model (raises ValidationError)."""
+        return self.tools[tool_name].model(**arguments)
+
@@ -0,0 +1,309 @@
+# Persistent, memory-mapped vector store for multi-document RAG.
+#
+# Chunk embeddings and texts live on disk in append-only segments; each add()
+# writes one new segment:
+#   seg-NNNNNN.vec.npy   float32 [rows, dim], L2-normalized embeddings
+#   seg-NNNNNN.doc.npy   int32   [rows], document id of each row
+#   seg-NNNNNN.off.npy   int64   [rows + 1], byte offsets into the text file
+#   seg-NNNNNN.txt       UTF-8 chunk texts, back to back
+# manifest.json lists the segments, the documents (source -> id, plus an
+# optional fingerprint of the indexed text) and the deleted document ids
+# (tombstones). Opening the store only maps these
+# files, so it is instant at any size; pages are read on demand by search.
+#
+# search() is a vectorized dot product per segment (cosine, since rows are
+# normalized) with deleted rows masked out and np.argpartition for top-k.
+# For corpora larger than RAM, build_ivf() adds a coarse k-means index
+# (an inverted file): each row is assigned to its nearest centroid, and a
+# search only reads the rows in the `nprobe` closest lists. compact() rewrites
+# everything into one segment without deleted rows, copying the live rows a
+# block at a time into a memory-mapped output, so it needs little RAM.
+
+import json
+import os
+
+import numpy as np
+
+MANIFEST = "manifest.json"
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class Segment:
+    """One append-only segment, memory-mapped read-only."""
+
+    def __init__(self, directory, name):
+        self.name = name
+        base = os.path.join(directory, name)
+        self.vectors = np.load(base + ".vec.npy", mmap_mode="r")
+        self.doc_ids = np.load(base + ".doc.npy", mmap_mode="r")
+        self.offsets = np.load(base + ".off.npy", mmap_mode="r")
+        self._text_path = base + ".txt"
+        self._text = None
+        ivf_path = base + ".ivf.npy"
+        self.lists = np.load(ivf_path, mmap_mode="r") if os.path.exists(ivf_path) else None
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def text(self, row):
+        if self._text is None:
+            size = os.path.getsize(self._text_path)
+            self._text = np.memmap(self._text_path, dtype=np.uint8, mode="r") if size else np.zeros(0, np.uint8)
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return self._text[start:end].tobytes().decode("utf-8")
+
+    @staticmethod
+    def write(directory, name, vectors, doc_ids, texts, lists=None):
+        base = os.path.join(directory, name)
+        encoded = [t.encode("utf-8") for t in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(b) for b in encoded])
+        with open(base + ".txt", "wb") as f:
+            for b in encoded:
+                f.write(b)
+        np.save(base + ".vec.npy", np.ascontiguousarray(vectors, dtype=np.float32))
+        np.save(base + ".doc.npy", np.asarray(doc_ids, dtype=np.int32))
+        np.save(base + ".off.npy", offsets)
+        if lists is not None:
+            np.save(base + ".ivf.npy", np.asarray(lists, dtype=np.int32))
+
+    @staticmethod
+    def write_rows(directory, name, sources, rows, dim, with_lists, block=65536):
+        """
+        Writes `rows` selected rows of the (segment, row indices) pairs in
+        `sources` to a new segment, `block` rows at a time, through
+        memory-mapped output arrays.
+        """
+        base = os.path.join(directory, name)
+        open_memmap = np.lib.format.open_memmap
+        vectors = open_memmap(base + ".vec.npy", mode="w+", dtype=np.float32, shape=(rows, dim))
+        doc_ids = open_memmap(base + ".doc.npy", mode="w+", dtype=np.int32, shape=(rows,))
+        offsets = open_memmap(base + ".off.npy", mode="w+", dtype=np.int64, shape=(rows + 1,))
+        lists = open_memmap(base + ".ivf.npy", mode="w+", dtype=np.int32, shape=(rows,)) if with_lists else None
+        offsets[0] = 0
+        position = 0
+        with open(base + ".txt", "wb") as text:
+            for segment, keep in sources:
+                for i in range(0, len(keep), block):
+                    picked = keep[i:i + block]
+                    end = position + len(picked)
+                    vectors[position:end] = segment.vectors[picked]
+                    doc_ids[position:end] = segment.doc_ids[picked]
+                    if lists is not None:
+                        lists[position:end] = segment.lists[picked]
+                    for j, row in enumerate(picked):
+                        encoded = segment.text(int(row)).encode("utf-8")
+                        text.write(encoded)
+                        offsets[position + j + 1] = offsets[position + j] + len(encoded)
+                    position = end
+        for array in (vectors, doc_ids, offsets, lists):
+            if array is not None:
+                array.flush()
+        del vectors, doc_ids, offsets, lists  # Close the maps before the files are re-opened read-only
+
+    def files(self, directory):
+        base = os.path.join(directory, self.name)
+        return [base + ext for ext in (".vec.npy", ".doc.npy", ".off.npy", ".txt", ".ivf.npy")]
+
+
+class VectorStore:
+    """
+    Documents (identified by a source string such as a URL) made of chunk
+    texts and their embeddings. Re-adding a source replaces it.
+    """
+
+    def __init__(self, directory, dim=None):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, MANIFEST)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        else:
+            manifest = {"dim": dim, "next_segment": 0, "next_doc": 0, "segments": [], "documents": {},
+                        "fingerprints": {}, "deleted": []}
+        self.manifest = manifest
+        self.deleted = set(manifest["deleted"])
+        self.segments = [Segment(directory, name) for name in manifest["segments"]]
+        centroids = os.path.join(directory, "ivf_centroids.npy")
+        self.centroids = np.load(centroids) if os.path.exists(centroids) else None
+
+    @property
+    def dim(self):
+        return self.manifest["dim"]
+
+    @property
+    def documents(self):
+        """{source: document id} for the live documents."""
+        return dict(self.manifest["documents"])
+
+    def fingerprint(self, source):
+        """The fingerprint given when `source` was added, or None."""
+        return self.manifest["fingerprints"].get(source)
+
+    def __len__(self):
+        return sum(len(s) for s in self.segments) - self._deleted_rows()
+
+    def _deleted_rows(self):
+        if not self.deleted:
+            return 0
+        deleted = np.fromiter(self.deleted, dtype=np.int32)
+        return int(sum(np.isin(s.doc_ids, deleted).sum() for s in self.segments))
+
+    def _save_manifest(self):
+        self.manifest["deleted"] = sorted(self.deleted)
+        path = os.path.join(self.directory, MANIFEST)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp, path)
+
+    # --- Updates ---
+
+    def add(self, source, chunks, embeddings, fingerprint=None):
+        """
+        Adds (or replaces) a document's chunks and their embeddings as a new
+        segment. `fingerprint` (e.g. a hash of the text) lets callers skip
+        re-embedding unchanged documents.
+        """
+        vectors = normalize(embeddings)
+        if len(chunks) != len(vectors):
+            raise ValueError("Need exactly one embedding per chunk.")
+        if self.dim is None:
+            self.manifest["dim"] = int(vectors.shape[1])
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Embedding size {vectors.shape[1]} does not match the store's {self.dim}.")
+        self.delete(source, save=False)
+
+        doc_id = self.manifest["next_doc"]
+        self.manifest["next_doc"] += 1
+        name = f"seg-{self.manifest['next_segment']:06d}"
+        self.manifest["next_segment"] += 1
+        lists = self._assign(vectors) if self.centroids is not None else None
+        Segment.write(self.directory, name, vectors, np.full(len(chunks), doc_id), chunks, lists)
+
+        # The manifest is written last, so a crash mid-add leaves only unreferenced files
+        self.manifest["segments"].append(name)
+        self.manifest["documents"][source] = doc_id
+        if fingerprint is not None:
+            self.manifest["fingerprints"][source] = fingerprint
+        self._save_manifest()
+        self.segments.append(Segment(self.directory, name))
+        return doc_id
+
+    def delete(self, source, save=True):
+        """Tombstones a document; its rows are skipped by search and dropped by compact()."""
+        doc_id = self.manifest["documents"].pop(source, None)
+        if doc_id is None:
+            return False
+        self.manifest["fingerprints"].pop(source, None)
+        self.deleted.add(doc_id)
+        if save:
+            self._save_manifest()
+        return True
+
+    def compact(self):
+        """Rewrites all live rows into a single segment and removes the old files."""
+        deleted = np.fromiter(self.deleted, dtype=np.int32)
+        sources = [(segment, np.flatnonzero(~np.isin(segment.doc_ids, deleted))) for segment in self.segments]
+        old = self.segments
+        name = f"seg-{self.manifest['next_segment']:06d}"
+        self.manifest["next_segment"] += 1
+        with_lists = self.centroids is not None and all(segment.lists is not None for segment in old)
+        Segment.write_rows(self.directory, name, sources, sum(len(keep) for _, keep in sources),
+                           self.dim or 0, with_lists)
+        self.manifest["segments"] = [name]
+        self.deleted = set()
+        self._save_manifest()
+        self.segments = [Segment(self.directory, name)]
+        if self.centroids is not None and self.segments[0].lists is None:
+            self._write_lists(self.segments[0])
+        for segment in old:
+            for path in segment.files(self.directory):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    # --- Coarse (IVF) index ---
+
+    def build_ivf(self, nlist=256, sample=50_000, iterations=10, seed=0):
+        """Trains `nlist` k-means centroids on a sample of rows and assigns every row to one."""
+        rng = np.random.default_rng(seed)
+        total = sum(len(s) for s in self.segments)
+        if total == 0:
+            return
+        picks = np.sort(rng.choice(total, size=min(sample, total), replace=False))
+        starts = np.cumsum([0] + [len(s) for s in self.segments])
+        rows = [np.asarray(s.vectors[picks[(picks >= lo) & (picks < hi)] - lo])
+                for s, lo, hi in zip(self.segments, starts[:-1], starts[1:])]
+        data = np.concatenate(rows)
+        nlist = min(nlist, len(data))
+        centroids = data[rng.choice(len(data), size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assign = np.argmax(data @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = data[assign == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = normalize(centroids)
+        self.centroids = centroids
+        np.save(os.path.join(self.directory, "ivf_centroids.npy"), centroids)
+        for segment in self.segments:
+            self._write_lists(segment)
+
+    def _assign(self, vectors, batch=65536):
+        out = np.empty(len(vectors), dtype=np.int32)
+        for i in range(0, len(vectors), batch):
+            out[i:i + batch] = np.argmax(np.asarray(vectors[i:i + batch]) @ self.centroids.T, axis=1)
+        return out
+
+    def _write_lists(self, segment):
+        np.save(os.path.join(self.directory, segment.name + ".ivf.npy"), self._assign(segment.vectors))
+        segment.lists = np.load(os.path.join(self.directory, segment.name + ".ivf.npy"), mmap_mode="r")
+
+    # --- Search ---
+
+    def search(self, query_embedding, k=4, nprobe=None):
+        """
+        Returns up to k (score, source, text) tuples, best first. With an IVF
+        index and `nprobe`, only rows in the nprobe nearest lists are scored.
+        """
+        if not self.segments:
+            return []
+        query = normalize(query_embedding).reshape(-1)
+        deleted = np.fromiter(self.deleted, dtype=np.int32)
+        probes = None
+        if nprobe and self.centroids is not None:
+            probes = np.argsort(self.centroids @ query)[::-1][:nprobe]
+
+        candidates = []  # (score, segment index, row)
+        for s, segment in enumerate(self.segments):
+            if not len(segment):
+                continue
+            if probes is not None and segment.lists is not None:
+                rows = np.flatnonzero(np.isin(segment.lists, probes))
+                if not len(rows):
+                    continue
+                scores = np.asarray(segment.vectors[rows]) @ query
+            else:
+                rows = None
+                scores = np.asarray(segment.vectors) @ query
+            if len(deleted):
+                doc_ids = segment.doc_ids if rows is None else segment.doc_ids[rows]
+                scores[np.isin(doc_ids, deleted)] = -np.inf
+            top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+            for i in top:
+                if np.isfinite(scores[i]):
+                    candidates.append((float(scores[i]), s, int(i if rows is None else rows[i])))
+
+        sources = {doc_id: source for source, doc_id in self.manifest["documents"].items()}
+        results = []
+        for score, s, row in sorted(candidates, reverse=True)[:k]:
+            segment = self.segments[s]
+            results.append((score, sources.get(int(segment.doc_ids[row])), segment.text(row)))
+        return results
@@ -0,0 +1,59 @@
+# Stop conditions of HFStreaming, driven by a text-only tokenizer (no model needed).
+
+import os
+import sys
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from HFStreaming import BoxedAnswer, TextStoppingCriteria, boxed_answer  # noqa: E402
+
+
+class CharTokenizer:
+    """One token per character: ids are code points."""
+
+    def encode(self, text):
+        return [ord(c) for c in text]
+
+    def decode(self, ids, skip_special_tokens=True):
+        return "".join(chr(int(i)) for i in ids)
+
+
+def stop_point(prompt, completion):
+    """Feeds the completion one token at a time; returns (text so far, reason) at the first stop, or None."""
+    tokenizer = CharTokenizer()
+    ids = tokenizer.encode(prompt)
+    criteria = TextStoppingCriteria(tokenizer, len(ids), [BoxedAnswer()])
+    for token in tokenizer.encode(completion):
+        ids.append(token)
+        if criteria(torch.tensor([ids]), None).item():
+            return tokenizer.decode(ids[len(prompt):]), criteria.reason
+    return None
+
+
+def test_empty_boxed_does_not_stop():
+    completion = "Remember to put the answer in \\boxed{} at the end. 54*24 = 1296"
+    assert stop_point("Solve 54*24, answer in \\boxed{}.", completion) is None
+
+
+def test_filled_boxed_stops_when_closed():
+    completion = "Put it in \\boxed{ }. 54*24 = 1296, so \\boxed{1296} and more text"
+    text, reason = stop_point("Solve 54*24, answer in \\boxed{}.", completion)
+    assert text.endswith("\\boxed{1296}")
+    assert reason == "boxed answer"
+
+
+@pytest.mark.parametrize("text, answer", [
+    ("\\boxed{42}", "42"),
+    ("\\boxed{\\frac{1}{2}} and \\boxed{3}", "\\frac{1}{2}"),
+    ("\\boxed{} then \\boxed {  7 }", "  7 "),
+    ("\\boxed{}", None),
+    ("\\boxed{\\frac{1}{2}", None),
+    ("no answer", None),
+])
+def test_boxed_answer(text, answer):
+    assert boxed_answer(text) == answer
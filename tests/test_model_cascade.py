@@ -0,0 +1,192 @@
+# Escalation checks of ModelCascade (no model needed).
+
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("ollama")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ModelCascade import ModelCascade, Tier, accepts_logprobs  # noqa: E402
+
+
+class FakeClient:
+    """
+    Replies to every chat with the next queued (text, done_reason, logprobs).
+    Streams send the text 4 characters per chunk; `streams` records, per
+    call, how many chunks were read and whether the stream was closed.
+    """
+
+    def __init__(self, replies=()):
+        self.replies = list(replies)
+        self.calls = []
+        self.streams = []
+
+    def chat(self, model, messages, stream=False, **kwargs):
+        self.calls.append((model, kwargs))
+        text, done_reason, logprobs = self.replies.pop(0)
+        if stream:
+            return self._stream(text, done_reason)
+        return {"message": {"role": "assistant", "content": text}, "done_reason": done_reason,
+                "logprobs": logprobs}
+
+    def _stream(self, text, done_reason):
+        state = {"read": 0, "closed": False}
+        self.streams.append(state)
+        pieces = [text[i:i + 4] for i in range(0, len(text), 4)] or [""]
+        try:
+            for n, piece in enumerate(pieces):
+                state["read"] += 1
+                done = n == len(pieces) - 1
+                yield {"message": {"role": "assistant", "content": piece}, "done": done,
+                       "done_reason": done_reason if done else None}
+        finally:
+            state["closed"] = True
+
+
+@pytest.fixture
+def cascade():
+    return ModelCascade([Tier("small", min_mean_logprob=-1.0), Tier("large")], client=FakeClient())
+
+
+def check(cascade, text, done_reason="stop", logprobs=None, validate=None, tier=0):
+    response = {"message": {"content": text}, "done_reason": done_reason}
+    return cascade.check(cascade.tiers[tier], text, response, logprobs, validate)
+
+
+def test_accepts_a_good_reply(cascade):
+    assert check(cascade, "Paris is the capital of France.", logprobs=[{"logprob": -0.2}]) is None
+
+
+def test_invalid_when_validate_raises(cascade):
+    assert check(cascade, "not json", validate=json.loads) == "invalid"
+    assert check(cascade, '{"city": "Paris"}', validate=json.loads) is None
+
+
+def test_length(cascade):
+    assert check(cascade, "   ") == "length"
+    assert check(cascade, "The answer is", done_reason="length") == "length"
+
+
+def test_truncation_check_can_be_disabled(cascade):
+    tier = Tier("small", check_truncated=False)
+    assert cascade.check(tier, "The answer is", {"done_reason": "length"}, None) is None
+
+
+@pytest.mark.parametrize("text", [
+    "I'm sorry, but I can't help with that.",
+    "I’m sorry, I cannot answer that.",
+    "Sorry, I don't know.",
+    "I apologize, but I am unable to do that.",
+    "I'm afraid I can't do that.",
+    "I cannot provide that information.",
+    "I do not know the answer.",
+    "Unfortunately, I'm not able to browse the web.",
+    "As an AI, I have no opinions.",
+])
+def test_refusal(cascade, text):
+    assert check(cascade, text) == "refusal"
+
+
+@pytest.mark.parametrize("text", [
+    "I'm sorry to hear that! Here is how to reset your password: ...",
+    "Sorry for the wait. The weather in Paris is sunny.",
+    "I can help with that. The capital of France is Paris.",
+    "I know the answer: 42.",
+    "The model said \"I can't\" only later in the reply.",
+])
+def test_not_refusal(cascade, text):
+    assert check(cascade, text) is None
+
+
+def test_refusal_check_can_be_disabled(cascade):
+    tier = Tier("small", check_refusal=False)
+    assert cascade.check(tier, "I can't do that.", {}, None) is None
+
+
+def test_logprob_threshold(cascade):
+    assert check(cascade, "Maybe Lyon?", logprobs=[{"logprob": -2.0}, {"logprob": -1.0}]) == "logprob"
+    assert check(cascade, "Paris.", logprobs=[{"logprob": -0.5}, {"logprob": -1.0}]) is None
+    assert check(cascade, "Paris.", logprobs=None) is None  # Server sent none
+    assert check(cascade, "Maybe Lyon?", logprobs=[{"logprob": -5.0}], tier=1) is None  # No threshold
+
+
+def test_chat_escalates_and_asks_for_logprobs():
+    client = FakeClient([("I'm sorry, I can't help.", "stop", None), ("Paris.", "stop", None)])
+    cascade = ModelCascade([Tier("small", min_mean_logprob=-1.0), Tier("large")], client=client)
+    response = cascade.chat([{"role": "user", "content": "Capital of France?"}])
+    assert response["message"]["content"] == "Paris."
+    assert cascade.last_tier == 1
+    assert cascade.stats[0].escalated == {"refusal": 1}
+    assert [model for model, _ in client.calls] == ["small", "large"]
+    assert ("logprobs" in client.calls[0][1]) == accepts_logprobs(client)
+    assert "logprobs" not in client.calls[1][1]
+
+
+def test_logprobs_not_sent_to_a_client_without_them():
+    class OldClient:
+        def chat(self, model, messages, stream=False, options=None, keep_alive=None):
+            return {"message": {"content": "Paris."}, "done_reason": "stop"}
+
+    assert not accepts_logprobs(OldClient())
+    cascade = ModelCascade([Tier("small", min_mean_logprob=-1.0), Tier("large")], client=OldClient())
+    assert cascade.chat([{"role": "user", "content": "Capital of France?"}])["message"]["content"] == "Paris."
+    assert cascade.last_tier == 0
+
+
+LONG_ANSWER = "Paris is the capital of France. " * 8
+
+
+def streaming_cascade(*replies):
+    client = FakeClient([(text, "stop", None) for text in replies])
+    return ModelCascade([Tier("small", decide_chars=32), Tier("large")], client=client), client
+
+
+def test_stream_escalates_a_refusal_on_its_opening():
+    cascade, client = streaming_cascade("I'm sorry, but I can't help with that. " * 8, LONG_ANSWER)
+    text = "".join(chunk["message"]["content"] for chunk in cascade.chat([], stream=True))
+    assert text == LONG_ANSWER
+    assert cascade.last_tier == 1
+    assert cascade.stats[0].escalated == {"refusal": 1}
+    small = client.streams[0]
+    assert small["closed"] and small["read"] < len(LONG_ANSWER) // 4  # Cancelled early
+
+
+def test_stream_flushes_a_lower_tier_reply_once_judged():
+    cascade, client = streaming_cascade(LONG_ANSWER)
+    stream = cascade.chat([], stream=True)
+    first = next(stream)
+    assert first["message"]["content"] == LONG_ANSWER[:4]
+    assert client.streams[0]["read"] <= 9  # About 32 characters are read before anything is released
+    rest = "".join(chunk["message"]["content"] for chunk in stream)
+    assert first["message"]["content"] + rest == LONG_ANSWER
+    assert cascade.last_tier == 0
+    assert [model for model, _ in client.calls] == ["small"]
+
+
+def test_stream_accepts_a_short_complete_reply():
+    cascade, client = streaming_cascade("Paris.")
+    assert "".join(chunk["message"]["content"] for chunk in cascade.chat([], stream=True)) == "Paris."
+    assert cascade.last_tier == 0
+
+
+def test_stream_with_validate_stops_once_the_reply_validates():
+    call = '{"tool_name": "get_customer_by_id", "parameters": {"customer_id": 4}}'
+    cascade, client = streaming_cascade(call + "\n\n\n" + " " * 40, call)
+    text = "".join(chunk["message"]["content"] for chunk in cascade.chat([], stream=True, validate=json.loads))
+    assert json.loads(text) == json.loads(call)
+    assert cascade.last_tier == 0
+    small = client.streams[0]
+    assert small["closed"] and small["read"] == -(-len(call) // 4)
+
+
+def test_stream_with_validate_escalates_an_invalid_reply():
+    call = '{"tool_name": "delete_customer", "parameters": {"customer_id": 9}}'
+    cascade, client = streaming_cascade('{"tool_name": "delete_customer", "parameters": {', call)
+    text = "".join(chunk["message"]["content"] for chunk in cascade.chat([], stream=True, validate=json.loads))
+    assert text == call
+    assert cascade.last_tier == 1
+    assert cascade.stats[0].escalated == {"invalid": 1}
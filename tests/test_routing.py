@@ -0,0 +1,74 @@
+# Routing of obvious requests in ChatFunctions and ChatSQL (no model needed).
+
+import importlib
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("ollama")
+pytest.importorskip("pydantic")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="module")
+def chat_module():
+    """Imports a chat script. Its caches, database and model clients are only created on first use."""
+    return importlib.import_module
+
+
+@pytest.mark.parametrize("name", ["ChatFunctions", "ChatSQL"])
+def test_import_creates_no_files(tmp_path, monkeypatch, name):
+    monkeypatch.chdir(tmp_path)
+    importlib.reload(importlib.import_module(name))
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize("text, city", [
+    ("What's the weather in London?", "London"),
+    ("weather in New York today", "New York"),
+    ("what is the weather like in Rio de Janeiro", "Rio de Janeiro"),
+    ("how is the weather in St. Louis right now", "St. Louis"),
+])
+def test_weather_routes_city(chat_module, text, city):
+    router = chat_module("ChatFunctions").router
+    assert router.route(text) == ("get_weather", {"city": city})
+
+
+@pytest.mark.parametrize("text", [
+    "what's the weather in London tomorrow",
+    "weather in Paris and Rome",
+    "weather in Oslo this weekend",
+    "weather in paris or somewhere warm",
+    "how hot is the sun in July",
+    "is it raining in Paris or Rome",
+])
+def test_weather_leaves_unclear_requests_to_the_model(chat_module, text):
+    assert chat_module("ChatFunctions").router.route(text) is None
+
+
+@pytest.mark.parametrize("text, call", [
+    ("add customer Ann Lee from New York",
+     ("add_new_customer", {"first_name": "Ann", "last_name": "Lee", "city": "New York"})),
+    ("add a new customer Bo Chen in Rio de Janeiro",
+     ("add_new_customer", {"first_name": "Bo", "last_name": "Chen", "city": "Rio de Janeiro"})),
+    ("change the city of customer 5 to San Francisco",
+     ("update_customer_city", {"customer_id": "5", "new_city": "San Francisco"})),
+    ("move customer #12 to Berlin", ("update_customer_city", {"customer_id": "12", "new_city": "Berlin"})),
+    ("get customer 42", ("get_customer_by_id", {"customer_id": "42"})),
+])
+def test_sql_routes(chat_module, text, call):
+    assert chat_module("ChatSQL").router.route(text) == call
+
+
+@pytest.mark.parametrize("text", [
+    "add customer Ann Lee from Rome and Bob Day from Oslo",
+    "add customer Ann Lee from rome",
+    "move customer 5 to Paris tomorrow",
+    "change the city of customer 5 to Berlin or Munich",
+    "customer 3 moved to Berlin",
+    "please add a new customer",
+])
+def test_sql_writes_need_an_exact_pattern(chat_module, text):
+    assert chat_module("ChatSQL").router.route(text) is None